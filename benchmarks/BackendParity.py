@@ -0,0 +1,68 @@
+# Accuracy-parity and throughput check of the sentiment inference backends against the fp32 model
+# Usage: python BackendParity.py [--backends torch-int8 onnx] [--limit 1000] [--tolerance 0.01]
+import os
+import sys
+import time
+import argparse
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models/sentiment_analysis'))
+import Backends
+import ML_Anal
+
+data_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data/balancedmerged.csv')
+label_mapping = {'neutral': 0, 'positive': 1, 'negative': 2}
+
+
+# Function to score every comment with one backend, returns predictions, logits and comments/second
+def run_backend(backend, comments):
+    start_time = time.perf_counter()
+    logits = ML_Anal.predict_logits(comments, backend)
+    elapsed = time.perf_counter() - start_time
+    predictions = [row.index(max(row)) for row in logits]
+    return predictions, logits, len(comments) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sentiment backends against the fp32 model')
+    parser.add_argument('--backends', nargs='+', default=['torch-int8', 'onnx'], choices=list(Backends.backends))
+    parser.add_argument('--limit', type=int, default=None, help='only use the first N labelled comments')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='allowed accuracy drop versus fp32')
+    args = parser.parse_args()
+
+    df = pd.read_csv(data_file)
+    df = df[df['Sentiment'].isin(label_mapping)]
+    if args.limit:
+        df = df.iloc[:args.limit]
+    comments = df['Comment'].astype(str).tolist()
+    labels = df['Sentiment'].map(label_mapping).tolist()
+
+    reference = Backends.load_backend('torch', ML_Anal.model_dir)
+    ML_Anal.predict_logits(comments[:32], reference)
+    ref_predictions, ref_logits, ref_throughput = run_backend(reference, comments)
+    ref_accuracy = sum(p == l for p, l in zip(ref_predictions, labels)) / len(labels)
+    print(f'{len(comments)} comments from {data_file}')
+    print(f'{"backend":<12}{"accuracy":>10}{"agreement":>11}{"max |dlogit|":>14}{"comments/s":>12}{"speedup":>9}')
+    print(f'{"torch":<12}{ref_accuracy:>10.4f}{1:>11.4f}{0:>14.4f}{ref_throughput:>12.1f}{1:>8.2f}x')
+
+    failed = []
+    for name in args.backends:
+        backend = Backends.load_backend(name, ML_Anal.model_dir)
+        # warm-up so one-time graph optimization isn't counted as throughput
+        ML_Anal.predict_logits(comments[:32], backend)
+        predictions, logits, throughput = run_backend(backend, comments)
+        accuracy = sum(p == l for p, l in zip(predictions, labels)) / len(labels)
+        agreement = sum(p == r for p, r in zip(predictions, ref_predictions)) / len(labels)
+        max_diff = max(abs(a - b) for row, ref_row in zip(logits, ref_logits) for a, b in zip(row, ref_row))
+        print(f'{name:<12}{accuracy:>10.4f}{agreement:>11.4f}{max_diff:>14.4f}'
+              f'{throughput:>12.1f}{throughput / ref_throughput:>8.2f}x')
+        if ref_accuracy - accuracy > args.tolerance:
+            failed.append(name)
+
+    if failed:
+        print(f'Accuracy dropped by more than {args.tolerance} for: {", ".join(failed)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# Accuracy/latency trade-off of the sentiment length policies (ML_Anal.length_policy) on the labelled comments:
+# every policy and token cap scores the same comments, compared with the labels and with plain truncation at 512
+# Usage: python LengthPolicyEval.py [--configs truncate:128 head_tail:128 chunk_average:128] [--limit 2000]
+#   [--tolerance 0.005] [--output results/length_policies.json]
+import os
+import sys
+import json
+import time
+import argparse
+import pandas as pd
+
+src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src')
+sys.path.append(src_dir)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models/sentiment_analysis'))
+import ML_Anal
+import Metrics
+
+data_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../data/balancedmerged.csv')
+label_mapping = {'neutral': 0, 'positive': 1, 'negative': 2}
+reference_config = 'truncate:512'
+default_configs = ['truncate:64', 'truncate:128', 'truncate:256', 'head_tail:128', 'head_tail:256',
+                   'chunk_average:128', 'chunk_average:256']
+
+
+def parse_config(config):
+    policy, _, cap = config.partition(':')
+    if policy not in ML_Anal.length_policies or not cap.isdigit():
+        raise argparse.ArgumentTypeError(f'expected POLICY:TOKENS with POLICY in {ML_Anal.length_policies}')
+    return policy, ML_Anal.parse_max_tokens(cap)
+
+
+def macro_f1(predictions, labels):
+    scores = []
+    for label in label_mapping.values():
+        true_positive = sum(p == label and l == label for p, l in zip(predictions, labels))
+        predicted = predictions.count(label)
+        actual = labels.count(label)
+        if predicted and actual and true_positive:
+            precision, recall = true_positive / predicted, true_positive / actual
+            scores.append(2 * precision * recall / (precision + recall))
+        else:
+            scores.append(0.0)
+    return sum(scores) / len(scores)
+
+
+# Function to score every comment with one policy and cap, returns the predictions and the timings
+def run_config(config, input_ids, comments):
+    ML_Anal.length_policy, ML_Anal.max_tokens = parse_config(config)
+    Metrics.reset()
+    start_time = time.perf_counter()
+    logits = ML_Anal.predict_logits(comments, input_ids=input_ids)
+    elapsed = time.perf_counter() - start_time
+    batches, _, longest_batch, _ = Metrics.span_totals['sentiment.batch']
+    tokens = sum(value for (name, _), value in Metrics.counters.items() if name == 'sentiment_tokens')
+    return [row.index(max(row)) for row in logits], {'seconds': elapsed, 'batches': batches,
+                                                     'max_batch_seconds': longest_batch, 'tokens': tokens}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sentiment length policies on the labelled comments')
+    parser.add_argument('--configs', nargs='+', type=parse_config, default=None,
+                        help=f'POLICY:TOKENS to compare (default: {" ".join(default_configs)})')
+    parser.add_argument('--limit', type=int, default=None, help='only use the first N labelled comments')
+    parser.add_argument('--tolerance', type=float, default=0.005,
+                        help='accuracy drop versus truncation at 512 still counted as no loss')
+    parser.add_argument('--output', default=None, help='also write the results to this JSON file')
+    args = parser.parse_args()
+    configs = [f'{policy}:{cap}' for policy, cap in args.configs] if args.configs else default_configs
+
+    df = pd.read_csv(data_file)
+    df = df[df['Sentiment'].isin(label_mapping)].dropna(subset=['Comment'])
+    if args.limit:
+        df = df.iloc[:args.limit]
+    comments = df['Comment'].astype(str).tolist()
+    labels = df['Sentiment'].map(label_mapping).tolist()
+
+    # tokenized once, so only the model time is compared
+    input_ids = ML_Anal.get_tokenizer()(comments, truncation=False, verbose=False)['input_ids']
+    lengths = [len(ids) for ids in input_ids]
+    print(f'{len(comments)} comments from {data_file}')
+    print('comments longer than: ' + ', '.join(
+        f'{cap} tokens {sum(length > cap for length in lengths) / len(lengths):.1%}' for cap in (64, 128, 256, 512)))
+
+    Metrics.enable()
+    ML_Anal.predict_logits(comments[:32], input_ids=input_ids[:32])
+    ref_predictions, ref_timing = run_config(reference_config, input_ids, comments)
+    ref_accuracy = sum(p == l for p, l in zip(ref_predictions, labels)) / len(labels)
+
+    print(f'{"policy":<20}{"accuracy":>10}{"macro F1":>10}{"long acc":>10}{"agreement":>11}'
+          f'{"tokens":>10}{"seconds":>9}{"max batch ms":>14}{"speedup":>9}')
+    results = []
+    for config in [reference_config] + [config for config in configs if config != reference_config]:
+        if config == reference_config:
+            predictions, timing = ref_predictions, ref_timing
+        else:
+            predictions, timing = run_config(config, input_ids, comments)
+        cap = parse_config(config)[1]
+        # accuracy on the comments the policy changes, the rest are scored the same way by every policy
+        long_rows = [index for index, length in enumerate(lengths) if length > cap]
+        long_accuracy = (sum(predictions[i] == labels[i] for i in long_rows) / len(long_rows)) if long_rows else None
+        result = dict(timing, config=config,
+                      accuracy=sum(p == l for p, l in zip(predictions, labels)) / len(labels),
+                      macro_f1=macro_f1(predictions, labels), long_comments=len(long_rows),
+                      long_accuracy=long_accuracy,
+                      agreement=sum(p == r for p, r in zip(predictions, ref_predictions)) / len(labels),
+                      speedup=ref_timing['seconds'] / timing['seconds'])
+        results.append(result)
+        long_text = f'{long_accuracy:.4f}' if long_accuracy is not None else '-'
+        print(f'{config:<20}{result["accuracy"]:>10.4f}{result["macro_f1"]:>10.4f}{long_text:>10}'
+              f'{result["agreement"]:>11.4f}{timing["tokens"]:>10}{timing["seconds"]:>9.2f}'
+              f'{timing["max_batch_seconds"] * 1000:>14.1f}{result["speedup"]:>8.2f}x')
+
+    # the fastest setting that keeps the accuracy of full-length truncation
+    candidates = [result for result in results if ref_accuracy - result['accuracy'] <= args.tolerance]
+    best = max(candidates, key=lambda result: result['speedup'])
+    print(f'Fastest within {args.tolerance} accuracy of {reference_config}: {best["config"]} '
+          f'({best["speedup"]:.2f}x, accuracy {best["accuracy"]:.4f})')
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'data_file': data_file, 'comments': len(comments), 'reference': reference_config,
+                       'tolerance': args.tolerance, 'recommended': best['config'], 'results': results}, file,
+                      indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Throughput of the CRF tagging paths in POSTagging: the old one-predict-call-per-comment path, batched tagging,
+# batched tagging with the comment cache, and with the lexicon fast path (if pos_lexicon.pkl has been built)
+# Usage: python POSBenchmark.py [--comments 100000] [--csv ../data/imbalancedmerged.csv]
+# When --comments is larger than the CSV it is repeated, which makes cache hit rates look better than on a real video
+import os
+import sys
+import time
+import pickle
+import argparse
+import pandas as pd
+
+src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src')
+sys.path.append(src_dir)
+import POSTagging
+import ModelRegistry
+
+
+# the tagging loop POSTagging used before: a feature dict per token and one CRF.predict call per comment
+def tag_legacy(sentences, model):
+    return [model.predict([[POSTagging.get_word_features(sentence, i) for i in range(len(sentence))]])[0]
+            if sentence else [] for sentence in sentences]
+
+
+# Function to run tag_sentences with the given caches switched on, every variant starts cold
+def tag_with(sentences, model, tag_cache, lexicon):
+    POSTagging.word_feature_cache.clear()
+    POSTagging.comment_tag_cache.clear()
+    POSTagging.span_tag_cache.clear()
+    POSTagging.tag_cache_stats.clear()
+    POSTagging.use_tag_cache = tag_cache
+    POSTagging.use_lexicon = lexicon
+    return POSTagging.tag_sentences(sentences, model)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CRF POS tagging throughput')
+    parser.add_argument('--csv', default=os.path.join(src_dir, '../data/imbalancedmerged.csv'))
+    parser.add_argument('--comments', type=int, default=100000, help='comments to tag, the CSV is repeated as needed')
+    parser.add_argument('--maxent-comments', type=int, default=2000,
+                        help='comments for the MaxEnt comparison (NLTK classifies one token at a time, so keep it small)')
+    args = parser.parse_args()
+
+    comments = pd.read_csv(args.csv)['Comment'].dropna().astype(str).tolist()
+    comments = (comments * (args.comments // len(comments) + 1))[:args.comments]
+
+    # the model paths in POSTagging are relative to src
+    os.chdir(src_dir)
+    ModelRegistry.get('punkt')
+    model = ModelRegistry.get('crf_pos_tagger')
+    sentences = [POSTagging.nltk.word_tokenize(comment) for comment in comments]
+    token_count = sum(len(sentence) for sentence in sentences)
+    print(f'{len(sentences)} comments, {token_count} tokens')
+
+    variants = [
+        ('legacy', lambda: tag_legacy(sentences, model)),
+        ('batched', lambda: tag_with(sentences, model, False, False)),
+        ('cached', lambda: tag_with(sentences, model, True, False))
+    ]
+    if os.path.exists(POSTagging.lexicon_path):
+        variants.append(('lexicon', lambda: tag_with(sentences, model, True, True)))
+    else:
+        print(f'{POSTagging.lexicon_path} not found, run models/pos_tagging/build_pos_lexicon.py for the lexicon path')
+
+    reference = None
+    print(f'{"variant":<10}{"seconds":>9}{"tokens/s":>12}{"speedup":>9}{"same tags":>11}'
+          f'{"comment hits":>14}{"span hits":>11}{"CRF tokens":>12}')
+    for name, run in variants:
+        start_time = time.perf_counter()
+        labels = [list(sentence_labels) for sentence_labels in run()]
+        elapsed = time.perf_counter() - start_time
+        if reference is None:
+            reference = (labels, elapsed)
+        same = sum(a == b for sentence, ref in zip(labels, reference[0]) for a, b in zip(sentence, ref)) / token_count
+        stats = POSTagging.tag_cache_stats if name != 'legacy' else {}
+        comment_lookups = stats.get('comment_hits', 0) + stats.get('comment_misses', 0)
+        span_lookups = stats.get('span_hits', 0) + stats.get('span_misses', 0)
+        comment_rate = stats.get('comment_hits', 0) / comment_lookups if comment_lookups else 0
+        span_rate = stats.get('span_hits', 0) / span_lookups if span_lookups else 0
+        crf_tokens = stats.get('crf_tokens', token_count)
+        print(f'{name:<10}{elapsed:>9.2f}{token_count / elapsed:>12.0f}{reference[1] / elapsed:>8.2f}x{same:>11.2%}'
+              f'{comment_rate:>14.1%}{span_rate:>11.1%}{crf_tokens:>12}')
+
+    # MaxEnt: NLTK's classify per token against the compiled sparse-matrix backend
+    maxent_sentences = [sentence for sentence in sentences[:args.maxent_comments] if sentence]
+    maxent_tokens = sum(len(sentence) for sentence in maxent_sentences)
+    with open(POSTagging.maxent_model_path, 'rb') as file:
+        classifier = pickle.load(file)
+    start_time = time.perf_counter()
+    nltk_labels = [[classifier.classify(POSTagging.get_word_features(sentence, i)) for i in range(len(sentence))]
+                   for sentence in maxent_sentences]
+    nltk_elapsed = time.perf_counter() - start_time
+    vectorized = ModelRegistry.get('maxent_pos_tagger')
+    start_time = time.perf_counter()
+    vectorized_labels = vectorized.tag_sentences(maxent_sentences)
+    vectorized_elapsed = time.perf_counter() - start_time
+    same = sum(a == b for sentence, ref in zip(vectorized_labels, nltk_labels)
+               for a, b in zip(sentence, ref)) / maxent_tokens
+    print(f'MaxEnt on {len(maxent_sentences)} comments ({maxent_tokens} tokens), '
+          f'{vectorized.collisions} hashed feature collisions')
+    print(f'{"nltk":<12}{nltk_elapsed:>9.2f} s{maxent_tokens / nltk_elapsed:>12.0f} tokens/s')
+    print(f'{"vectorized":<12}{vectorized_elapsed:>9.2f} s{maxent_tokens / vectorized_elapsed:>12.0f} tokens/s'
+          f'{nltk_elapsed / vectorized_elapsed:>8.1f}x, same tags as nltk: {same:.2%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+# End-to-end benchmark of the analysis stages on synthetic comment corpora: scrape (from the local fake API),
+# dedup (exact and near-duplicate), POS tagging, sentiment and report rendering, each timed on its own.
+# The corpora are drawn from the comment lengths and word frequencies of data/*.csv, with a share of copied
+# comments like a bot flood. Every stage reports throughput, p50/p99 latency of its unit of work (a page, a batch
+# or a report, render counts reports instead of comments) and peak RSS, and the results are saved as JSON so
+# runs of two commits can be compared.
+# Usage: python PipelineBenchmark.py [--sizes 1000 100000 1000000] [--stages scrape dedup pos sentiment render]
+#        python PipelineBenchmark.py --sizes 100000 --compare results/<older run>.json
+# POS tagging and sentiment only run on the first --model-comments comments of a corpus, at full size they
+# would take hours on a CPU. The scrape stage includes the time the fake API takes to build its responses.
+# The sentiment cache is off and the POS and layout caches are emptied before every stage, so runs of two
+# commits compare the models and not cache hits.
+import os
+import sys
+import json
+import time
+import glob
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from collections import Counter
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src')
+sys.path.append(src_dir)
+sys.path.append(os.path.join(src_dir, '../models/sentiment_analysis'))
+import AnalScraper
+import FakeYouTube
+import NearDuplicates
+import POSTagging
+import Visualization
+import ML_Anal
+
+results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+stage_names = ['scrape', 'dedup', 'pos', 'sentiment', 'render']
+
+
+# Comment lengths (in words) and word frequencies of the comments in the CSV files, synthetic comments are drawn
+# from them, so they have realistic lengths and vocabulary but no real sentences
+class CorpusModel:
+    def __init__(self, paths):
+        lengths = []
+        counts = Counter()
+        for path in paths:
+            for comment in pd.read_csv(path)['Comment'].dropna().astype(str):
+                words = comment.split()
+                if words:
+                    lengths.append(len(words))
+                    counts.update(words)
+        self.lengths = np.array(lengths)
+        self.vocabulary = np.array(list(counts), dtype=object)
+        frequencies = np.array(list(counts.values()), dtype=float)
+        self.probabilities = frequencies / frequencies.sum()
+
+    # Function to draw count comments. duplicate_rate of them are copies of an earlier comment, half exact and
+    # half with a number added, like the copy-paste floods dedup is there for
+    def generate(self, count, seed=0, duplicate_rate=0.02):
+        rng = np.random.default_rng(seed)
+        lengths = rng.choice(self.lengths, count)
+        words = rng.choice(self.vocabulary, int(lengths.sum()), p=self.probabilities)
+        comments = []
+        end = 0
+        for length in lengths.tolist():
+            comments.append(' '.join(words[end:end + length]))
+            end += length
+        copies = rng.choice(np.arange(1, count), min(count - 1, int(count * duplicate_rate)), replace=False)
+        for position, index in enumerate(copies.tolist()):
+            source = comments[int(rng.integers(0, index))]
+            comments[index] = source if position % 2 else f'{source} {index % 100}'
+        return comments
+
+
+# Function to get the resident memory of this process in bytes, None where /proc isn't available
+def current_rss():
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Samples the resident memory while a stage runs and keeps the peak (psutil isn't a dependency of the project)
+class MemorySampler:
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = current_rss()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def start(self):
+        if self.peak is not None:
+            self.thread.start()
+
+    # Function to stop sampling, returns the peak in MB
+    def stop(self):
+        if self.peak is None:
+            # no /proc (macOS, Windows), fall back to the peak of the whole process
+            try:
+                import resource
+            except ImportError:
+                return None
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+        self.stopped.set()
+        self.thread.join()
+        rss = current_rss()
+        return round(max(self.peak, rss or 0) / (1024 * 1024), 1)
+
+
+# Function to time a stage. steps is a generator that does one unit of work (a page, a batch, a report) per
+# iteration and yields the number of comments it handled, the time between yields is the latency of the unit
+def measure(steps):
+    sampler = MemorySampler()
+    sampler.start()
+    latencies = []
+    items = 0
+    start_time = time.perf_counter()
+    step_start = start_time
+    for count in steps:
+        now = time.perf_counter()
+        latencies.append(now - step_start)
+        items += count
+        step_start = now
+    elapsed = time.perf_counter() - start_time
+    peak = sampler.stop()
+    latencies = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        'items': items,
+        'units': len(latencies),
+        'seconds': round(elapsed, 4),
+        'throughput': round(items / elapsed, 1) if elapsed else None,
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 3),
+        'peak_rss_mb': peak
+    }
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def scrape_steps(corpus, state):
+    youtube = FakeYouTube.FakeYouTube(len(corpus), texts=corpus, reply_rate=0)
+    comments = []
+    for page in AnalScraper.iter_comment_pages(youtube, 'benchmark', len(corpus), progress=False):
+        comments.extend(page)
+        yield len(page)
+    state['comments'] = comments
+
+
+# dedup the way the streaming pipeline does it, page by page with the seen set and filter kept across pages
+def dedup_steps(corpus, state, page_size=100):
+    comments = state.get('comments') or [{'Comment': comment} for comment in corpus]
+    seen = set()
+    near_filter = NearDuplicates.NearDuplicateFilter()
+    unique = []
+    for page in chunks(comments, page_size):
+        texts = []
+        for comment in page:
+            if comment['Comment'] not in seen:
+                seen.add(comment['Comment'])
+                texts.append(comment['Comment'])
+        unique.extend(text for text, kept in zip(texts, near_filter.keep(texts)) if kept)
+        yield len(page)
+    state['unique'] = unique
+
+
+def pos_steps(texts, state, batch_size):
+    model = POSTagging.get_model()
+    noun_counter = Counter()
+    adj_counter = Counter()
+    for batch in chunks(texts, batch_size):
+        POSTagging.count_nouns_adjectives(batch, model, noun_counter, adj_counter)
+        yield len(batch)
+    state['nouns'] = noun_counter
+    state['adjectives'] = adj_counter
+
+
+def sentiment_steps(texts, state, batch_size):
+    sentiment_counts = Counter()
+    for batch in chunks(texts, batch_size):
+        sentiment_counts.update(ML_Anal.score_comments(batch))
+        yield len(batch)
+    state['sentiment'] = sentiment_counts
+
+
+# one report per slice of the corpus, so every report has its own word clouds and the layout cache starts cold.
+# Its items are reports, not comments
+def render_steps(texts, state, reports, output_dir):
+    for index, batch in enumerate(chunks(texts, max(1, len(texts) // reports))):
+        if index == reports:
+            break
+        if state.get('nouns'):
+            nouns, adjectives = state['nouns'], state['adjectives']
+        else:
+            # without POS results the words of the slice stand in for both clouds
+            nouns = adjectives = Counter(word for text in batch for word in text.split())
+        total = sum(state.get('sentiment', {}).values())
+        shares = [state['sentiment'][label] / total if total else 1 / 3 for label in (1, 0, 2)]
+        Visualization.render_report(nouns.most_common(100), adjectives.most_common(100), *shares,
+                                    'https://www.youtube.com/watch?v=benchmark', f'benchmark_{index}', output_dir)
+        yield 1
+
+
+# Function to load the models before the stages are timed, a model that can't be loaded fails its stage only
+def warm_up(stages):
+    errors = {}
+    if 'pos' in stages:
+        try:
+            POSTagging.count_nouns_adjectives(['warm up'], POSTagging.get_model(), Counter(), Counter())
+        except Exception as e:
+            errors['pos'] = f'{type(e).__name__}: {e}'
+    if 'sentiment' in stages:
+        try:
+            ML_Anal.score_comments(['warm up'])
+        except Exception as e:
+            errors['sentiment'] = f'{type(e).__name__}: {e}'
+    return errors
+
+
+def run_size(model, size, args, errors):
+    print(f'Generating {size} comments...')
+    corpus = model.generate(size, args.seed, args.duplicate_rate)
+    state = {}
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        Visualization.layout_cache_dir = os.path.join(temp_dir, 'wordcloud_cache')
+        for stage in args.stages:
+            # every stage and size starts with cold in-process caches, a warm one would time lookups instead
+            POSTagging.clear_caches()
+            Visualization.layout_cache.clear()
+            if stage in errors:
+                results[stage] = {'error': errors[stage]}
+                print_result(size, stage, results[stage])
+                continue
+            # the model stages run on the deduplicated comments, like in the pipeline
+            texts = (state.get('unique') or corpus)[:args.model_comments]
+            steps = {
+                'scrape': lambda: scrape_steps(corpus, state),
+                'dedup': lambda: dedup_steps(corpus, state),
+                'pos': lambda: pos_steps(texts, state, args.batch_size),
+                'sentiment': lambda: sentiment_steps(texts, state, args.batch_size),
+                'render': lambda: render_steps(texts, state, args.reports, temp_dir)
+            }[stage]
+            try:
+                results[stage] = measure(steps())
+            except Exception as e:
+                results[stage] = {'error': f'{type(e).__name__}: {e}'}
+            print_result(size, stage, results[stage])
+        if 'unique' in state:
+            results['dedup']['kept'] = len(state['unique'])
+    return results
+
+
+def print_result(size, stage, result):
+    if 'error' in result:
+        print(f'{size:>9} {stage:<10} failed: {result["error"]}')
+        return
+    print(f'{size:>9} {stage:<10} {result["items"]:>9} items {result["seconds"]:>9.2f} s '
+          f'{result["throughput"] or 0:>11.0f}/s  p50 {result["p50_ms"]:>9.2f} ms  p99 {result["p99_ms"]:>9.2f} ms  '
+          f'peak {result["peak_rss_mb"]} MB')
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=src_dir, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, cwd=src_dir).stdout.strip()
+        return f'{commit}-dirty' if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+# Function to compare a run with an older one, returns the number of stages that got slower than tolerance allows
+def compare(run, baseline, tolerance):
+    regressions = 0
+    print(f'Compared with {baseline["commit"]} ({baseline["created_at"]}):')
+    for size, stages in run['results'].items():
+        for stage, result in stages.items():
+            old = baseline['results'].get(size, {}).get(stage)
+            if not old or 'error' in old or 'error' in result or not old.get('throughput'):
+                continue
+            speed = result['throughput'] / old['throughput']
+            p99 = result['p99_ms'] / old['p99_ms'] if old['p99_ms'] else 1
+            slower = speed < 1 - tolerance
+            regressions += slower
+            print(f'{size:>9} {stage:<10} throughput {speed:>6.2f}x  p99 {p99:>6.2f}x'
+                  f'{"  REGRESSION" if slower else ""}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every analysis stage on synthetic comment corpora')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--stages', nargs='+', default=stage_names, choices=stage_names)
+    parser.add_argument('--csv', nargs='+', default=sorted(glob.glob(os.path.join(src_dir, '../data/*.csv'))),
+                        help='CSV files the lengths and vocabulary of the corpora are drawn from')
+    parser.add_argument('--model-comments', type=int, default=20000,
+                        help='comments run through POS tagging and sentiment at most')
+    parser.add_argument('--batch-size', type=int, default=256, help='comments per POS or sentiment batch')
+    parser.add_argument('--reports', type=int, default=10, help='reports rendered per corpus')
+    parser.add_argument('--duplicate-rate', type=float, default=0.02, help='share of copied comments')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help=f'JSON file of the results (default: {results_dir}/...)')
+    parser.add_argument('--compare', default=None, help='JSON file of an older run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='throughput drop that counts as a regression')
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.compare = os.path.abspath(args.compare) if args.compare else None
+
+    model = CorpusModel(args.csv)
+    # the model paths in POSTagging and the data paths of the stages are relative to src
+    os.chdir(src_dir)
+    # time the model, not the persistent prediction cache, which would be warm from any earlier run
+    ML_Anal.use_cache = False
+    errors = warm_up(args.stages)
+    run = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'settings': {name: value for name, value in vars(args).items() if name not in ('output', 'compare', 'csv')},
+        'corpus': {'csv': [os.path.basename(path) for path in args.csv], 'comments': int(len(model.lengths)),
+                   'vocabulary': int(len(model.vocabulary))},
+        'results': {}
+    }
+    for size in args.sizes:
+        run['results'][str(size)] = run_size(model, size, args, errors)
+
+    output = args.output or os.path.join(results_dir, f'{run["created_at"].replace(":", "")}_{run["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(run, file, indent=1)
+    print(f'Results saved to {output}')
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            regressions = compare(run, json.load(file), args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Throughput of the text preparation before tagging and scoring: the old path (clean_comment compiling its regex
+# per comment, nltk.word_tokenize for POS tagging and a second pass through the slow Python DistilBertTokenizer
+# for the sentiment model) against the new one (precompiled cleaning and one fast tokenizer pass for both)
+# Usage: python TokenizationBenchmark.py [--comments 100000] [--csv ../data/imbalancedmerged.csv]
+import os
+import re
+import sys
+import time
+import argparse
+import pandas as pd
+
+src_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src')
+sys.path.append(src_dir)
+import TextProcessing
+import ModelRegistry
+
+
+# the cleaning AnalScraper used before, the pattern was compiled on every call
+def clean_legacy(text):
+    emoji_pattern = re.compile(
+        "["
+        u"\U0001F600-\U0001F64F"
+        u"\U0001F300-\U0001F5FF"
+        u"\U0001F680-\U0001F6FF"
+        u"\U0001F1E0-\U0001F1FF"
+        u"\U00002702-\U000027B0"
+        u"\U000024C2-\U0001F251"
+        "]+", flags=re.UNICODE)
+    text = emoji_pattern.sub(r'', text)
+    text = text.replace('\n', ' ').replace('\r', ' ').replace(',', ' ')
+    return text
+
+
+def load_slow_tokenizer():
+    from transformers import DistilBertTokenizer
+    try:
+        return DistilBertTokenizer.from_pretrained('distilbert-base-uncased', local_files_only=True)
+    except OSError:
+        return DistilBertTokenizer.from_pretrained('distilbert-base-uncased')
+
+
+# Function to prepare comments the old way, returns the words and the IDs
+def prepare_legacy(comments, slow_tokenizer):
+    import nltk
+    cleaned = [clean_legacy(comment) for comment in comments]
+    words = [nltk.word_tokenize(comment) for comment in cleaned]
+    input_ids = []
+    for start in range(0, len(cleaned), 32):
+        input_ids.extend(slow_tokenizer(cleaned[start:start + 32], truncation=True,
+                                        max_length=TextProcessing.max_length)['input_ids'])
+    return words, input_ids
+
+
+def prepare_fast(comments):
+    return TextProcessing.tokenize_comments(TextProcessing.clean_comments(comments))
+
+
+def timed(run):
+    start_time = time.perf_counter()
+    result = run()
+    return result, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark comment cleaning and tokenization')
+    parser.add_argument('--csv', default=os.path.join(src_dir, '../data/imbalancedmerged.csv'))
+    parser.add_argument('--comments', type=int, default=100000, help='comments to prepare, the CSV is repeated as needed')
+    args = parser.parse_args()
+
+    comments = pd.read_csv(args.csv)['Comment'].dropna().astype(str).tolist()
+    comments = (comments * (args.comments // len(comments) + 1))[:args.comments]
+
+    # load everything first, model loading isn't part of the comparison
+    os.chdir(src_dir)
+    ModelRegistry.get('punkt')
+    slow_tokenizer = load_slow_tokenizer()
+    TextProcessing.get_tokenizer()
+
+    _, clean_old = timed(lambda: [clean_legacy(comment) for comment in comments])
+    _, clean_new = timed(lambda: TextProcessing.clean_comments(comments))
+    print(f'cleaning {len(comments)} comments: {clean_old:.2f} s -> {clean_new:.2f} s ({clean_old / clean_new:.1f}x)')
+
+    (old_words, old_ids), old_elapsed = timed(lambda: prepare_legacy(comments, slow_tokenizer))
+    (new_words, new_ids), new_elapsed = timed(lambda: prepare_fast(comments))
+    print(f'{"path":<8}{"seconds":>9}{"comments/s":>13}')
+    print(f'{"legacy":<8}{old_elapsed:>9.2f}{len(comments) / old_elapsed:>13.0f}')
+    print(f'{"fast":<8}{new_elapsed:>9.2f}{len(comments) / new_elapsed:>13.0f}  {old_elapsed / new_elapsed:.1f}x')
+
+    # the IDs must be identical once cut like the legacy path, the words may differ from nltk on some punctuation
+    limit = TextProcessing.max_length
+    new_ids = [ids if len(ids) <= limit else ids[:limit - 1] + ids[-1:] for ids in new_ids]
+    same_ids = sum(list(a) == list(b) for a, b in zip(old_ids, new_ids)) / len(comments)
+    same_words = sum(a == b for a, b in zip(old_words, new_words)) / len(comments)
+    print(f'same input IDs: {same_ids:.2%}, same words as nltk: {same_words:.2%}')
+
+
+if __name__ == '__main__':
+    main()
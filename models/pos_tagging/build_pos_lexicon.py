@@ -0,0 +1,58 @@
+import os
+import nltk
+import pickle
+from collections import Counter, defaultdict
+
+# written next to this script, where POSTagging looks for it (../models/pos_tagging/pos_lexicon.pkl from src)
+lexicon_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pos_lexicon.pkl')
+
+# a word goes into the lexicon only if it's frequent and (almost) always has the same tag
+min_count = 5
+min_share = 0.99
+
+
+# Function to make sure the Penn Treebank sample is there, only downloads when it is missing
+def load_treebank():
+    try:
+        nltk.data.find('corpora/treebank')
+    except LookupError:
+        nltk.download('treebank')
+    # the same data the CRF and MaxEnt taggers are trained on
+    return nltk.corpus.treebank.tagged_sents()
+
+
+# Function to count how often every word gets every tag
+def count_tags(corpus):
+    tag_counts = defaultdict(Counter)
+    for sentence in corpus:
+        for word, tag in sentence:
+            # -NONE- marks treebank trace elements, they never show up in real text
+            if tag != '-NONE-':
+                tag_counts[word][tag] += 1
+    return tag_counts
+
+
+# Function to keep the unambiguous words with their tag
+def build_lexicon(tag_counts):
+    lexicon = {}
+    for word, counts in tag_counts.items():
+        tag, count = counts.most_common(1)[0]
+        total = sum(counts.values())
+        if total >= min_count and count / total >= min_share:
+            lexicon[word] = tag
+    return lexicon
+
+
+if __name__ == '__main__':
+    tag_counts = count_tags(load_treebank())
+    lexicon = build_lexicon(tag_counts)
+
+    # saves the lexicon
+    with open(lexicon_path, 'wb') as file:
+        pickle.dump(lexicon, file)
+
+    covered = sum(sum(tag_counts[word].values()) for word in lexicon)
+    total = sum(sum(counts.values()) for counts in tag_counts.values())
+    print(f'Lexicon words: {len(lexicon)} of {len(tag_counts)}')
+    print(f'Treebank tokens covered: {covered / total:.2%}')
+    print(f'Lexicon saved to {lexicon_path}')
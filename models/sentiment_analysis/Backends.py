@@ -0,0 +1,99 @@
+import os
+import numpy as np
+
+# Every backend takes padded numpy int64 arrays (input_ids, attention_mask)
+# and returns a numpy float array of logits with shape (batch, 3).
+# torch and transformers are imported by the backends that use them, ONNX Runtime runs an exported
+# model.onnx without either of them
+
+onnx_filename = 'model.onnx'
+
+
+# Plain fp32 eager PyTorch, the way the model was always run
+class TorchBackend:
+    name = 'torch'
+
+    def __init__(self, model_dir):
+        from transformers import DistilBertForSequenceClassification
+        self.model = DistilBertForSequenceClassification.from_pretrained(model_dir, num_labels=3)
+        self.model.eval()
+
+    def predict_logits(self, input_ids, attention_mask):
+        import torch
+        with torch.no_grad():
+            outputs = self.model(input_ids=torch.from_numpy(input_ids),
+                                 attention_mask=torch.from_numpy(attention_mask))
+        return outputs.logits.numpy()
+
+
+# Same model with its Linear layers dynamically quantized to int8 (weights int8, activations quantized on the fly)
+class QuantizedTorchBackend(TorchBackend):
+    name = 'torch-int8'
+
+    def __init__(self, model_dir):
+        import torch
+        super().__init__(model_dir)
+        self.model = torch.ao.quantization.quantize_dynamic(self.model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+# Function to export the fine-tuned model to ONNX next to the safetensors weights
+def export_onnx(model_dir, onnx_path=None):
+    import torch
+    from transformers import DistilBertForSequenceClassification
+
+    onnx_path = onnx_path or os.path.join(model_dir, onnx_filename)
+    model = DistilBertForSequenceClassification.from_pretrained(model_dir, num_labels=3)
+    model.eval()
+    # dummy input only fixes the graph, batch and sequence axes stay dynamic
+    dummy_ids = torch.ones((2, 16), dtype=torch.long)
+    dummy_mask = torch.ones((2, 16), dtype=torch.long)
+    torch.onnx.export(
+        model,
+        (dummy_ids, dummy_mask),
+        onnx_path,
+        input_names=['input_ids', 'attention_mask'],
+        output_names=['logits'],
+        dynamic_axes={
+            'input_ids': {0: 'batch', 1: 'sequence'},
+            'attention_mask': {0: 'batch', 1: 'sequence'},
+            'logits': {0: 'batch'}
+        },
+        opset_version=14
+    )
+    print(f'ONNX model has been saved to {onnx_path}')
+    return onnx_path
+
+
+# ONNX Runtime on CPU, exports model.onnx first if it's not there yet
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, model_dir):
+        import onnxruntime  # only needed for this backend
+
+        onnx_path = os.path.join(model_dir, onnx_filename)
+        if not os.path.exists(onnx_path):
+            export_onnx(model_dir, onnx_path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+
+    def predict_logits(self, input_ids, attention_mask):
+        return self.session.run(['logits'], {
+            'input_ids': input_ids.astype(np.int64),
+            'attention_mask': attention_mask.astype(np.int64)
+        })[0]
+
+
+backends = {
+    TorchBackend.name: TorchBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    OnnxBackend.name: OnnxBackend
+}
+
+
+# Function to load an inference backend by name from the model directory
+def load_backend(name, model_dir):
+    if name not in backends:
+        raise ValueError(f"Unknown sentiment backend '{name}', choose one of: {', '.join(backends)}")
+    return backends[name](model_dir)
@@ -0,0 +1,218 @@
+# Knowledge distillation of the sentiment model into a small student that trains and scores on CPU in seconds:
+# TF-IDF features of word 1-2 grams and character 2-4 grams, and a ridge regression onto the teacher's logits.
+# Matching the logits (not just the top class) keeps how sure the teacher was, which the tiered mode of ML_Anal
+# relies on to send the comments the student is unsure about to the teacher.
+# The student learns from unlabeled scraped comments (data/Comments_*.arrow and the Comment column of
+# data/*.csv) scored by the teacher through the sentiment cache, so comments scored before cost nothing.
+# The labelled comments of data/balancedmerged.csv are kept out of training and used for the evaluation.
+# Usage: python Distillation.py [--max-comments 200000] [--alpha 1.0] [--tolerance 0.01]
+import os
+import sys
+import glob
+import time
+import pickle
+import argparse
+import numpy as np
+
+# Define the model directory where the student is saved next to the teacher
+model_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = os.path.join(model_dir, '../../data')
+student_path = os.path.join(model_dir, 'student.pkl')
+eval_file = os.path.join(data_dir, 'balancedmerged.csv')
+
+# share of the corpus held out to measure agreement with the teacher
+holdout_fraction = 0.1
+# comments scored by the teacher per call, the cache stores each chunk as it is done
+teacher_chunk_size = 5000
+# student confidences (top class probability) below which the tiered mode asks the teacher
+confidence_thresholds = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95]
+
+
+# The student: features and ridge weights, predict_logits gives the same 3 logits per comment as the teacher
+class StudentModel:
+    def __init__(self, vectorizer, regressor, metadata=None):
+        self.vectorizer = vectorizer
+        self.regressor = regressor
+        self.metadata = metadata or {}
+
+    def predict_logits(self, texts):
+        if not len(texts):
+            return np.zeros((0, 3))
+        return self.regressor.predict(self.vectorizer.transform([str(text) for text in texts]))
+
+
+def build_vectorizer():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.pipeline import FeatureUnion
+    return FeatureUnion([
+        ('words', TfidfVectorizer(ngram_range=(1, 2), min_df=2, max_features=200000, sublinear_tf=True,
+                                  dtype=np.float32)),
+        # character grams cover misspellings, elongations ('sooo') and emoji-adjacent words
+        ('chars', TfidfVectorizer(analyzer='char_wb', ngram_range=(2, 4), min_df=2, max_features=200000,
+                                  sublinear_tf=True, dtype=np.float32))
+    ])
+
+
+# Function to fit a student on comments and the teacher's logits of the same comments
+def train_student(texts, teacher_logits, alpha=1.0, metadata=None):
+    from sklearn.linear_model import Ridge
+    vectorizer = build_vectorizer()
+    features = vectorizer.fit_transform(texts)
+    regressor = Ridge(alpha=alpha, solver='sag', max_iter=200, random_state=42)
+    regressor.fit(features, np.asarray(teacher_logits, dtype=np.float32))
+    return StudentModel(vectorizer, regressor, metadata)
+
+
+# The student is saved as plain sklearn objects, so the pickle doesn't depend on where StudentModel was defined
+def save_student(student, path=student_path):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file:
+        pickle.dump({'vectorizer': student.vectorizer, 'regressor': student.regressor,
+                     'metadata': student.metadata}, file)
+    os.replace(temp_path, path)
+
+
+def load_student(path=student_path):
+    try:
+        with open(path, 'rb') as file:
+            data = pickle.load(file)
+    except FileNotFoundError:
+        raise FileNotFoundError(f'No student model at {path}, train one with models/sentiment_analysis/'
+                                f'Distillation.py') from None
+    return StudentModel(data['vectorizer'], data['regressor'], data['metadata'])
+
+
+# Function to get the top class probability of every row of logits
+def confidences(logits):
+    logits = np.asarray(logits, dtype=np.float64)
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return 1 / exp.sum(axis=1)
+
+
+# Function to gather unlabeled comments from the comments files and CSVs, each distinct comment once
+def collect_comments(exclude=(), max_comments=None):
+    import pandas as pd
+    import CommentStore
+    import SentimentCache
+    seen = {SentimentCache.normalize_text(text) for text in exclude}
+    comments = []
+    paths = sorted(glob.glob(os.path.join(data_dir, 'Comments_*.arrow')))
+    paths += sorted(glob.glob(os.path.join(data_dir, '*.csv')))
+    for path in paths:
+        if path.endswith('.csv'):
+            frame = pd.read_csv(path)
+            if 'Comment' not in frame.columns:
+                continue
+            texts = frame['Comment'].dropna().astype(str).tolist()
+        else:
+            texts = [text for text in CommentStore.read_comments(path) if text]
+        for text in texts:
+            key = SentimentCache.normalize_text(text)
+            if key and key not in seen:
+                seen.add(key)
+                comments.append(text)
+        if max_comments and len(comments) >= max_comments:
+            return comments[:max_comments]
+    return comments
+
+
+# Function to get the teacher's logits, from the cache where it scored a comment before
+def teacher_logits(texts):
+    import ML_Anal
+    logits = []
+    for start in range(0, len(texts), teacher_chunk_size):
+        logits.extend(ML_Anal.score_logits(texts[start:start + teacher_chunk_size]))
+        print(f'Teacher logits: {len(logits)}/{len(texts)}', end='\r')
+    print()
+    return np.asarray(logits, dtype=np.float32)
+
+
+# Function to get, per confidence threshold, the share of comments sent to the teacher and the predictions
+# of the tiered mode
+def tiered_predictions(student_logits, teacher_predictions):
+    student_predictions = student_logits.argmax(axis=1)
+    student_confidences = confidences(student_logits)
+    rows = []
+    for threshold in confidence_thresholds:
+        routed = student_confidences < threshold
+        rows.append((threshold, routed.mean(), np.where(routed, teacher_predictions, student_predictions)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill the sentiment model into a TF-IDF/ridge student')
+    parser.add_argument('--max-comments', type=int, default=200000, help='unlabeled comments to learn from at most')
+    parser.add_argument('--alpha', type=float, default=1.0, help='ridge regularization strength')
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help='accuracy drop versus the teacher accepted when suggesting a confidence threshold')
+    parser.add_argument('--output', default=student_path)
+    args = parser.parse_args()
+
+    sys.path.append(os.path.join(model_dir, '../../src'))
+    import ML_Anal
+    import ModelTraining
+    # the teacher labels the corpus, whatever mode the scoring runs in
+    ML_Anal.scoring_mode = 'teacher'
+
+    labelled = ModelTraining.load_data(eval_file, header=True)
+    eval_texts = labelled['comment'].astype(str).tolist()
+    eval_labels = np.array([ModelTraining.label_mapping[label] for label in labelled['label']])
+    comments = collect_comments(eval_texts, args.max_comments)
+    if not comments:
+        print(f'No unlabeled comments found in {data_dir}, scrape some videos first')
+        sys.exit(1)
+    print(f'{len(comments)} unlabeled comments, {len(eval_texts)} labelled comments for the evaluation')
+
+    start_time = time.perf_counter()
+    corpus_logits = teacher_logits(comments)
+    eval_teacher = teacher_logits(eval_texts)
+    print(f'Teacher scoring (cached comments are free): {time.perf_counter() - start_time:.1f} s')
+
+    order = np.random.default_rng(42).permutation(len(comments))
+    holdout = order[:int(len(comments) * holdout_fraction)]
+    train = order[len(holdout):]
+    start_time = time.perf_counter()
+    student = train_student([comments[i] for i in train], corpus_logits[train], args.alpha,
+                            {'teacher_version': ML_Anal.model_version(), 'comments': len(train),
+                             'alpha': args.alpha})
+    print(f'Student trained on {len(train)} comments in {time.perf_counter() - start_time:.1f} s')
+
+    # the speed of both models on the labelled comments, the teacher without its cache
+    start_time = time.perf_counter()
+    eval_student = student.predict_logits(eval_texts)
+    student_rate = len(eval_texts) / (time.perf_counter() - start_time)
+    sample = eval_texts[:1000]
+    start_time = time.perf_counter()
+    ML_Anal.predict_logits(sample)
+    teacher_rate = len(sample) / (time.perf_counter() - start_time)
+
+    holdout_teacher = corpus_logits[holdout].argmax(axis=1)
+    holdout_student = student.predict_logits([comments[i] for i in holdout])
+    teacher_accuracy = (eval_teacher.argmax(axis=1) == eval_labels).mean()
+    print(f'teacher: accuracy {teacher_accuracy:.4f}, {teacher_rate:.0f} comments/s')
+    print(f'student: accuracy {(eval_student.argmax(axis=1) == eval_labels).mean():.4f}, '
+          f'agreement with the teacher {(holdout_student.argmax(axis=1) == holdout_teacher).mean():.4f}, '
+          f'{student_rate:.0f} comments/s')
+
+    print(f'{"confidence":<12}{"to teacher":>11}{"accuracy":>10}{"agreement":>11}{"comments/s":>12}')
+    suggested = None
+    holdout_rows = tiered_predictions(holdout_student, holdout_teacher)
+    for (threshold, routed, predictions), (_, _, holdout_predictions) in zip(
+            tiered_predictions(eval_student, eval_teacher.argmax(axis=1)), holdout_rows):
+        accuracy = (predictions == eval_labels).mean()
+        agreement = (holdout_predictions == holdout_teacher).mean()
+        # every comment goes through the student, the routed share through the teacher as well
+        rate = 1 / (1 / student_rate + routed / teacher_rate)
+        print(f'{threshold:<12}{routed:>11.1%}{accuracy:>10.4f}{agreement:>11.4f}{rate:>12.0f}')
+        if suggested is None and teacher_accuracy - accuracy <= args.tolerance:
+            suggested = threshold
+    if suggested is not None:
+        print(f'Lowest confidence within {args.tolerance} accuracy of the teacher: --student-confidence {suggested}')
+        student.metadata['suggested_confidence'] = suggested
+
+    save_student(student, args.output)
+    print(f'Student saved to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
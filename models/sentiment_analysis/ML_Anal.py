@@ -1,40 +1,304 @@
 import os
-import torch
-import pandas as pd
-from transformers import DistilBertTokenizer, DistilBertForSequenceClassification
+import sys
 
 # Define the model directory where the tokenizer and model are saved
 model_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Load the tokenizer and model
-tokenizer = DistilBertTokenizer.from_pretrained('distilbert-base-uncased')
-model = DistilBertForSequenceClassification.from_pretrained(model_dir, num_labels=3)
+# needed for the ModelRegistry
+sys.path.append(os.path.join(model_dir, '../../src'))
+import ModelRegistry
+import TextProcessing
+import CommentStore
+import SentimentTimeline
+import Metrics
+
+# Inference backend: 'torch' (fp32), 'torch-int8' (dynamic quantization) or 'onnx' (ONNX Runtime)
+backend_name = os.environ.get('SENTIMENT_BACKEND', 'torch')
+
+
+# Function to load the model with the selected backend (torch and transformers are imported here, not at import time)
+def load_backend(name):
+    import Backends
+    return Backends.load_backend(name, model_dir)
+
+
+# The tokenizer and model are loaded on first use and then kept for the life of the process.
+# The tokenizer is the fast (Rust) one shared with the POS tagging stage in TextProcessing
+def get_tokenizer():
+    return TextProcessing.get_tokenizer()
+
+
+def get_backend():
+    name = backend_name
+    return ModelRegistry.get(f'sentiment_model:{name}', lambda: load_backend(name))
+
+
+# Longest sequence the model accepts
+max_length = TextProcessing.max_length
+# Upper bound on padded tokens (batch size x longest comment in the batch) per forward pass
+token_budget = 8192
+# Upper bound on comments per forward pass, so thousands of one-word comments don't form a single batch
+max_batch_size = 256
+
+# How comments longer than max_tokens tokens are fitted to the model. Attention cost grows with the square of the
+# length, so a few long essays can dominate the time of a batch:
+# 'truncate' keeps the first max_tokens tokens,
+# 'head_tail' keeps the first head_tokens and the last max_tokens - head_tokens (the end often holds the verdict),
+# 'chunk_average' scores every max_tokens window of the comment and averages the logits, weighted by length.
+# benchmarks/LengthPolicyEval.py measures the accuracy and latency of each on data/balancedmerged.csv
+length_policies = ['truncate', 'head_tail', 'chunk_average']
+length_policy = 'truncate'
+max_tokens = max_length
+# smallest max_tokens: [CLS], [SEP] and at least one token of the comment
+min_tokens = 3
+# head part of 'head_tail', a quarter of max_tokens when None
+head_tokens = None
+
+
+# Function to check a --max-tokens value on the command line (argparse type)
+def parse_max_tokens(value):
+    import argparse
+    try:
+        tokens = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected a number of tokens, got {value!r}') from None
+    if tokens < min_tokens:
+        raise argparse.ArgumentTypeError(f'at least {min_tokens} tokens ([CLS], [SEP] and one of the comment), '
+                                         f'got {tokens}')
+    return tokens
+
+
+# Function to fit the token IDs ([CLS] ... [SEP]) of comments to the length policy, returns the windows to score
+# and for every window the index of the comment it belongs to
+def make_windows(input_ids, policy=None, limit=None):
+    policy = policy or length_policy
+    if policy not in length_policies:
+        raise ValueError(f'Unknown length policy {policy!r}, expected one of {length_policies}')
+    limit = min(limit or max_tokens, max_length)
+    # room for the tokens of the comment between [CLS] and [SEP]
+    room = limit - 2
+    windows = []
+    owners = []
+    for index, ids in enumerate(input_ids):
+        ids = list(ids)
+        if len(ids) <= limit:
+            windows.append(ids)
+            owners.append(index)
+            continue
+        first, body, last = ids[:1], ids[1:-1], ids[-1:]
+        if policy == 'chunk_average':
+            for start in range(0, len(body), room):
+                windows.append(first + body[start:start + room] + last)
+                owners.append(index)
+            continue
+        if policy == 'head_tail':
+            head = min(room, head_tokens if head_tokens is not None else room // 4)
+            body = body[:head] + body[len(body) - (room - head):]
+        windows.append(first + body[:room] + last)
+        owners.append(index)
+    return windows, owners
+
+# Function to group comments of similar token length into batches that fit the token budget
+def make_length_batches(lengths, budget=None, batch_limit=None):
+    budget = budget or token_budget
+    batch_limit = batch_limit or max_batch_size
+    # sorting by length keeps the padding inside each batch minimal
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for index in order:
+        # lengths are sorted, so the current comment is the longest one in the batch
+        if batch and (lengths[index] * (len(batch) + 1) > budget or len(batch) >= batch_limit):
+            batches.append(batch)
+            batch = []
+        batch.append(index)
+    if batch:
+        batches.append(batch)
+    return batches
+
+# Function to predict logits for any number of sentences, returned in the original order.
+# input_ids can be passed when the sentences were already tokenized (TextProcessing.tokenize_comments)
+def predict_logits(sentences, model=None, input_ids=None):
+    if not sentences:
+        return []
+    model = model or get_backend()
+    tokenizer = get_tokenizer()
+    if input_ids is None:
+        # no truncation here, the length policy decides which tokens are scored
+        with TextProcessing.tokenizer_lock:
+            input_ids = tokenizer(sentences, truncation=False, verbose=False)['input_ids']
+    windows, owners = make_windows(input_ids)
+    logits = [None] * len(windows)
+    for batch in make_length_batches([len(ids) for ids in windows]):
+        with TextProcessing.tokenizer_lock:
+            inputs = tokenizer.pad({'input_ids': [windows[i] for i in batch]}, return_tensors='np')
+        with Metrics.span('sentiment.batch', comments=len(batch), padded_tokens=int(inputs['input_ids'].size)):
+            batch_logits = model.predict_logits(inputs['input_ids'], inputs['attention_mask'])
+        if Metrics.enabled:
+            Metrics.count('sentiment_comments', len(batch))
+            Metrics.count('sentiment_tokens', int(inputs['attention_mask'].sum()))
+        # scatter the batch back to the positions the sentences came from
+        for index, row in zip(batch, batch_logits.tolist()):
+            logits[index] = row
+    if len(windows) == len(sentences):
+        return logits
+    return average_windows(logits, owners, [len(ids) for ids in windows], len(sentences))
+
+
+# Function to average the logits of the windows of every comment, weighted by the tokens in each window
+def average_windows(window_logits, owners, lengths, count):
+    sums = [None] * count
+    weights = [0] * count
+    for row, owner, length in zip(window_logits, owners, lengths):
+        if sums[owner] is None:
+            sums[owner] = [0.0] * len(row)
+        sums[owner] = [total + value * length for total, value in zip(sums[owner], row)]
+        weights[owner] += length
+    return [[total / weight for total in row] for row, weight in zip(sums, weights)]
 
 # Function to predict sentiment for a batch of sentences
-def predict_sentiment(sentences):
-    inputs = tokenizer(sentences, return_tensors='pt', padding=True, truncation=True, max_length=512)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    logits = outputs.logits
-    predicted_class_ids = logits.argmax(dim=1).tolist()
-    return predicted_class_ids
+def predict_sentiment(sentences, model=None):
+    return [row.index(max(row)) for row in predict_logits(sentences, model)]
+
+# Scoring mode: 'teacher' runs the fine-tuned model on every comment, 'student' only the distilled TF-IDF student
+# (Distillation.py), 'tiered' runs the student first and the teacher on the comments where the student's top
+# class probability is below student_confidence
+scoring_modes = ['teacher', 'tiered', 'student']
+scoring_mode = 'teacher'
+student_path = os.path.join(model_dir, 'student.pkl')
+student_confidence = 0.9
+
+
+def get_student():
+    import Distillation
+    path = student_path
+    return ModelRegistry.get('sentiment_student', lambda: Distillation.load_student(path))
+
+
+# Function to get logits in the scoring mode, returns them and for every comment whether the teacher scored it
+def predict_scored(sentences, input_ids=None):
+    if scoring_mode == 'teacher' or not sentences:
+        return predict_logits(sentences, input_ids=input_ids), [True] * len(sentences)
+    import Distillation
+    with Metrics.span('sentiment.student', comments=len(sentences)):
+        student_logits = get_student().predict_logits(sentences)
+    if scoring_mode == 'student':
+        Metrics.count('student_comments', len(sentences))
+        return student_logits.tolist(), [False] * len(sentences)
+    routed = [index for index, confidence in enumerate(Distillation.confidences(student_logits))
+              if confidence < student_confidence]
+    if Metrics.enabled:
+        Metrics.count('student_comments', len(sentences) - len(routed))
+        Metrics.count('teacher_routed_comments', len(routed))
+    logits = student_logits.tolist()
+    from_teacher = [False] * len(sentences)
+    routed_ids = None if input_ids is None else [input_ids[index] for index in routed]
+    for index, row in zip(routed, predict_logits([sentences[index] for index in routed], input_ids=routed_ids)):
+        logits[index] = row
+        from_teacher[index] = True
+    return logits, from_teacher
+
+# Persistent prediction cache shared by every run and video
+use_cache = True
+cache_path = os.path.join(model_dir, '../../data/sentiment_cache.sqlite')
+cache_max_entries = 1000000
+
+
+def get_cache():
+    import SentimentCache
+    return ModelRegistry.get('sentiment_cache', lambda: SentimentCache.SentimentCache(cache_path, cache_max_entries))
+
+
+# Function to get the stats of the cache for the metrics export, once a run has opened it
+def cache_stats():
+    return get_cache().stats() if ModelRegistry.is_loaded('sentiment_cache') else {}
+
+
+# the size and hit rate are current values, not running totals
+Metrics.register_collector('sentiment_cache', cache_stats, gauges=('entries', 'hit_rate'))
+
+
+# model version per settings, so the config and weights are read once and not on every batch
+model_versions = {}
+
+
+# Function to get the model version that cache keys are tied to, new weights or settings never reuse old entries.
+# Weights replaced while the process runs are only noticed after a restart
+def model_version():
+    settings = (backend_name, max_length, length_policy, max_tokens, head_tokens)
+    if settings not in model_versions:
+        model_versions[settings] = compute_model_version()
+    return model_versions[settings]
+
+
+def compute_model_version():
+    import hashlib
+    digest = hashlib.sha256()
+    with open(os.path.join(model_dir, 'config.json'), 'rb') as file:
+        digest.update(file.read())
+    weights_file = os.path.join(model_dir, 'model.safetensors')
+    if os.path.exists(weights_file):
+        weights_stat = os.stat(weights_file)
+        digest.update(f'{weights_stat.st_size}:{weights_stat.st_mtime_ns}'.encode())
+    digest.update(f'{backend_name}:{max_length}'.encode())
+    # the default policy keeps the version of the caches written before length policies existed
+    if length_policy != 'truncate' or max_tokens < max_length:
+        digest.update(f':{length_policy}:{max_tokens}:{head_tokens}'.encode())
+    return digest.hexdigest()[:16]
+
+
+# Function to get logits for comments, consulting the cache first and only running the model on the misses
+def score_logits(comments, input_ids=None):
+    if not use_cache:
+        return predict_scored(comments, input_ids)[0]
+    import SentimentCache
+    cache = get_cache()
+    version = model_version()
+    with Metrics.span('sentiment.cache_lookup', comments=len(comments)):
+        logits = [None if result is None else result[1] for result in cache.lookup(comments, version)]
+
+    # repeated comments inside the same run are only scored once
+    missing = {}
+    for index, row in enumerate(logits):
+        if row is None:
+            missing.setdefault(SentimentCache.normalize_text(comments[index]), []).append(index)
+    if Metrics.enabled:
+        Metrics.count('sentiment_cache_hits', sum(row is not None for row in logits))
+        Metrics.count('sentiment_cache_misses', sum(len(indexes) for indexes in missing.values()))
+    if missing:
+        texts = [comments[indexes[0]] for indexes in missing.values()]
+        texts_ids = None if input_ids is None else [input_ids[indexes[0]] for indexes in missing.values()]
+        new_logits, from_teacher = predict_scored(texts, texts_ids)
+        for indexes, row in zip(missing.values(), new_logits):
+            for index in indexes:
+                logits[index] = row
+        # only the teacher's logits are cached, so a later run in teacher mode never reuses a student guess
+        scored = [index for index, teacher in enumerate(from_teacher) if teacher]
+        if scored:
+            cache.store([texts[index] for index in scored], [new_logits[index] for index in scored], version)
+    return logits
+
+
+# Function to get predicted class ids for comments, using the cache
+def score_comments(comments, input_ids=None):
+    return [row.index(max(row)) for row in score_logits(comments, input_ids)]
 
 # Function to analyze comments
 def analyze_comments(comments_file, video_id):
-    # Load the comments from the CSV file
-    comments_df = pd.read_csv(comments_file)
-    comments = comments_df['Comment'].tolist()
+    # Load the comments from the comments file (memory-mapped Arrow, older CSV files work too)
+    comments = CommentStore.read_comments(comments_file)
 
     sentiment_counts = {0: 0, 1: 0, 2: 0}
 
-    batch_size = 32  # Process comments in batches to improve efficiency
-    for i in range(0, len(comments), batch_size):
-        batch = comments[i:i + batch_size]
-        # Ensure all comments are strings, had problems
-        batch = [str(comment) for comment in batch]
-        predicted_class_ids = predict_sentiment(batch)
-        for class_id in predicted_class_ids:
-            sentiment_counts[class_id] += 1
+    # cached comments are skipped, the rest are batched by token length, so pass everything at once
+    class_ids = score_comments(comments)
+    for class_id in class_ids:
+        sentiment_counts[class_id] += 1
+    # the prediction of every comment is stored next to it
+    # and counted per hour and day of publishing, to follow the sentiment over time
+    if not comments_file.endswith('.csv'):
+        CommentStore.add_columns(comments_file, {'Sentiment': class_ids})
+        SentimentTimeline.update_from_file(comments_file, video_id)
 
     total_comments = sum(sentiment_counts.values())
     sentiment_percentages = {label: count / total_comments for label, count in sentiment_counts.items()}
@@ -1,34 +1,43 @@
+import time
 import pandas as pd
 from sklearn.metrics import accuracy_score
-from transformers import DistilBertTokenizer, DistilBertForSequenceClassification, Trainer, TrainingArguments
-import torch
-from torch.utils.data import Dataset
-import time
 
-# Load data
-data = pd.read_csv('ReadyToTrain.csv', header=None, names=['video_id', 'comment', 'label'])
+# Map string labels to numeric values
+label_mapping = {'neutral': 0, 'positive': 1, 'negative': 2}
+training_file = 'ReadyToTrain.csv'
+# the training file has no header, labelled files like data/balancedmerged.csv name their columns
+header_names = {'VideoID': 'video_id', 'Comment': 'comment', 'Sentiment': 'label'}
+
+
+# Function to load labelled comments, shuffled, with the unexpected labels dropped
+def load_data(path=training_file, header=False):
+    if header:
+        data = pd.read_csv(path).rename(columns=header_names)
+    else:
+        data = pd.read_csv(path, header=None, names=['video_id', 'comment', 'label'])
 
-# Drop videoID
-data = data.drop(columns=['video_id'])
+    # Drop videoID
+    data = data.drop(columns=['video_id'])
 
-# Filter out unexpected labels
-valid_labels = {'neutral', 'positive', 'negative'}
-data = data[data['label'].isin(valid_labels)]
+    # Filter out unexpected labels
+    data = data[data['label'].isin(label_mapping)].dropna(subset=['comment'])
 
-# Shuffle the data to randomize row positions
-data = data.sample(frac=1, random_state=42).reset_index(drop=True)
+    # Shuffle the data to randomize row positions
+    data = data.sample(frac=1, random_state=42).reset_index(drop=True)
 
-# Ensure CSV has the columns 'comment' and 'label'
-assert 'comment' in data.columns, "The CSV file does not contain a 'comment' column."
-assert 'label' in data.columns, "The CSV file does not contain a 'label' column."
+    # Ensure CSV has the columns 'comment' and 'label'
+    assert 'comment' in data.columns, "The CSV file does not contain a 'comment' column."
+    assert 'label' in data.columns, "The CSV file does not contain a 'label' column."
+    return data
 
-# Separate the data into different classes
-positive_data = data[data['label'] == 'positive']
-neutral_data = data[data['label'] == 'neutral']
-negative_data = data[data['label'] == 'negative']
 
 # Function to split data into 800 training and 200 validation samples for each class
-def split_data():
+def split_data(data):
+    # Separate the data into different classes
+    positive_data = data[data['label'] == 'positive']
+    neutral_data = data[data['label'] == 'neutral']
+    negative_data = data[data['label'] == 'negative']
+
     pos_train, pos_val = positive_data.iloc[:800], positive_data.iloc[800:]
     neu_train, neu_val = neutral_data.iloc[:800], neutral_data.iloc[800:]
     neg_train, neg_val = negative_data.iloc[:800], negative_data.iloc[800:]
@@ -43,19 +52,28 @@ def split_data():
 
     return train_texts, train_labels, val_texts, val_labels
 
-# Map string labels to numeric values
-label_mapping = {'neutral': 0, 'positive': 1, 'negative': 2}
+# torch and transformers are imported on use, so the data helpers load without them (Distillation.py)
+tokenizer = None
+
+
+def get_tokenizer():
+    global tokenizer
+    if tokenizer is None:
+        from transformers import DistilBertTokenizer
+        tokenizer = DistilBertTokenizer.from_pretrained('distilbert-base-uncased')
+    return tokenizer
 
-# Define function to tokenize data
-tokenizer = DistilBertTokenizer.from_pretrained('distilbert-base-uncased')
 
+# Define function to tokenize data
 def tokenize_data(texts, labels):
+    import torch
+    tokenizer = get_tokenizer()
     texts = [str(text) for text in texts]
     encodings = tokenizer(texts, padding=True, truncation=True, return_tensors='pt')
     return encodings, torch.tensor(labels)
 
-# Create Dataset class
-class SentimentDataset(Dataset):
+# Create Dataset class (a map-style dataset, the DataLoader of the Trainer only needs __getitem__ and __len__)
+class SentimentDataset:
     def __init__(self, encodings, labels):
         self.encodings = encodings
         self.labels = labels
@@ -75,6 +93,9 @@ def compute_metrics(p):
 
 # train and evaluate the model
 def train_and_evaluate_model(train_texts, train_labels, val_texts, val_labels, output_dir):
+    import torch
+    from transformers import DistilBertForSequenceClassification, Trainer, TrainingArguments
+
     train_encodings, train_labels = tokenize_data(train_texts, train_labels)
     val_encodings, val_labels = tokenize_data(val_texts, val_labels)
 
@@ -95,7 +116,7 @@ def train_and_evaluate_model(train_texts, train_labels, val_texts, val_labels, o
         save_strategy="epoch",
         logging_strategy="epoch",
         load_best_model_at_end=True,
-        fp16=True,  # Enable mixed precision training
+        fp16=torch.cuda.is_available(),  # Enable mixed precision training (GPU only, CPU trains in fp32)
         gradient_accumulation_steps=2
     )
 
@@ -118,13 +139,15 @@ def train_and_evaluate_model(train_texts, train_labels, val_texts, val_labels, o
     eval_result = trainer.evaluate(eval_dataset=val_dataset)
     print(f"Evaluation results for {output_dir}: {eval_result}")
 
-# Prepare the data
-train_texts, train_labels, val_texts, val_labels = split_data()
-output_dir = 'results 800 200'
 
-print(f"Number of training samples: {len(train_labels)}")
-print(f"Number of validation samples: {len(val_labels)}")
-print(f"Training to validation ratio: {(len(train_labels) / len(val_labels)):.2f}")
+if __name__ == '__main__':
+    # Prepare the data
+    train_texts, train_labels, val_texts, val_labels = split_data(load_data())
+    output_dir = 'results 800 200'
+
+    print(f"Number of training samples: {len(train_labels)}")
+    print(f"Number of validation samples: {len(val_labels)}")
+    print(f"Training to validation ratio: {(len(train_labels) / len(val_labels)):.2f}")
 
-# Train and evaluate the model
-train_and_evaluate_model(train_texts, train_labels, val_texts, val_labels, output_dir)
+    # Train and evaluate the model
+    train_and_evaluate_model(train_texts, train_labels, val_texts, val_labels, output_dir)
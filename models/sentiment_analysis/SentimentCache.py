@@ -0,0 +1,98 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+
+# SQLite has a limit on bound parameters per statement, lookups are split into chunks below it
+lookup_chunk_size = 500
+
+
+# Function to normalize a comment before hashing. The model is uncased and splits on whitespace,
+# so case and whitespace differences never change the prediction
+def normalize_text(text):
+    return ' '.join(str(text).lower().split())
+
+
+# Function to build the cache key from the normalized text and the model version
+def make_key(text, model_version):
+    return hashlib.sha256(f'{model_version}\0{normalize_text(text)}'.encode('utf-8')).digest()[:16]
+
+
+# On-disk cache of sentiment predictions with size-bounded LRU eviction
+class SentimentCache:
+    def __init__(self, path, max_entries=1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS sentiment ('
+            'key BLOB PRIMARY KEY, class_id INTEGER NOT NULL, logits BLOB NOT NULL, last_used INTEGER NOT NULL)')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS sentiment_last_used ON sentiment (last_used)')
+        self._connection.commit()
+        self._size = self._connection.execute('SELECT COUNT(*) FROM sentiment').fetchone()[0]
+
+    # Function to look up many comments at once, returns (class_id, logits) or None for each of them
+    def lookup(self, texts, model_version):
+        keys = [make_key(text, model_version) for text in texts]
+        found = {}
+        with self._lock:
+            unique_keys = list(set(keys))
+            for i in range(0, len(unique_keys), lookup_chunk_size):
+                chunk = unique_keys[i:i + lookup_chunk_size]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._connection.execute(
+                    f'SELECT key, class_id, logits FROM sentiment WHERE key IN ({placeholders})', chunk)
+                for key, class_id, logits in rows:
+                    found[key] = (class_id, array('f', logits).tolist())
+            # a hit makes the entry the most recently used one
+            now = time.time_ns()
+            self._connection.executemany('UPDATE sentiment SET last_used = ? WHERE key = ?',
+                                         [(now, key) for key in found])
+            self._connection.commit()
+        results = [found.get(key) for key in keys]
+        hit_count = sum(result is not None for result in results)
+        self.hits += hit_count
+        self.misses += len(results) - hit_count
+        return results
+
+    # Function to store predictions, evicting the least recently used entries above max_entries
+    def store(self, texts, logits, model_version):
+        now = time.time_ns()
+        rows = {}
+        for text, row in zip(texts, logits):
+            rows[make_key(text, model_version)] = (row.index(max(row)), array('f', row).tobytes())
+        with self._lock:
+            before = self._connection.total_changes
+            self._connection.executemany(
+                'INSERT OR IGNORE INTO sentiment (key, class_id, logits, last_used) VALUES (?, ?, ?, ?)',
+                [(key, class_id, blob, now) for key, (class_id, blob) in rows.items()])
+            self._size += self._connection.total_changes - before
+            if self._size > self.max_entries:
+                overflow = self._size - self.max_entries
+                self._connection.execute(
+                    'DELETE FROM sentiment WHERE key IN (SELECT key FROM sentiment ORDER BY last_used LIMIT ?)',
+                    (overflow,))
+                self._size -= overflow
+                self.evictions += overflow
+            self._connection.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': self._size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -1,9 +1,19 @@
 import os
+import json
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from googleapiclient.discovery import build
-import pandas as pd
 from tqdm import tqdm
-import re
 from urllib.parse import urlparse, parse_qs
+import TextProcessing
+import CommentStore
+import ScrapeState
+import NearDuplicates
+import Metrics
 
 # Ensure the data directory exists
 if not os.path.exists('../data'):
@@ -18,66 +28,298 @@ def extract_video_id(url):
     else:
         raise ValueError("Invalid YouTube URL")
 
-# Function to fetch comments from YouTube API
-def fetch_comments(youtube, video_id, max_comments, order='relevance'):
-    comments = []
+# Token bucket shared by every scraping thread, limits API requests per second
+class RateLimiter:
+    def __init__(self, requests_per_second, burst=None):
+        self.rate = requests_per_second
+        self.capacity = burst or max(1, int(requests_per_second))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            # sleep outside the lock so other threads can refill and check too
+            time.sleep(wait)
+
+
+# YouTube Data API quota units this run may spend, shared by every scraping thread
+class QuotaBudget:
+    # commentThreads.list costs 1 unit per request
+    page_cost = 1
+
+    def __init__(self, units):
+        self.remaining = units
+        self.spent = 0
+        self.lock = threading.Lock()
+
+    # Function to reserve units for one request, False means the budget is used up
+    def spend(self, units=page_cost):
+        with self.lock:
+            if self.remaining < units:
+                return False
+            self.remaining -= units
+            self.spent += units
+            return True
+
+
+# Retries of a failed request, waits base * 2^attempt seconds (capped at backoff_max) with full jitter
+max_retries = 6
+backoff_base = 1.0
+backoff_max = 64.0
+# HTTP statuses worth retrying, and 403 reasons that are really rate limits
+retry_statuses = {429, 500, 502, 503, 504}
+retry_reasons = {'rateLimitExceeded', 'userRateLimitExceeded', 'backendError'}
+quota_reasons = {'quotaExceeded', 'dailyLimitExceeded'}
+# on quotaExceeded, sleep until the daily quota resets (midnight Pacific time) instead of stopping
+wait_for_quota = False
+# also drop near-duplicates (bot floods of one comment with small changes), see NearDuplicates. Off by default,
+# the filter only sees text, and a real comment can look like an edited copy of another
+near_duplicates = False
+
+
+# Raised when the daily API quota, or the QuotaBudget of the run, is used up before a video was fetched
+# completely. With resume=True the progress of the video is saved, so running the same scrape again (after the
+# quota resets) continues from the page it stopped at
+class QuotaExceeded(Exception):
+    pass
+
+
+# Function to get the reason of an API error ('quotaExceeded', 'commentsDisabled', ...), None if it has none
+def error_reason(error):
+    details = getattr(error, 'error_details', None)
+    if isinstance(details, list) and details and isinstance(details[0], dict):
+        return details[0].get('reason')
+    try:
+        return json.loads(error.content)['error']['errors'][0]['reason']
+    except (AttributeError, ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+# Function to tell transient errors (server errors, rate limits, dropped connections) from permanent ones
+def is_retryable(error):
+    status = getattr(getattr(error, 'resp', None), 'status', None)
+    if status is not None:
+        return int(status) in retry_statuses or error_reason(error) in retry_reasons
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+# Function to get the seconds until the YouTube Data API quota resets, at midnight Pacific time
+def seconds_until_quota_reset():
+    now = datetime.now(ZoneInfo('America/Los_Angeles'))
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+# Function to run an API request, retrying transient errors with exponential backoff and jitter
+def execute_with_retry(request, rate_limiter=None):
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return request.execute()
+        except Exception as e:
+            Metrics.count('api_errors', reason=error_reason(e) or type(e).__name__)
+            if error_reason(e) in quota_reasons:
+                if not wait_for_quota:
+                    raise QuotaExceeded(str(e)) from e
+                wait = seconds_until_quota_reset() + 60
+                print(f"API quota exceeded, pausing for {wait / 3600:.1f} hours until it resets")
+                time.sleep(wait)
+                continue
+            if not is_retryable(e) or attempt >= max_retries:
+                raise
+            wait = random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+            print(f"Request failed ({e}), retry {attempt + 1} of {max_retries} in {wait:.1f} s")
+            time.sleep(wait)
+            attempt += 1
+
+
+# Fetches the replies that don't come with their thread (part=replies carries at most 5 per thread) with
+# comments().list. Threads are fetched by a bounded pool with an API client per thread, shared by every video
+# being scraped, so the replies of a page are fetched at the same time instead of one thread after the other
+class ReplyFetcher:
+    def __init__(self, client_factory, workers=8, rate_limiter=None, quota=None, page_cache=None):
+        self.client_factory = client_factory
+        self.rate_limiter = rate_limiter
+        self.quota = quota
+        self.page_cache = page_cache
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='replies')
+
+    # Function to fetch every reply of a thread, page by page
+    def fetch_thread(self, video_id, thread_id):
+        if not hasattr(self.local, 'youtube'):
+            self.local.youtube = self.client_factory()
+        replies = []
+        page_token = None
+        while True:
+            # reply pages are cached under the thread, in place of the sort order
+            response = self.page_cache.get(video_id, f'replies-{thread_id}', page_token) if self.page_cache else None
+            if response is None:
+                if self.quota is not None and not self.quota.spend():
+                    # the thread would be cut short, the page it belongs to is fetched again on the next run
+                    raise QuotaExceeded(f'quota budget used up during the replies of thread {thread_id}')
+                request = self.local.youtube.comments().list(
+                    part='snippet',
+                    parentId=thread_id,
+                    pageToken=page_token,
+                    textFormat='plainText',
+                    maxResults=100
+                )
+                with Metrics.span('scrape.replies', video_id=video_id):
+                    response = execute_with_retry(request, self.rate_limiter)
+                Metrics.count('api_requests')
+                if self.page_cache:
+                    self.page_cache.put(video_id, f'replies-{thread_id}', page_token, response)
+            replies.extend(response['items'])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+        return replies
+
+    def submit(self, video_id, thread_id):
+        return self.executor.submit(self.fetch_thread, video_id, thread_id)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+# Function to turn an API comment into the dict every stage uses, ParentID is the thread of a reply
+def make_comment(video_id, comment_id, snippet, parent_id=None):
+    return {
+        'VideoID': video_id,
+        'CommentID': comment_id,
+        'ParentID': parent_id,
+        'PublishedAt': snippet.get('publishedAt'),
+        'Comment': clean_comment(snippet['textDisplay'])
+    }
+
+
+# Function to fetch comments from YouTube API page by page, yields a list of comments for every page.
+# With resume=True every page is saved (ScrapeState), and a scrape of the video that stopped early
+# (crash, quota, error) is continued: its saved comments come as the first page, then fetching goes on from there.
+# With a reply_fetcher, every comment is followed by its replies (max_comments counts top-level comments only)
+def iter_comment_pages(youtube, video_id, max_comments, order='relevance', rate_limiter=None, quota=None,
+                       progress=True, page_cache=None, resume=False, reply_fetcher=None):
     page_token = None
     fetched_count = 0
+    part = 'snippet,replies' if reply_fetcher is not None else 'snippet'
+    # scrapes with and without replies are saved apart, their comments differ
+    state = ScrapeState.PaginationState(video_id, order if reply_fetcher is None else f'{order}.replies') \
+        if resume else None
 
     # Progress bar to show fetching progress
-    pbar = tqdm(total=max_comments, desc=f'Fetching comments for video {video_id}', unit=' comment')
+    pbar = tqdm(total=max_comments, desc=f'Fetching comments for video {video_id}', unit=' comment',
+                disable=not progress)
 
-    while fetched_count < max_comments:
-        try:
-            # Requesting comments from YouTube API
-            comment_request = youtube.commentThreads().list(
-                part="snippet",
-                videoId=video_id,
-                pageToken=page_token,
-                textFormat="plainText",
-                maxResults=100,  # Max results per request
-                order=order
-            )
-            comment_response = comment_request.execute()
-
-            # Processing each comment
-            for item in comment_response['items']:
-                top_comment = item['snippet']['topLevelComment']['snippet']
-                comment_text = clean_comment(top_comment['textDisplay'])
-                comments.append({
-                    'VideoID': video_id,
-                    'Comment': comment_text
-                })
-                fetched_count += 1
-                pbar.update(1)
-                if fetched_count >= max_comments:
-                    break
-
-            page_token = comment_response.get('nextPageToken')
+    try:
+        if state is not None and state.resumable():
+            saved = []
+            for comment in state.load_comments():
+                if not comment.get('ParentID'):
+                    if fetched_count >= max_comments:
+                        break
+                    fetched_count += 1
+                saved.append(comment)
+            page_token = state.page_token
+            pbar.update(fetched_count)
+            print(f"Resuming video {video_id} after {fetched_count} saved comments ({state.pages} pages)")
+            yield saved
+        while fetched_count < max_comments:
+            page = []
+            try:
+                # Replaying a cached page costs no quota
+                comment_response = page_cache.get(video_id, order, page_token, part) if page_cache else None
+                if page_cache:
+                    Metrics.count('page_cache_hits' if comment_response is not None else 'page_cache_misses')
+                if comment_response is None:
+                    if quota is not None and not quota.spend():
+                        raise QuotaExceeded('quota budget used up')
+                    # Requesting comments from YouTube API
+                    comment_request = youtube.commentThreads().list(
+                        part=part,
+                        videoId=video_id,
+                        pageToken=page_token,
+                        textFormat="plainText",
+                        maxResults=100,  # Max results per request
+                        order=order
+                    )
+                    with Metrics.span('scrape.request', video_id=video_id):
+                        comment_response = execute_with_retry(comment_request, rate_limiter)
+                    Metrics.count('api_requests')
+                    Metrics.count('api_comments', len(comment_response['items']))
+                    if page_cache:
+                        page_cache.put(video_id, order, page_token, comment_response, part)
+
+                # Processing each comment, threads with more replies than the page carries are fetched meanwhile
+                threads = []
+                for item in comment_response['items']:
+                    replies = None
+                    if reply_fetcher is not None:
+                        replies = item.get('replies', {}).get('comments', [])
+                        if item['snippet'].get('totalReplyCount', 0) > len(replies):
+                            replies = reply_fetcher.submit(video_id, item['id'])
+                    threads.append((item, replies))
+                    fetched_count += 1
+                    pbar.update(1)
+                    if fetched_count >= max_comments:
+                        break
+
+                for item, replies in threads:
+                    page.append(make_comment(video_id, item['id'], item['snippet']['topLevelComment']['snippet']))
+                    if replies is not None:
+                        if not isinstance(replies, list):
+                            replies = replies.result()
+                        for reply in replies:
+                            page.append(make_comment(video_id, reply['id'], reply['snippet'], item['id']))
+
+                page_token = comment_response.get('nextPageToken')
+            except QuotaExceeded:
+                print(f"Quota used up on video {video_id} after {fetched_count} comments"
+                      + (', progress saved, run again after the quota resets to continue' if state else ''))
+                raise
+            except Exception as e:
+                print(f"An error occurred while fetching a page of comments: {e}")
+                break
+
+            if state is not None:
+                if page_token and fetched_count < max_comments:
+                    state.save_page(page, page_token)
+                else:
+                    state.clear()
+            # yield outside the try, errors raised by the consumer are not fetch errors
+            yield page
             if not page_token:
                 break
-        except Exception as e:
-            print(f"An error occurred while fetching a page of comments: {e}")
-            break
+    finally:
+        pbar.close()
 
-    pbar.close()
+
+# Function to fetch comments from YouTube API
+def fetch_comments(youtube, video_id, max_comments, order='relevance', rate_limiter=None, quota=None, progress=True,
+                   page_cache=None, resume=False, reply_fetcher=None):
+    comments = []
+    for page in iter_comment_pages(youtube, video_id, max_comments, order, rate_limiter, quota, progress,
+                                   page_cache, resume, reply_fetcher):
+        comments.extend(page)
     return comments
 
-# Function to clean comments by removing emojis, newlines, and commas
+
+# Function to clean comments by removing emojis and newlines (patterns are compiled once in TextProcessing)
 def clean_comment(text):
-    text = text.replace('\n', ' ').replace('\r', ' ').replace(',', ' ')
-    emoji_pattern = re.compile(
-        "["
-        u"\U0001F600-\U0001F64F"  # emoticons
-        u"\U0001F300-\U0001F5FF"  # symbols & pictographs
-        u"\U0001F680-\U0001F6FF"  # transport & map symbols
-        u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        u"\U00002702-\U000027B0"  # other symbols
-        u"\U000024C2-\U0001F251"
-        "]+", flags=re.UNICODE)
-    return emoji_pattern.sub(r'', text)
-
-# Function to remove duplicate comments
+    return TextProcessing.clean_comment(text)
+
+# Function to remove duplicate comments, and near-duplicates when near_duplicates is set
 def remove_duplicate_comments(comments):
     seen_comments = set()
     unique_comments = []
@@ -85,23 +327,36 @@ def remove_duplicate_comments(comments):
         if comment['Comment'] not in seen_comments:
             seen_comments.add(comment['Comment'])
             unique_comments.append(comment)
+    if near_duplicates:
+        unique_comments = NearDuplicates.remove_near_duplicates(unique_comments)
     return unique_comments
 
-# Function to create POS-ready CSV file
-def create_pos_ready_file(comments, video_id):
-    pos_ready_comments = []
-    for comment in comments:
-        pos_ready_comments.append({
-            'VideoID': comment['VideoID'],
-            'Comment': comment['Comment']
-        })
-    pos_ready_df = pd.DataFrame(pos_ready_comments)
-    pos_ready_filename = f'../data/POS_ready_{video_id}.csv'
-    pos_ready_df.to_csv(pos_ready_filename, index=False)
-    print(f'POS-ready comments have been saved to {pos_ready_filename}')
-    return pos_ready_filename
-
-def run_scraper(api_key, video_url, max_comments):
+# Function to turn the user's answer into a comment limit
+def parse_max_comments(max_comments):
+    if isinstance(max_comments, (int, float)):
+        return max_comments
+    if not max_comments.isdigit() and max_comments.lower() != 'all':
+        return 500
+    elif max_comments.lower() == 'all':
+        return float('inf')
+    return int(max_comments)
+
+
+# Function to dedup and save the comments of one video, returns the comments file read by the analysis stages
+def save_comments(comments, video_id):
+    # Process comments
+    with Metrics.span('dedup', comments=len(comments)):
+        processed_comments = remove_duplicate_comments(comments)
+
+    # Save them once, in a columnar file every stage can memory-map
+    output_filename = CommentStore.write_comments(processed_comments, CommentStore.comments_path(video_id))
+
+    print(f'Processed comments have been saved to {output_filename}')
+    return output_filename
+
+
+# replies=True also collects the replies of every comment, reply_workers threads fetch them at the same time
+def run_scraper(api_key, video_url, max_comments, page_cache=None, replies=False, reply_workers=8):
     youtube = build('youtube', 'v3', developerKey=api_key)
 
     try:
@@ -110,29 +365,111 @@ def run_scraper(api_key, video_url, max_comments):
         print(f"Error processing URL: {e}")
         return
 
-    if not max_comments.isdigit() and max_comments.lower() != 'all':
-        max_comments = 500
-    elif max_comments.lower() == 'all':
-        max_comments = float('inf')
-    else:
-        max_comments = int(max_comments)
+    max_comments = parse_max_comments(max_comments)
 
     # Fetch comments
-    comments = fetch_comments(youtube, video_id, max_comments)
+    # resume=True: a scrape stopped by an error or the quota continues from its last page when run again
+    reply_fetcher = ReplyFetcher(lambda: build('youtube', 'v3', developerKey=api_key), reply_workers,
+                                 page_cache=page_cache) if replies else None
+    try:
+        comments = fetch_comments(youtube, video_id, max_comments, page_cache=page_cache, resume=True,
+                                  reply_fetcher=reply_fetcher)
+    finally:
+        if reply_fetcher:
+            reply_fetcher.close()
 
-    # Process comments
-    processed_comments = remove_duplicate_comments(comments)
-    processed_comments_df = pd.DataFrame(processed_comments)
+    return save_comments(comments, video_id)
 
-    # Save processed comments to CSV file
-    processed_output_filename = f'../data/Processed_Comments_{video_id}.csv'
-    processed_comments_df.to_csv(processed_output_filename, index=False)
 
-    print(f'Processed comments have been saved to {processed_output_filename}')
+# Function to fetch many videos at once. Pages of one video stay sequential (each needs the previous page token),
+# but different videos are fetched by a bounded pool of threads that share one rate limiter and one quota budget
+def fetch_many_videos(client_factory, video_ids, max_comments, max_workers=8, requests_per_second=10.0,
+                      quota_units=None, order='relevance', page_cache=None, replies=False, reply_workers=8):
+    rate_limiter = RateLimiter(requests_per_second) if requests_per_second else None
+    quota = QuotaBudget(quota_units) if quota_units is not None else None
+    # one reply pool for all videos, so the number of reply fetches in flight stays bounded
+    reply_fetcher = ReplyFetcher(client_factory, reply_workers, rate_limiter, quota, page_cache) if replies else None
+    # API clients aren't thread safe, so every worker thread builds its own
+    local = threading.local()
 
-    # Create POS-ready file
-    return create_pos_ready_file(processed_comments, video_id)
+    def fetch_video(video_id):
+        if not hasattr(local, 'youtube'):
+            local.youtube = client_factory()
+        return fetch_comments(local.youtube, video_id, max_comments, order=order, rate_limiter=rate_limiter,
+                              quota=quota, progress=False, page_cache=page_cache, resume=True,
+                              reply_fetcher=reply_fetcher)
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_video = {executor.submit(fetch_video, video_id): video_id for video_id in video_ids}
+            for future in tqdm(as_completed(future_to_video), total=len(future_to_video), desc='Fetching videos',
+                               unit=' video'):
+                video_id = future_to_video[future]
+                try:
+                    results[video_id] = future.result()
+                except Exception as e:
+                    print(f"An error occurred while fetching video {video_id}: {e}")
+    finally:
+        if reply_fetcher:
+            reply_fetcher.close()
+    if quota is not None:
+        print(f'Quota spent: {quota.spent} units, {quota.remaining} left')
+    return results
+
+
+# Function to scrape many videos concurrently and save each one, returns {video_id: comments file}
+def run_many_scrapers(api_key, video_urls, max_comments, max_workers=8, requests_per_second=10.0, quota_units=None,
+                      client_factory=None, page_cache=None, replies=False, reply_workers=8):
+    client_factory = client_factory or (lambda: build('youtube', 'v3', developerKey=api_key))
+    video_ids = []
+    for video_url in video_urls:
+        try:
+            video_ids.append(extract_video_id(video_url))
+        except ValueError as e:
+            print(f"Error processing URL {video_url}: {e}")
+
+    results = fetch_many_videos(client_factory, video_ids, parse_max_comments(max_comments), max_workers,
+                                requests_per_second, quota_units, page_cache=page_cache, replies=replies,
+                                reply_workers=reply_workers)
+    return {video_id: save_comments(comments, video_id) for video_id, comments in results.items()}
 
 
 if __name__ == '__main__':
-    run_scraper()
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scrape comments of many YouTube videos concurrently')
+    parser.add_argument('video_urls', nargs='+')
+    parser.add_argument('--max-comments', default='500', help="number of comments per video or 'all'")
+    parser.add_argument('--workers', type=int, default=8, help='videos fetched at the same time')
+    parser.add_argument('--requests-per-second', type=float, default=10.0, help='global API request rate')
+    parser.add_argument('--quota', type=int, default=None, help='quota units this run may spend')
+    parser.add_argument('--fake-api', action='store_true', help='use the local fake YouTube API instead')
+    parser.add_argument('--fake-error-rate', type=float, default=0.0,
+                        help='share of fake API requests failing with a transient error, to exercise retries')
+    parser.add_argument('--fake-quota', type=int, default=None,
+                        help='fake API requests answered before it reports quotaExceeded')
+    parser.add_argument('--wait-for-quota', action='store_true',
+                        help='when the API quota runs out, wait for the daily reset instead of stopping')
+    parser.add_argument('--replies', action='store_true', help='also collect the replies of every comment')
+    parser.add_argument('--reply-workers', type=int, default=8, help='reply threads fetched at the same time')
+    parser.add_argument('--page-cache-ttl', type=float, default=0,
+                        help='hours a cached page is replayed instead of refetched (default 0, off)')
+    args = parser.parse_args()
+
+    wait_for_quota = args.wait_for_quota
+    import PageCache
+    cache = PageCache.PageCache(ttl=args.page_cache_ttl * 3600) if args.page_cache_ttl > 0 else None
+
+    if args.fake_api:
+        import FakeYouTube
+        # one fake shared by every thread, so its quota is global like the real one
+        fake = FakeYouTube.FakeYouTube(error_rate=args.fake_error_rate, quota=args.fake_quota)
+        factory = lambda: fake
+        key = None
+    else:
+        with open('../key.txt', 'r') as file:
+            key = file.read().strip()
+        factory = None
+    run_many_scrapers(key, args.video_urls, args.max_comments, args.workers, args.requests_per_second, args.quota,
+                      factory, cache, args.replies, args.reply_workers)
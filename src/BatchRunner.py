@@ -0,0 +1,360 @@
+# Non-interactive batch runner: scrape -> POS -> sentiment -> report for every video of a links file
+# (data/links.txt format, '@Category' lines followed by video URLs) or a list of video IDs.
+# Videos are scraped by a pool of threads while already scraped videos are tagged by one POS thread and scored
+# by sentiment_workers threads. The stage every video has reached is checkpointed, so a crashed or interrupted job picks
+# up where it stopped when it's started again, and per-video and per-category reports are written at the end
+# (with --render, also the PDF report of every video, rendered headless by a process pool).
+# Usage: python BatchRunner.py --links ../data/links.txt [--max-comments 500] [--scrape-workers 8] [--fake-api]
+#        python BatchRunner.py --videos vKkoBUPav3s 4IHh8d5RhOM --job my_channel
+import os
+import sys
+import csv
+import json
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import AnalScraper
+import POSTagging
+import CommentStore
+import Visualization
+import Metrics
+
+#needed for the ML_Anal
+sys.path.append(os.path.join(os.path.dirname(__file__), '../models/sentiment_analysis'))
+import ML_Anal
+
+batch_dir = '../data/batch'
+default_category = 'Uncategorized'
+
+# stages of a video, in order
+stages = ['pending', 'scraped', 'tagged', 'done']
+
+# marks the end of a stage queue
+done = object()
+
+
+# Function to read a links file, returns [(category, video_id)] in file order
+def parse_links(path):
+    videos = []
+    category = default_category
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('@'):
+                category = line[1:].strip() or default_category
+                continue
+            try:
+                videos.append((category, AnalScraper.extract_video_id(line)))
+            except ValueError as e:
+                print(f"Error processing URL {line}: {e}")
+    return videos
+
+
+# Checkpoint of a job: the category and stage of every video, saved after every stage a video finishes
+class Checkpoint:
+    def __init__(self, job_dir, videos, restart=False):
+        self.path = os.path.join(job_dir, 'checkpoint.json')
+        self.lock = threading.Lock()
+        self.videos = {}
+        if not restart:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as file:
+                    self.videos = json.load(file)['videos']
+            except FileNotFoundError:
+                pass
+        for category, video_id in videos:
+            entry = self.videos.setdefault(video_id, {'category': category, 'stage': 'pending'})
+            entry['category'] = category
+            # failed videos are retried on the next run
+            entry.pop('error', None)
+
+    def stage(self, video_id):
+        return self.videos[video_id]['stage']
+
+    def set_stage(self, video_id, stage, **fields):
+        with self.lock:
+            self.videos[video_id].update(fields, stage=stage)
+            self.videos[video_id].pop('error', None)
+            self.save()
+
+    def fail(self, video_id, error):
+        with self.lock:
+            self.videos[video_id]['error'] = str(error)
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # write to a temporary file first, so a crash never corrupts the checkpoint
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'videos': self.videos}, file, indent=1)
+        os.replace(temp_path, self.path)
+
+
+# Function to count the per-comment results stored in a video's comments file
+def video_counts(video_id):
+    table = CommentStore.read_table(CommentStore.comments_path(video_id))
+    columns = table.column_names
+    sentiment = Counter(table.column('Sentiment').to_pylist()) if 'Sentiment' in columns else Counter()
+    nouns = Counter()
+    adjectives = Counter()
+    if 'Nouns' in columns:
+        for words in table.column('Nouns').to_pylist():
+            nouns.update(words)
+        for words in table.column('Adjectives').to_pylist():
+            adjectives.update(words)
+    return table.num_rows, sentiment, nouns, adjectives
+
+
+# Function to build a report from counts, the same numbers main shows for a single video
+def make_report(comments, sentiment, nouns, adjectives, **fields):
+    total = sum(sentiment.values())
+    report = dict(fields)
+    report.update({
+        'comments': comments,
+        'positive': sentiment[1] / total if total else 0,
+        'neutral': sentiment[0] / total if total else 0,
+        'negative': sentiment[2] / total if total else 0,
+        'top_nouns': nouns.most_common(100),
+        'top_adjectives': adjectives.most_common(100)
+    })
+    return report
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=1)
+    os.replace(temp_path, path)
+
+
+# Function to write a report for every finished video and every category, and a summary.csv of the categories.
+# render=True also renders the report of every video like main does, render_workers processes at a time
+def write_reports(job_dir, checkpoint, render=False, render_workers=None):
+    categories = {}
+    to_render = []
+    for video_id, entry in checkpoint.videos.items():
+        if entry['stage'] != 'done':
+            continue
+        comments, sentiment, nouns, adjectives = video_counts(video_id)
+        report = make_report(comments, sentiment, nouns, adjectives, video_id=video_id, category=entry['category'])
+        write_json(os.path.join(job_dir, 'videos', f'{video_id}.json'), report)
+        if render:
+            to_render.append({'top_nouns': report['top_nouns'], 'top_adjectives': report['top_adjectives'],
+                              'positive_percentage': report['positive'], 'neutral_percentage': report['neutral'],
+                              'negative_percentage': report['negative'],
+                              'yt_link': f'https://www.youtube.com/watch?v={video_id}', 'video_id': video_id,
+                              'output_dir': os.path.join(job_dir, 'videos')})
+        totals = categories.setdefault(entry['category'], [0, 0, Counter(), Counter(), Counter()])
+        totals[0] += 1
+        totals[1] += comments
+        totals[2].update(sentiment)
+        totals[3].update(nouns)
+        totals[4].update(adjectives)
+
+    summary = []
+    for category, (videos, comments, sentiment, nouns, adjectives) in categories.items():
+        report = make_report(comments, sentiment, nouns, adjectives, category=category, videos=videos)
+        write_json(os.path.join(job_dir, 'categories', f'{category}.json'), report)
+        summary.append([category, videos, comments, f"{report['positive']:.4f}", f"{report['neutral']:.4f}",
+                        f"{report['negative']:.4f}"])
+    with open(os.path.join(job_dir, 'summary.csv'), 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Category', 'Videos', 'Comments', 'Positive', 'Neutral', 'Negative'])
+        writer.writerows(summary)
+    if to_render:
+        Visualization.render_reports(to_render, render_workers)
+    return categories
+
+
+def run_batch(videos, job_dir, client_factory, max_comments=500, scrape_workers=8, pos_workers=1,
+              requests_per_second=10.0, quota_units=None, page_cache=None, restart=False, replies=False,
+              reply_workers=8, render=False, render_workers=None, sentiment_workers=1):
+    checkpoint = Checkpoint(job_dir, videos, restart)
+    checkpoint.save()
+    video_ids = list(dict.fromkeys(video_id for _, video_id in videos))
+    rate_limiter = AnalScraper.RateLimiter(requests_per_second) if requests_per_second else None
+    quota = AnalScraper.QuotaBudget(quota_units) if quota_units is not None else None
+    reply_fetcher = AnalScraper.ReplyFetcher(client_factory, reply_workers, rate_limiter, quota, page_cache) \
+        if replies else None
+    pos_queue = queue.Queue()
+    sentiment_queue = queue.Queue()
+    # API clients aren't thread safe, so every scrape thread builds its own
+    local = threading.local()
+
+    def scrape_video(video_id):
+        if not hasattr(local, 'youtube'):
+            local.youtube = client_factory()
+        with Metrics.span('batch.scrape', video_id=video_id):
+            # raises QuotaExceeded when the budget runs out before the video is complete, the video then stays
+            # pending and the next run continues it from its last saved page
+            comments = AnalScraper.fetch_comments(local.youtube, video_id, max_comments, rate_limiter=rate_limiter,
+                                                  quota=quota, progress=False, page_cache=page_cache, resume=True,
+                                                  reply_fetcher=reply_fetcher)
+            AnalScraper.save_comments(comments, video_id)
+
+    def pos_stage():
+        while True:
+            video_id = pos_queue.get()
+            if video_id is done:
+                break
+            try:
+                with Metrics.span('batch.pos', video_id=video_id):
+                    if CommentStore.read_table(CommentStore.comments_path(video_id)).num_rows:
+                        POSTagging.pos_tagging(CommentStore.comments_path(video_id), pos_workers)
+                checkpoint.set_stage(video_id, 'tagged')
+                sentiment_queue.put(video_id)
+            except Exception as e:
+                print(f"An error occurred while tagging video {video_id}: {e}")
+                checkpoint.fail(video_id, e)
+        sentiment_queue.put(done)
+
+    def sentiment_stage():
+        while True:
+            video_id = sentiment_queue.get()
+            if video_id is done:
+                # put it back for the other sentiment threads
+                sentiment_queue.put(done)
+                break
+            try:
+                with Metrics.span('batch.sentiment', video_id=video_id):
+                    if CommentStore.read_table(CommentStore.comments_path(video_id)).num_rows:
+                        ML_Anal.analyze_comments(CommentStore.comments_path(video_id), video_id)
+                checkpoint.set_stage(video_id, 'done')
+            except Exception as e:
+                print(f"An error occurred while scoring video {video_id}: {e}")
+                checkpoint.fail(video_id, e)
+
+    threads = [threading.Thread(target=pos_stage, name='pos_stage', daemon=True)]
+    # the model runs outside the GIL, so several videos can be scored at once
+    threads += [threading.Thread(target=sentiment_stage, name=f'sentiment_stage_{index}', daemon=True)
+                for index in range(max(1, sentiment_workers))]
+    for thread in threads:
+        thread.start()
+
+    # videos that got further than scraping before the last run stopped go straight to their next stage
+    to_scrape = []
+    for video_id in video_ids:
+        stage = checkpoint.stage(video_id)
+        if stage == 'scraped':
+            pos_queue.put(video_id)
+        elif stage == 'tagged':
+            sentiment_queue.put(video_id)
+        elif stage == 'pending':
+            to_scrape.append(video_id)
+    print(f'{len(video_ids)} videos, {len(to_scrape)} to scrape, '
+          f'{sum(checkpoint.stage(video_id) == "done" for video_id in video_ids)} already done')
+
+    try:
+        with ThreadPoolExecutor(max_workers=scrape_workers) as executor:
+            future_to_video = {executor.submit(scrape_video, video_id): video_id for video_id in to_scrape}
+            for future in as_completed(future_to_video):
+                video_id = future_to_video[future]
+                try:
+                    future.result()
+                except AnalScraper.QuotaExceeded as e:
+                    print(f"Video {video_id} stopped early ({e}), the next run continues it")
+                    checkpoint.fail(video_id, e)
+                    continue
+                except Exception as e:
+                    print(f"An error occurred while scraping video {video_id}: {e}")
+                    checkpoint.fail(video_id, e)
+                    continue
+                checkpoint.set_stage(video_id, 'scraped')
+                pos_queue.put(video_id)
+    finally:
+        if reply_fetcher:
+            reply_fetcher.close()
+        pos_queue.put(done)
+        for thread in threads:
+            thread.join()
+
+    if quota is not None:
+        print(f'Quota spent: {quota.spent} units, {quota.remaining} left')
+    with Metrics.span('batch.reports'):
+        categories = write_reports(job_dir, checkpoint, render, render_workers)
+    finished = sum(checkpoint.stage(video_id) == 'done' for video_id in video_ids)
+    print(f'{finished} of {len(video_ids)} videos done, reports for {len(categories)} categories in {job_dir}')
+    return checkpoint
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scrape, tag and score many videos and write per-category reports')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--links', help="links file, '@Category' lines followed by video URLs")
+    source.add_argument('--videos', nargs='+', help='video IDs or URLs')
+    parser.add_argument('--job', default=None,
+                        help=f'job name, checkpoint and reports go to {batch_dir}/<job> (default: links file name)')
+    parser.add_argument('--max-comments', default='500', help="number of comments per video or 'all'")
+    parser.add_argument('--scrape-workers', type=int, default=8, help='videos fetched at the same time')
+    parser.add_argument('--pos-workers', type=int, default=1, help='processes used to tag each video')
+    parser.add_argument('--sentiment-workers', type=int, default=1,
+                        help='videos scored at the same time (each also uses the intra-op threads of the model)')
+    parser.add_argument('--requests-per-second', type=float, default=10.0, help='global API request rate')
+    parser.add_argument('--quota', type=int, default=None, help='quota units this run may spend')
+    parser.add_argument('--replies', action='store_true', help='also collect the replies of every comment')
+    parser.add_argument('--near-duplicates', action='store_true',
+                        help='also drop near-duplicate comments (bot floods with small changes)')
+    parser.add_argument('--reply-workers', type=int, default=8, help='reply threads fetched at the same time')
+    parser.add_argument('--page-cache-ttl', type=float, default=0,
+                        help='hours a cached page is replayed instead of refetched (default 0, off)')
+    parser.add_argument('--backend', default=ML_Anal.backend_name, choices=['torch', 'torch-int8', 'onnx'])
+    parser.add_argument('--length-policy', default=ML_Anal.length_policy, choices=ML_Anal.length_policies)
+    parser.add_argument('--max-tokens', type=ML_Anal.parse_max_tokens, default=ML_Anal.max_tokens,
+                        help='tokens of a comment scored at once')
+    parser.add_argument('--scoring-mode', default=ML_Anal.scoring_mode, choices=ML_Anal.scoring_modes)
+    parser.add_argument('--student-confidence', type=float, default=ML_Anal.student_confidence,
+                        help='student confidence below which the tiered mode asks the fine-tuned model')
+    parser.add_argument('--pos-backend', default=POSTagging.pos_backend, choices=['crf', 'maxent'])
+    parser.add_argument('--render', action='store_true', help='also render the PDF report of every video')
+    parser.add_argument('--render-workers', type=int, default=None, help='processes rendering reports at once')
+    parser.add_argument('--report-dpi', type=int, default=Visualization.dpi, help='resolution of rendered reports')
+    parser.add_argument('--metrics', default=None,
+                        help='record spans and counters and write them to this file at the end '
+                             '(OpenTelemetry JSON for .json, Prometheus text otherwise)')
+    parser.add_argument('--fake-api', action='store_true', help='use the local fake YouTube API instead')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and process every video again')
+    args = parser.parse_args()
+
+    ML_Anal.backend_name = args.backend
+    ML_Anal.length_policy = args.length_policy
+    ML_Anal.max_tokens = args.max_tokens
+    ML_Anal.scoring_mode = args.scoring_mode
+    ML_Anal.student_confidence = args.student_confidence
+    POSTagging.pos_backend = args.pos_backend
+    Visualization.dpi = args.report_dpi
+    if args.metrics:
+        Metrics.enable()
+    AnalScraper.near_duplicates = args.near_duplicates
+
+    if args.links:
+        batch_videos = parse_links(args.links)
+        job = args.job or os.path.splitext(os.path.basename(args.links))[0]
+    else:
+        batch_videos = [(default_category, AnalScraper.extract_video_id(video) if '/' in video else video)
+                        for video in args.videos]
+        job = args.job or 'videos'
+
+    import PageCache
+    cache = PageCache.PageCache(ttl=args.page_cache_ttl * 3600) if args.page_cache_ttl > 0 else None
+
+    if args.fake_api:
+        import FakeYouTube
+        factory = FakeYouTube.FakeYouTube
+    else:
+        from googleapiclient.discovery import build
+        with open('../key.txt', 'r') as file:
+            key = file.read().strip()
+        factory = lambda: build('youtube', 'v3', developerKey=key)
+    run_batch(batch_videos, os.path.join(batch_dir, job), factory, AnalScraper.parse_max_comments(args.max_comments),
+              args.scrape_workers, args.pos_workers, args.requests_per_second, args.quota, cache, args.restart,
+              args.replies, args.reply_workers, args.render, args.render_workers, args.sentiment_workers)
+    if args.metrics:
+        print(Metrics.summary())
+        print(f'Metrics saved to {Metrics.export(args.metrics)}')
@@ -0,0 +1,90 @@
+# Columnar storage of a video's comments (Arrow IPC / Feather v2, uncompressed so it can be memory-mapped).
+# The scraper writes one file per video with the comment texts, IDs and timestamps, the POS tagging and sentiment
+# stages read it zero-copy and add their per-comment results (Nouns, Adjectives, Sentiment) as new columns.
+# This replaces the Processed_Comments/POS_ready CSV pair, which held the same comments twice and made the
+# scraper strip commas from every comment.
+import os
+import pyarrow as pa
+from pyarrow import feather
+import Metrics
+
+data_dir = '../data'
+
+schema = pa.schema([
+    ('VideoID', pa.string()),
+    ('CommentID', pa.string()),
+    # thread of a reply, null for top-level comments
+    ('ParentID', pa.string()),
+    ('PublishedAt', pa.string()),
+    ('Comment', pa.string())
+])
+
+# types of the result columns added by the analysis stages
+result_types = {
+    'Sentiment': pa.int8(),
+    'Nouns': pa.list_(pa.string()),
+    'Adjectives': pa.list_(pa.string())
+}
+
+
+def comments_path(video_id):
+    return os.path.join(data_dir, f'Comments_{video_id}.arrow')
+
+
+# Function to write to a temporary file first, so readers never see a half written file
+def write_table(table, path):
+    with Metrics.span('store.write', rows=table.num_rows):
+        temp_path = f'{path}.tmp'
+        feather.write_feather(table, temp_path, compression='uncompressed')
+        os.replace(temp_path, path)
+
+
+# Function to save a list of comment dicts (as built by AnalScraper.iter_comment_pages)
+def write_comments(comments, path):
+    columns = {name: [comment.get(name) for comment in comments] for name in schema.names}
+    write_table(pa.Table.from_pydict(columns, schema=schema), path)
+    return path
+
+
+# Writer that saves comments page by page, for the streaming pipeline
+class CommentWriter:
+    def __init__(self, path):
+        self.path = path
+        self.temp_path = f'{path}.tmp'
+        self.writer = pa.ipc.new_file(self.temp_path, schema)
+
+    def write(self, comments):
+        columns = {name: [comment.get(name) for comment in comments] for name in schema.names}
+        self.writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.temp_path, self.path)
+
+
+# Function to open a comments file, the buffers are memory-mapped and not copied
+def read_table(path):
+    with Metrics.span('store.read'):
+        return feather.read_table(path, memory_map=True)
+
+
+# Function to get the comment texts of a file, old CSV files from before the Arrow format are still read
+def read_comments(path):
+    if path.endswith('.csv'):
+        import pandas as pd
+        with Metrics.span('store.read_csv'):
+            return [str(comment) for comment in pd.read_csv(path)['Comment'].tolist()]
+    return read_table(path).column('Comment').to_pylist()
+
+
+# Function to add (or replace) per-comment result columns, {name: values in file order}
+def add_columns(path, columns):
+    # read into memory, a memory-mapped file can't be replaced on Windows
+    table = feather.read_table(path, memory_map=False)
+    for name, values in columns.items():
+        column = pa.array(values, type=result_types.get(name))
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, column)
+        else:
+            table = table.append_column(name, column)
+    write_table(table, path)
@@ -0,0 +1,189 @@
+# Local fake of the part of the YouTube Data API v3 client the scraper uses.
+# It answers commentThreads().list(...).execute() with deterministic comments and needs no key or network,
+# so scraping can be exercised and timed offline: AnalScraper.fetch_comments(FakeYouTube(), 'abc', 500)
+# comments().list(parentId=...) answers the replies of a thread
+import json
+import random
+import threading
+import time
+import httplib2
+from googleapiclient.errors import HttpError
+from datetime import datetime, timedelta, timezone
+
+words = ['this', 'song', 'is', 'amazing', 'video', 'great', 'love', 'the', 'first', 'time', 'bad', 'news',
+         'game', 'lol', 'who', 'here', 'in', 'best', 'worst', 'ever', 'really', 'good', 'not', 'so', 'much']
+
+
+# Request object, the real client also only runs the call on execute()
+class FakeRequest:
+    def __init__(self, handler, kwargs):
+        self.handler = handler
+        self.kwargs = kwargs
+
+    def execute(self):
+        return self.handler(**self.kwargs)
+
+
+class FakeCommentThreads:
+    def __init__(self, api):
+        self.api = api
+
+    def list(self, **kwargs):
+        return FakeRequest(self.api.list_comment_threads, kwargs)
+
+
+class FakeComments:
+    def __init__(self, api):
+        self.api = api
+
+    def list(self, **kwargs):
+        return FakeRequest(self.api.list_comments, kwargs)
+
+
+# Function to build the HttpError the real client raises, with the API's JSON error body
+def make_http_error(status, reason, message):
+    content = json.dumps({'error': {'code': status, 'message': message,
+                                    'errors': [{'reason': reason, 'domain': 'youtube', 'message': message}]}})
+    return HttpError(httplib2.Response({'status': status, 'reason': message}), content.encode('utf-8'))
+
+
+class FakeYouTube:
+    # comments_per_video can be an int or {video_id: count}; latency is seconds slept per request.
+    # Fault injection: error_rate is the share of requests that fail with a transient 5xx/429 error,
+    # quota is the number of requests answered before every request fails with quotaExceeded (see reset_quota)
+    # reply_rate is the share of threads that have replies, max_replies the most replies a thread has.
+    # texts replaces the random word salad of top-level comments, comment n gets texts[n % len(texts)]
+    def __init__(self, comments_per_video=1000, latency=0.0, seed=0, error_rate=0.0, quota=None, reply_rate=0.2,
+                 max_replies=40, texts=None):
+        self.comments_per_video = comments_per_video
+        self.texts = texts
+        self.reply_rate = reply_rate
+        self.max_replies = max_replies
+        self.latency = latency
+        self.seed = seed
+        self.error_rate = error_rate
+        self.quota = quota
+        self.request_count = 0
+        self.error_count = 0
+        self.errors = random.Random(f'{seed}:errors')
+        self.lock = threading.Lock()
+
+    # Function to give the fake a new daily quota, like midnight Pacific time does
+    def reset_quota(self, quota=None):
+        with self.lock:
+            self.quota = quota
+
+    # Function to fail a request the way the real API does, counted like the real one counts them
+    def inject_fault(self):
+        with self.lock:
+            self.request_count += 1
+            if self.quota is not None:
+                if self.quota <= 0:
+                    self.error_count += 1
+                    raise make_http_error(403, 'quotaExceeded', 'The request cannot be completed because you '
+                                                                'have exceeded your quota.')
+                self.quota -= 1
+            if self.error_rate and self.errors.random() < self.error_rate:
+                self.error_count += 1
+                status, reason = self.errors.choice([(500, 'backendError'), (503, 'backendError'),
+                                                     (429, 'rateLimitExceeded')])
+                raise make_http_error(status, reason, 'Injected transient error')
+
+    def commentThreads(self):
+        return FakeCommentThreads(self)
+
+    def comments(self):
+        return FakeComments(self)
+
+    def comment_count(self, video_id):
+        if isinstance(self.comments_per_video, dict):
+            return self.comments_per_video.get(video_id, 0)
+        return self.comments_per_video
+
+    # Function to get the number of replies of a thread, from its own random stream so comment texts don't change
+    def reply_count(self, video_id, serial):
+        rng = random.Random(f'{self.seed}:{video_id}:{serial}:replies')
+        if rng.random() >= self.reply_rate:
+            return 0
+        # most threads with replies have a few, some have long discussions
+        return min(self.max_replies, int(rng.paretovariate(1.2)))
+
+    def make_text(self, key):
+        rng = random.Random(key)
+        return ' '.join(rng.choice(words) for _ in range(rng.randint(1, 30)))
+
+    # Function to build a reply of a thread from its index (0 is the oldest reply)
+    def make_reply(self, video_id, serial, index):
+        text = self.make_text(f'{self.seed}:{video_id}:{serial}:reply:{index}')
+        published = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=serial, seconds=index + 1)
+        return {
+            'id': f'{video_id}.{serial}.{index}',
+            'snippet': {
+                'videoId': video_id,
+                'parentId': f'{video_id}.{serial}',
+                'textDisplay': text,
+                'textOriginal': text,
+                'publishedAt': published.strftime('%Y-%m-%dT%H:%M:%SZ')
+            }
+        }
+
+    # Function to build a comment from its serial number (0 is the oldest), the same every time it is asked for.
+    # Raising comments_per_video adds newer comments on top, like new comments arriving on a real video
+    def make_comment(self, video_id, serial, replies=False):
+        text = self.texts[serial % len(self.texts)] if self.texts else self.make_text(f'{self.seed}:{video_id}:{serial}')
+        published = datetime(2024, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=serial)
+        reply_count = self.reply_count(video_id, serial)
+        thread = {
+            'id': f'{video_id}.{serial}',
+            'snippet': {
+                'videoId': video_id,
+                'topLevelComment': {
+                    'id': f'{video_id}.{serial}',
+                    'snippet': {
+                        'textDisplay': text,
+                        'textOriginal': text,
+                        'publishedAt': published.strftime('%Y-%m-%dT%H:%M:%SZ')
+                    }
+                },
+                'totalReplyCount': reply_count
+            }
+        }
+        # like the real API, part=replies only carries up to 5 replies, the rest need comments().list
+        if replies and reply_count:
+            thread['replies'] = {'comments': [self.make_reply(video_id, serial, index)
+                                              for index in range(min(5, reply_count))]}
+        return thread
+
+    def list_comment_threads(self, part, videoId, pageToken=None, maxResults=20, order='relevance', **kwargs):
+        self.inject_fault()
+        if self.latency:
+            time.sleep(self.latency)
+        total = self.comment_count(videoId)
+        start = int(pageToken) if pageToken else 0
+        end = min(start + maxResults, total)
+        # newest first for every order, which is what order='time' promises
+        response = {
+            'kind': 'youtube#commentThreadListResponse',
+            'items': [self.make_comment(videoId, total - 1 - position, 'replies' in part)
+                      for position in range(start, end)]
+        }
+        if end < total:
+            response['nextPageToken'] = str(end)
+        return response
+
+    # replies of a thread, oldest first
+    def list_comments(self, part, parentId, pageToken=None, maxResults=20, **kwargs):
+        self.inject_fault()
+        if self.latency:
+            time.sleep(self.latency)
+        video_id, serial = parentId.rsplit('.', 1)
+        total = self.reply_count(video_id, int(serial))
+        start = int(pageToken) if pageToken else 0
+        end = min(start + maxResults, total)
+        response = {
+            'kind': 'youtube#commentListResponse',
+            'items': [self.make_reply(video_id, int(serial), index) for index in range(start, end)]
+        }
+        if end < total:
+            response['nextPageToken'] = str(end)
+        return response
@@ -0,0 +1,154 @@
+# Incremental re-analysis of a video: only comments newer than the last run are fetched, tagged and scored,
+# and their counts are merged into the aggregates stored for the video. The report is then built from those
+# aggregates, so a daily refresh costs as much as the new comments, not the whole video.
+import os
+import sys
+import json
+import hashlib
+from collections import Counter
+from datetime import datetime, timezone
+from googleapiclient.discovery import build
+import AnalScraper
+import POSTagging
+import TextProcessing
+import SentimentTimeline
+
+#needed for the ML_Anal
+sys.path.append(os.path.join(os.path.dirname(__file__), '../models/sentiment_analysis'))
+import ML_Anal
+
+state_dir = '../data/state'
+
+
+def state_path(video_id):
+    return os.path.join(state_dir, f'{video_id}.json')
+
+
+def empty_state(video_id):
+    return {
+        'video_id': video_id,
+        'newest_published_at': None,
+        'seen_ids': [],
+        # hashes of comment texts, so duplicates are dropped across runs like remove_duplicate_comments does
+        'seen_texts': [],
+        'sentiment_counts': {'0': 0, '1': 0, '2': 0},
+        'nouns': {},
+        'adjectives': {},
+        'updated_at': None
+    }
+
+
+def load_state(video_id):
+    try:
+        with open(state_path(video_id), 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return empty_state(video_id)
+
+
+def save_state(state):
+    os.makedirs(state_dir, exist_ok=True)
+    path = state_path(state['video_id'])
+    # write to a temporary file first, so a crash never corrupts the stored aggregates
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(state, file)
+    os.replace(temp_path, path)
+
+
+def text_hash(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+# Function to fetch the comments posted since the last run. With order='time' the newest comments come first,
+# so fetching stops at the first known comment that isn't newer than the newest one already analyzed
+def fetch_new_comments(youtube, video_id, state, max_comments):
+    seen_ids = set(state['seen_ids'])
+    newest = state['newest_published_at']
+    new_comments = []
+    pages = AnalScraper.iter_comment_pages(youtube, video_id, max_comments, order='time')
+    for page in pages:
+        reached_known = False
+        for comment in page:
+            if comment['CommentID'] in seen_ids:
+                if newest is None or (comment['PublishedAt'] or '') <= newest:
+                    reached_known = True
+                    break
+                continue
+            new_comments.append(comment)
+        if reached_known:
+            pages.close()
+            break
+    return new_comments
+
+
+# Function to fetch, tag and score only the new comments and merge them into the stored aggregates
+def update_video(youtube, video_id, max_comments=float('inf')):
+    state = load_state(video_id)
+    new_comments = fetch_new_comments(youtube, video_id, state, max_comments)
+
+    seen_texts = set(state['seen_texts'])
+    delta = []
+    delta_ids = []
+    delta_published = []
+    for comment in new_comments:
+        key = text_hash(comment['Comment'])
+        if key not in seen_texts:
+            seen_texts.add(key)
+            delta.append(comment['Comment'])
+            delta_ids.append(comment['CommentID'])
+            delta_published.append(comment['PublishedAt'])
+    print(f'{len(new_comments)} new comments for video {video_id}, {len(delta)} after dedup')
+
+    sentiment_counts = Counter({int(label): count for label, count in state['sentiment_counts'].items()})
+    noun_counter = Counter(state['nouns'])
+    adj_counter = Counter(state['adjectives'])
+    # the counts over time go into the timeline every run of the video adds to, full or incremental
+    timeline = SentimentTimeline.load_timeline(video_id)
+    if delta:
+        # one tokenizer pass gives the words for POS tagging and the IDs for the sentiment model
+        words, input_ids = TextProcessing.tokenize_comments(delta)
+        if POSTagging.word_tokenizer != 'fast':
+            words = POSTagging.tokenize(delta)
+        class_ids = ML_Anal.score_comments(delta, input_ids)
+        sentiment_counts.update(class_ids)
+        timeline.add(delta_ids, delta_published, class_ids)
+        POSTagging.count_tokenized(words, POSTagging.get_model(), noun_counter, adj_counter)
+
+    published = [comment['PublishedAt'] for comment in new_comments if comment['PublishedAt']]
+    if state['newest_published_at']:
+        published.append(state['newest_published_at'])
+    state['newest_published_at'] = max(published) if published else None
+    state['seen_ids'].extend(comment['CommentID'] for comment in new_comments)
+    state['seen_texts'] = list(seen_texts)
+    state['sentiment_counts'] = {str(label): sentiment_counts[label] for label in (0, 1, 2)}
+    state['nouns'] = dict(noun_counter)
+    state['adjectives'] = dict(adj_counter)
+    state['updated_at'] = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    save_state(state)
+    SentimentTimeline.save_timeline(timeline)
+    return state
+
+
+# Function to build the report inputs from stored aggregates, no scraping or scoring involved
+def report_from_state(state):
+    counts = state['sentiment_counts']
+    total_comments = sum(counts.values())
+    if total_comments:
+        positive_percentage = counts['1'] / total_comments
+        neutral_percentage = counts['0'] / total_comments
+        negative_percentage = counts['2'] / total_comments
+    else:
+        positive_percentage = neutral_percentage = negative_percentage = 0
+    top_nouns = Counter(state['nouns']).most_common(100)
+    top_adjectives = Counter(state['adjectives']).most_common(100)
+    return top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage
+
+
+# Function to refresh a video incrementally, the incremental counterpart of the steps in main.main
+def run_incremental(api_key, video_url, max_comments, youtube=None):
+    youtube = youtube or build('youtube', 'v3', developerKey=api_key)
+    video_id = AnalScraper.extract_video_id(video_url)
+    state = update_video(youtube, video_id, AnalScraper.parse_max_comments(max_comments))
+    print(f'Stored aggregates for video {video_id} cover {sum(state["sentiment_counts"].values())} comments')
+    return report_from_state(state)
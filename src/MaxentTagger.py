@@ -0,0 +1,109 @@
+# Vectorized scoring for the NLTK MaxEnt POS tagger (models/pos_tagging/train_maxent_pos_tagger.py).
+# NLTK classifies one feature dict at a time in pure Python. Here the classifier's weights are compiled once into
+# a feature-hashed sparse matrix W (hash buckets x labels), and a whole batch of tokens is scored with a single
+# sparse product X @ W, where X has a 1 in the bucket of every active feature of every token.
+import zlib
+import numpy as np
+from scipy import sparse
+
+# 4M buckets: the ~30k distinct (feature, value) pairs of the treebank model rarely share a bucket
+default_buckets = 2 ** 22
+
+# words whose buckets are remembered, keeps the caches bounded on huge vocabularies
+cache_limit = 500000
+
+# features that don't depend on the position of the word in the sentence
+static_features = ['word', 'is_capitalized', 'is_all_caps', 'is_all_lower', 'prefix-1', 'prefix-2', 'prefix-3',
+                   'suffix-1', 'suffix-2', 'suffix-3', 'has_hyphen', 'is_numeric', 'capitals_inside']
+
+
+# Function to hash a (feature name, value) pair into a bucket, repr keeps the string 'True' apart from True
+def feature_bucket(fname, fval, buckets):
+    return zlib.crc32(f'{fname}\0{fval!r}'.encode('utf-8')) % buckets
+
+
+class VectorizedMaxent:
+    def __init__(self, classifier, buckets=default_buckets):
+        encoding = classifier._encoding
+        if getattr(encoding, '_unseen', None):
+            raise ValueError('MaxEnt encodings with unseen_features are not supported by the vectorized backend')
+        self.buckets = buckets
+        self.labels = list(encoding.labels())
+        label_index = {label: i for i, label in enumerate(self.labels)}
+        weights = classifier.weights()
+
+        rows = []
+        cols = []
+        values = []
+        pair_buckets = {}
+        for (fname, fval, label), index in encoding._mapping.items():
+            if (fname, fval) not in pair_buckets:
+                pair_buckets[fname, fval] = feature_bucket(fname, fval, buckets)
+            rows.append(pair_buckets[fname, fval])
+            cols.append(label_index[label])
+            values.append(weights[index])
+        # (feature, value) pairs that hash into the same bucket get their weights summed, that's the hashing trick
+        self.weights = sparse.csr_matrix((np.array(values, dtype=np.float32), (rows, cols)),
+                                         shape=(buckets, len(self.labels)))
+        # number of (feature, value) pairs sharing a bucket with another one
+        self.collisions = len(pair_buckets) - len(set(pair_buckets.values()))
+
+        # always-on features act as a per-label bias
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+        for label, index in (getattr(encoding, '_alwayson', None) or {}).items():
+            self.bias[label_index[label]] = weights[index]
+
+        # bucket lists of words and neighbour words, cached because comment vocabularies repeat a lot
+        self.word_cache = {}
+        self.prev_cache = {}
+        self.next_cache = {}
+
+    # Function to get the buckets of the position independent features of a word (same values as get_word_features)
+    def word_buckets(self, word):
+        buckets = self.word_cache.get(word)
+        if buckets is None:
+            values = [word, word[0].upper() == word[0], word.upper() == word, word.lower() == word,
+                      word[0], word[:2], word[:3], word[-1], word[-2:], word[-3:],
+                      '-' in word, word.isdigit(), word[1:].lower() != word[1:]]
+            buckets = [feature_bucket(fname, fval, self.buckets) for fname, fval in zip(static_features, values)]
+            if len(self.word_cache) < cache_limit:
+                self.word_cache[word] = buckets
+        return buckets
+
+    def neighbour_bucket(self, cache, fname, word):
+        bucket = cache.get(word)
+        if bucket is None:
+            bucket = feature_bucket(fname, word, self.buckets)
+            if len(cache) < cache_limit:
+                cache[word] = bucket
+        return bucket
+
+    # Function to predict POS tags for many sentences with one sparse matrix product
+    def tag_sentences(self, sentences):
+        first = [feature_bucket('is_first', value, self.buckets) for value in (False, True)]
+        last = [feature_bucket('is_last', value, self.buckets) for value in (False, True)]
+        indices = []
+        indptr = [0]
+        for sentence in sentences:
+            end = len(sentence) - 1
+            for i, word in enumerate(sentence):
+                indices.extend(self.word_buckets(word))
+                indices.append(first[i == 0])
+                indices.append(last[i == end])
+                indices.append(self.neighbour_bucket(self.prev_cache, 'prev_word', sentence[i - 1] if i > 0 else ''))
+                indices.append(self.neighbour_bucket(self.next_cache, 'next_word', sentence[i + 1] if i < end else ''))
+                indptr.append(len(indices))
+        if len(indptr) == 1:
+            return [[] for _ in sentences]
+
+        features = sparse.csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr),
+                                     shape=(len(indptr) - 1, self.buckets))
+        scores = (features @ self.weights).toarray() + self.bias
+        best = scores.argmax(axis=1)
+
+        results = []
+        position = 0
+        for sentence in sentences:
+            results.append([self.labels[label] for label in best[position:position + len(sentence)]])
+            position += len(sentence)
+        return results
@@ -0,0 +1,341 @@
+# Lightweight tracing and metrics for the analysis stages: spans (timed, nested blocks of work), counters
+# (comments, tokens, requests, cache hits) and the memory high-water mark, exported as Prometheus text or as
+# OpenTelemetry (OTLP) JSON. Everything is off until enabled: span() then returns a shared no-op object and
+# count() returns at once, so the instrumented code pays one global lookup per page or batch.
+# Usage:
+#   Metrics.enable()
+#   with Metrics.span('pos.batch', comments=len(batch)):
+#       ...
+#   Metrics.count('pos_tokens', token_count)
+#   Metrics.export('metrics.prom')  # or metrics.json for OTLP JSON
+import os
+import re
+import sys
+import json
+import time
+import threading
+from collections import Counter
+
+enabled = False
+service_name = 'youtube-comment-analysis'
+# prefix of the Prometheus metric names
+prefix = 'ytca'
+# finished spans kept for the OTLP export, the per-span totals are kept either way
+max_spans = 100000
+
+# throughputs in the exports and the summary: counter / seconds spent in the span that does that work
+rates = {
+    'api_comments': 'scrape.request',
+    'pos_comments': 'pos.batch',
+    'pos_tokens': 'pos.batch',
+    'sentiment_comments': 'sentiment.batch',
+    'sentiment_tokens': 'sentiment.batch'
+}
+
+lock = threading.Lock()
+# (name, ((label, value), ...)) -> value
+counters = Counter()
+# span name -> [count, total seconds, max seconds, errors]
+span_totals = {}
+spans = []
+peak_rss = 0
+started_at = None
+# functions called at export that return {stat: value} of counters kept elsewhere (cache stats), and per
+# collector the stats that are current values (sizes, ratios) rather than running totals, exported as gauges
+collectors = {}
+collector_gauges = {}
+local = threading.local()
+
+name_pattern = re.compile(r'[^a-zA-Z0-9_]')
+
+
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+null_span = NullSpan()
+
+
+class Span:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = getattr(local, 'stack', None)
+        if stack is None:
+            stack = local.stack = []
+        parent = stack[-1] if stack else None
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.span_id = os.urandom(8).hex()
+        stack.append(self)
+        self.start = time.time_ns()
+        self.start_time = time.perf_counter()
+        return self
+
+    # Function to add attributes known only once the work is done (comment counts, cache hits)
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start_time
+        local.stack.pop()
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        rss = current_peak_rss()
+        global peak_rss
+        with lock:
+            totals = span_totals.setdefault(self.name, [0, 0.0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] = max(totals[2], seconds)
+            totals[3] += exc_type is not None
+            if rss:
+                peak_rss = max(peak_rss, rss)
+            if len(spans) < max_spans:
+                if rss:
+                    self.attributes['process.peak_rss_bytes'] = rss
+                spans.append({'name': self.name, 'trace_id': self.trace_id, 'span_id': self.span_id,
+                              'parent_id': self.parent_id, 'start': self.start,
+                              'end': self.start + int(seconds * 1e9), 'attributes': self.attributes})
+        return False
+
+
+# Function to time a block of work, nested spans become children of the enclosing one (per thread)
+def span(name, **attributes):
+    if not enabled:
+        return null_span
+    return Span(name, attributes)
+
+
+def count(name, value=1, **labels):
+    if not enabled:
+        return
+    with lock:
+        counters[(name, tuple(sorted(labels.items())))] += value
+
+
+# Function to export counters kept by another module, fn returns {stat: value}, the stats named in gauges can go
+# down (cache entries, hit rate)
+def register_collector(name, fn, gauges=()):
+    collectors[name] = fn
+    collector_gauges[name] = set(gauges)
+
+
+# Function to get the peak resident memory of the process in bytes, None where the platform can't tell
+def current_peak_rss():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def enable():
+    global enabled, started_at
+    enabled = True
+    started_at = started_at or time.time_ns()
+
+
+def reset():
+    global peak_rss, started_at
+    with lock:
+        counters.clear()
+        span_totals.clear()
+        spans.clear()
+        peak_rss = 0
+        started_at = time.time_ns() if enabled else None
+
+
+# Function to get the stats of every collector, split into running totals and gauges, as
+# ([(name, labels, value)], [(name, labels, value)]). Totals share one metric with a stat label, every gauge is a
+# metric of its own (a size and a ratio don't add up)
+def collected_stats():
+    totals = []
+    gauges = []
+    for name, fn in collectors.items():
+        try:
+            stats = fn()
+        except Exception:
+            # a collector whose module never loaded its cache has nothing to report
+            continue
+        for stat, value in stats.items():
+            if stat in collector_gauges[name]:
+                gauges.append((f'{name}_{stat}', {}, value))
+            else:
+                totals.append((name, {'stat': stat}, value))
+    return totals, gauges
+
+
+# Function to get every counter, the collected ones included, as [(name, labels, value)]
+def all_counters():
+    with lock:
+        result = [(name, dict(labels), value) for (name, labels), value in counters.items()]
+    return result + collected_stats()[0]
+
+
+# Function to get the collected gauges (cache sizes, hit rates) as [(name, labels, value)]
+def all_gauges():
+    return collected_stats()[1]
+
+
+def throughputs():
+    result = {}
+    with lock:
+        for counter_name, span_name in rates.items():
+            seconds = span_totals.get(span_name, [0, 0.0])[1]
+            total = sum(value for (name, _), value in counters.items() if name == counter_name)
+            if seconds and total:
+                result[f'{counter_name}_per_second'] = total / seconds
+    return result
+
+
+def metric_name(name):
+    return f'{prefix}_{name_pattern.sub("_", name)}'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{name_pattern.sub("_", key)}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+# Function to render everything in the Prometheus text format (a file for node_exporter's textfile collector,
+# or the body of a /metrics endpoint)
+def prometheus_text():
+    lines = []
+    by_name = {}
+    for name, labels, value in all_counters():
+        by_name.setdefault(name, []).append((labels, value))
+    for name, samples in sorted(by_name.items()):
+        full_name = f'{metric_name(name)}_total'
+        lines.append(f'# TYPE {full_name} counter')
+        lines.extend(f'{full_name}{format_labels(labels)} {value}' for labels, value in samples)
+    by_name = {}
+    for name, labels, value in all_gauges():
+        by_name.setdefault(name, []).append((labels, value))
+    for name, samples in sorted(by_name.items()):
+        lines.append(f'# TYPE {metric_name(name)} gauge')
+        lines.extend(f'{metric_name(name)}{format_labels(labels)} {value}' for labels, value in samples)
+
+    with lock:
+        totals = sorted(span_totals.items())
+    if totals:
+        duration = metric_name('span_duration_seconds')
+        lines.append(f'# TYPE {duration} summary')
+        for name, (calls, seconds, _, _) in totals:
+            lines.append(f'{duration}_count{format_labels({"span": name})} {calls}')
+            lines.append(f'{duration}_sum{format_labels({"span": name})} {seconds:.6f}')
+        lines.append(f'# TYPE {duration}_max gauge')
+        lines.extend(f'{duration}_max{format_labels({"span": name})} {longest:.6f}'
+                     for name, (_, _, longest, _) in totals)
+        lines.append(f'# TYPE {metric_name("span_errors_total")} counter')
+        lines.extend(f'{metric_name("span_errors_total")}{format_labels({"span": name})} {errors}'
+                     for name, (_, _, _, errors) in totals)
+
+    for name, value in sorted(throughputs().items()):
+        lines.append(f'# TYPE {metric_name(name)} gauge')
+        lines.append(f'{metric_name(name)} {value:.3f}')
+    lines.append(f'# TYPE {metric_name("peak_rss_bytes")} gauge')
+    lines.append(f'{metric_name("peak_rss_bytes")} {max(peak_rss, current_peak_rss() or 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+def otel_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otel_attributes(attributes):
+    return [{'key': key, 'value': otel_value(value)} for key, value in attributes.items()]
+
+
+# Function to build the OTLP JSON payloads (ExportTraceServiceRequest and ExportMetricsServiceRequest)
+def otel_json():
+    resource = {'attributes': otel_attributes({'service.name': service_name, 'process.pid': os.getpid()})}
+    scope = {'name': 'Metrics'}
+    with lock:
+        finished = list(spans)
+    traces = {'resourceSpans': [{'resource': resource, 'scopeSpans': [{'scope': scope, 'spans': [
+        dict({'traceId': record['trace_id'], 'spanId': record['span_id'], 'name': record['name'], 'kind': 1,
+              'startTimeUnixNano': str(record['start']), 'endTimeUnixNano': str(record['end']),
+              'attributes': otel_attributes(record['attributes']),
+              'status': {'code': 2 if 'error' in record['attributes'] else 1}},
+             **({'parentSpanId': record['parent_id']} if record['parent_id'] else {}))
+        for record in finished]}]}]}
+
+    now = str(time.time_ns())
+    start = str(started_at or now)
+    by_name = {}
+    for name, labels, value in all_counters():
+        by_name.setdefault(name, []).append({'attributes': otel_attributes(labels), 'startTimeUnixNano': start,
+                                             'timeUnixNano': now, **otel_value(value)})
+    metrics = [{'name': name, 'sum': {'dataPoints': points, 'aggregationTemporality': 2, 'isMonotonic': True}}
+               for name, points in sorted(by_name.items())]
+    by_name = {}
+    for name, labels, value in all_gauges():
+        by_name.setdefault(name, []).append({'attributes': otel_attributes(labels), 'timeUnixNano': now,
+                                             **otel_value(value)})
+    metrics.extend({'name': name, 'gauge': {'dataPoints': points}} for name, points in sorted(by_name.items()))
+    with lock:
+        totals = sorted(span_totals.items())
+    if totals:
+        metrics.append({'name': 'span.duration', 'unit': 's', 'summary': {'dataPoints': [
+            {'attributes': otel_attributes({'span': name}), 'startTimeUnixNano': start, 'timeUnixNano': now,
+             'count': str(calls), 'sum': seconds,
+             'quantileValues': [{'quantile': 1.0, 'value': longest}]}
+            for name, (calls, seconds, longest, _) in totals]}})
+    gauges = dict(throughputs(), peak_rss_bytes=max(peak_rss, current_peak_rss() or 0))
+    metrics.extend({'name': name, 'gauge': {'dataPoints': [{'timeUnixNano': now, **otel_value(value)}]}}
+                   for name, value in gauges.items())
+    return traces, {'resourceMetrics': [{'resource': resource, 'scopeMetrics': [{'scope': scope,
+                                                                                  'metrics': metrics}]}]}
+
+
+# Function to write the metrics to a file: OTLP JSON lines (traces, then metrics, the layout of the
+# OpenTelemetry collector's file exporter) for .json/.jsonl, Prometheus text otherwise
+def export(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        if path.endswith(('.json', '.jsonl')):
+            for payload in otel_json():
+                file.write(json.dumps(payload) + '\n')
+        else:
+            file.write(prometheus_text())
+    os.replace(temp_path, path)
+    return path
+
+
+# Function to build a short report of where the time went, slowest spans first
+def summary(limit=15):
+    with lock:
+        totals = sorted(span_totals.items(), key=lambda item: -item[1][1])[:limit]
+    lines = [f'{"span":<24}{"calls":>8}{"total s":>10}{"mean ms":>10}{"max ms":>10}']
+    for name, (calls, seconds, longest, _) in totals:
+        lines.append(f'{name:<24}{calls:>8}{seconds:>10.2f}{seconds / calls * 1000:>10.1f}{longest * 1000:>10.1f}')
+    for name, value in sorted(throughputs().items()):
+        lines.append(f'{name}: {value:,.0f}')
+    peak = max(peak_rss, current_peak_rss() or 0)
+    if peak:
+        lines.append(f'peak RSS: {peak / 2 ** 20:.0f} MB')
+    return '\n'.join(lines)
@@ -0,0 +1,62 @@
+import time
+import threading
+
+# Models are loaded on first use and kept for the life of the process
+loaders = {}
+models = {}
+# Seconds spent loading each model, used by the startup profile
+load_times = {}
+# Seconds spent in other startup steps (imports etc.), in the order they were recorded
+startup_times = {}
+
+_lock = threading.Lock()
+
+
+# Function to register how a model is loaded, nothing is loaded until get() is called
+def register(name, loader):
+    loaders[name] = loader
+
+
+# Function to get a model, loading it the first time it is asked for
+def get(name, loader=None):
+    if name in models:
+        return models[name]
+    with _lock:
+        # another thread may have loaded it while we were waiting
+        if name not in models:
+            if loader is not None and name not in loaders:
+                register(name, loader)
+            if name not in loaders:
+                raise KeyError(f"No loader registered for model '{name}'")
+            start_time = time.perf_counter()
+            models[name] = loaders[name]()
+            load_times[name] = time.perf_counter() - start_time
+    return models[name]
+
+
+def is_loaded(name):
+    return name in models
+
+
+# Function to drop a loaded model so the next get() loads it again
+def unload(name):
+    with _lock:
+        models.pop(name, None)
+        load_times.pop(name, None)
+
+
+# Function to record the duration of a startup step that isn't a model load
+def record(step, seconds):
+    startup_times[step] = startup_times.get(step, 0) + seconds
+
+
+# Function to build the --startup-profile report
+def startup_report():
+    lines = ['Startup profile:']
+    for step, seconds in startup_times.items():
+        lines.append(f'  {step:<40}{seconds:>8.3f} s')
+    for name, seconds in load_times.items():
+        lines.append(f'  {"load " + name:<40}{seconds:>8.3f} s')
+    total = sum(startup_times.values()) + sum(load_times.values())
+    lines.append(f'  {"total":<40}{total:>8.3f} s')
+    return '\n'.join(lines)
@@ -0,0 +1,154 @@
+# Near-duplicate filtering with MinHash and LSH, for copy-paste bot floods that only differ by a few characters
+# (an added emoji, changed punctuation or casing, a typo, an extra word). Every comment gets a MinHash signature
+# of its character 4-grams, computed for whole chunks of comments at once with numpy. The first
+# band_count * band_size values of a signature are cut into bands, and comments that share a band with a kept
+# comment are candidates. A candidate is dropped when the signatures estimate a Jaccard similarity of at least
+# threshold with that comment and both contain the same numbers.
+# Only kept comments are stored (their signature and one dict entry per band), so time and memory grow
+# linearly with the number of comments.
+import re
+import numpy as np
+
+# estimated Jaccard similarity of the 4-gram sets from which comments count as near-duplicates. Real comments
+# that differ by one word ('I love it' / 'I hate it') stay below it, bot copies with small edits are above it
+default_threshold = 0.85
+# shorter comments ('first', 'love this song so much') are only deduplicated exactly, short reactions are
+# often alike without being copies
+default_min_length = 30
+shingle_size = 4
+# signature length, and the bands used to find candidates (10 bands of 3 catch ~99% of pairs at 0.85)
+num_perm = 64
+band_count = 10
+band_size = 3
+# characters hashed per numpy chunk, bounds the memory of the (num_perm x shingles) matrix
+chunk_chars = 100000
+
+non_word_pattern = re.compile(r'[\W_]+')
+number_pattern = re.compile(r'\d+')
+
+# random odd multipliers and offsets of the hash functions, fixed so signatures are the same in every run
+generator = np.random.default_rng(12345)
+multipliers = generator.integers(1, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+offsets = generator.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+
+
+# Function to normalize a comment before hashing: lowercase, punctuation and extra spaces removed
+def normalize(text):
+    return non_word_pattern.sub(' ', text.lower()).strip()
+
+
+# Function to get the numbers of a normalized comment as one key. Comments with different numbers are never
+# near-duplicates ('still here in 2024' / 'still here in 2025'), a changed digit barely changes the 4-grams
+def number_key(text):
+    return hash(tuple(number_pattern.findall(text)))
+
+
+# Function to get the MinHash signature of every text, returns the indexes of the texts long enough to be
+# compared, their signatures (one row each) and their number keys
+def minhashes(texts, min_length=default_min_length):
+    indexes = []
+    signatures = []
+    numbers = []
+    chunk = []
+    size = 0
+    for index, text in enumerate(texts):
+        text = normalize(text)
+        if len(text) < max(min_length, shingle_size):
+            continue
+        chunk.append(text)
+        indexes.append(index)
+        numbers.append(number_key(text))
+        size += len(text) + 1
+        if size >= chunk_chars:
+            signatures.append(hash_chunk(chunk))
+            chunk = []
+            size = 0
+    if chunk:
+        signatures.append(hash_chunk(chunk))
+    if not signatures:
+        return indexes, np.zeros((0, num_perm), dtype=np.uint32), numbers
+    return indexes, np.concatenate(signatures), numbers
+
+
+# Function to compute the signatures of a chunk of texts with one pass of numpy over all their characters
+def hash_chunk(texts):
+    # texts joined by a separator, no shingle may contain it
+    codes = np.frombuffer('\0'.join(texts).encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+    windows = len(codes) - shingle_size + 1
+    valid = np.ones(windows, dtype=bool)
+    hashes = np.zeros(windows, dtype=np.uint64)
+    for offset in range(shingle_size):
+        window = codes[offset:offset + windows]
+        valid &= window != 0
+        hashes = (hashes ^ window) * np.uint64(0x9E3779B97F4A7C15)
+    hashes ^= hashes >> np.uint64(29)
+
+    # text of every shingle, from the separator positions
+    text_ids = np.cumsum(codes == 0)[:windows][valid]
+    hashes = hashes[valid]
+    # multiply-shift hashing, one row per hash function (rows make reduceat about 3x faster than columns)
+    values = (multipliers[:, None] * hashes + offsets[:, None]) >> np.uint64(32)
+    # texts are at least shingle_size long, so no reduceat segment is empty
+    starts = np.searchsorted(text_ids, np.arange(len(texts)))
+    return np.minimum.reduceat(values, starts, axis=1).T.astype(np.uint32)
+
+
+# Function to get the LSH key of every band of every signature, as Python ints
+def band_keys(signatures):
+    bands = signatures[:, :band_count * band_size].astype(np.uint64).reshape(len(signatures), band_count, band_size)
+    keys = np.zeros((len(signatures), band_count), dtype=np.uint64)
+    for row in range(band_size):
+        keys = (keys ^ bands[:, :, row]) * np.uint64(0x9E3779B97F4A7C15)
+    # the band number goes into the key, so one dict serves every band
+    keys ^= np.arange(band_count, dtype=np.uint64)
+    return keys.tolist()
+
+
+# Keeps the signatures of the comments kept so far, across pages or videos, and drops new comments that are
+# near-duplicates of one of them
+class NearDuplicateFilter:
+    def __init__(self, threshold=default_threshold, min_length=default_min_length):
+        self.threshold = threshold
+        self.min_length = min_length
+        # band key -> row of the first kept comment with that band
+        self.buckets = {}
+        self.signatures = np.zeros((1024, num_perm), dtype=np.uint32)
+        self.size = 0
+        self.kept = 0
+        self.dropped = 0
+
+    # Function to check one signature, remembers it when it isn't a near-duplicate of a kept one
+    def check(self, signature, keys):
+        candidates = {self.buckets[key] for key in keys if key in self.buckets}
+        if candidates:
+            rows = self.signatures[list(candidates)]
+            if (rows == signature).mean(axis=1).max() >= self.threshold:
+                return False
+        if self.size == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.zeros_like(self.signatures)])
+        self.signatures[self.size] = signature
+        for key in keys:
+            self.buckets.setdefault(key, self.size)
+        self.size += 1
+        return True
+
+    # Function to get for every text whether it is kept, the first comment of a group of near-duplicates is kept
+    def keep(self, texts):
+        results = [True] * len(texts)
+        indexes, signatures, numbers = minhashes(texts, self.min_length)
+        for index, signature, keys, key in zip(indexes, signatures, band_keys(signatures), numbers):
+            # the number key goes into the band keys, so only comments with the same numbers are candidates
+            results[index] = self.check(signature, [band ^ key for band in keys])
+        dropped = results.count(False)
+        self.dropped += dropped
+        self.kept += len(texts) - dropped
+        return results
+
+
+# Function to drop near-duplicate comment dicts, keeps the first comment of every group
+def remove_near_duplicates(comments, threshold=default_threshold, min_length=default_min_length):
+    near_filter = NearDuplicateFilter(threshold, min_length)
+    keep = near_filter.keep([comment['Comment'] for comment in comments])
+    if near_filter.dropped:
+        print(f'Dropped {near_filter.dropped} near-duplicate comments')
+    return [comment for comment, kept in zip(comments, keep) if kept]
@@ -1,81 +1,368 @@
-import pandas
 import pickle
 import nltk
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import ModelRegistry
+import CommentStore
+import Metrics
 
-def pos_tagging(csv_path):
-    # load the csv file
-    df = pandas.read_csv(csv_path)
-
-    nltk.download('punkt')
-
-    # load the pos tagging model (or alternatively use the maxent_pos_tagger.pkl)
-    with open('../models/pos_tagging/crf_pos_tagger.pkl', 'rb') as file:
-        model = pickle.load(file)
-
-    # extracts features for each word in a sentence
-    def get_word_features(sentence, i):
-        word = sentence[i]
-        features = {
-            'word': word,
-            'is_first': i == 0,  # if the word is a first word
-            'is_last': i == len(sentence) - 1,  # if the word is a last word
-            'is_capitalized': word[0].upper() == word[0],
-            'is_all_caps': word.upper() == word,  # word is in uppercase
-            'is_all_lower': word.lower() == word,  # word is in lowercase
-            # prefix of the word
-            'prefix-1': word[0],
-            'prefix-2': word[:2],
-            'prefix-3': word[:3],
-            # suffix of the word
-            'suffix-1': word[-1],
-            'suffix-2': word[-2:],
-            'suffix-3': word[-3:],
-            # extracting previous word
-            'prev_word': '' if i == 0 else sentence[i - 1],
-            # extracting next word
-            'next_word': '' if i == len(sentence) - 1 else sentence[i + 1],
-            'has_hyphen': '-' in word,  # if word has hyphen
-            'is_numeric': word.isdigit(),  # if word is in numeric
-            'capitals_inside': word[1:].lower() != word[1:]  # if capital letters in word
-        }
-        return features
-
-    # predict POS tags for a sentence
-    def predict_pos_tags(sentence, input_model):
-        features = [get_word_features(sentence, i) for i in range(len(sentence))]
-        # if CRF model
-        predicted_labels = input_model.predict([features])[0]
-        # if MaxEnt model
-        # predicted_labels = [input_model.classify(f) for f in features]
-        return list(zip(sentence, predicted_labels))
-
-    # get the x (or all by default) comments
-    x = 100
-    comments = df['Comment'].iloc[1:]  # excluding the first row (header)
+crf_model_path = '../models/pos_tagging/crf_pos_tagger.pkl'
+maxent_model_path = '../models/pos_tagging/maxent_pos_tagger.pkl'
+# 'crf' is the more accurate tagger, 'maxent' scores whole batches with one sparse matrix product and is faster
+pos_backend = 'crf'
+lexicon_path = '../models/pos_tagging/pos_lexicon.pkl'
+# 'fast' takes the words from the DistilBERT fast tokenizer (TextProcessing), 'nltk' uses nltk.word_tokenize
+word_tokenizer = 'fast'
 
-    # initialize counters for nouns and adjectives
-    noun_counter = Counter()
-    adj_counter = Counter()
 
-    # tokenize comments and predict POS tags
-    for index, comment in enumerate(comments):
-        if not isinstance(comment, str):
-            print(f"Non-string comment at index {index}: {comment} (type: {type(comment)})")
+# Function to make sure the nltk tokenizer data is there, only downloads when it is missing
+def load_punkt():
+    for resource, package in [('tokenizers/punkt', 'punkt'), ('tokenizers/punkt_tab', 'punkt_tab')]:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            nltk.download(package)
+    return True
+
+
+# Function to load the pos tagging model (or alternatively use the maxent_pos_tagger.pkl)
+def load_crf_model():
+    with open(crf_model_path, 'rb') as file:
+        return pickle.load(file)
+
+
+# Function to load the MaxEnt model and compile its weights for batch scoring
+def load_maxent_model():
+    import MaxentTagger
+    with open(maxent_model_path, 'rb') as file:
+        return MaxentTagger.VectorizedMaxent(pickle.load(file))
+
+
+# Function to get the tagging model of the selected backend, loaded once per process
+def get_model():
+    if pos_backend == 'maxent':
+        return ModelRegistry.get('maxent_pos_tagger')
+    return ModelRegistry.get('crf_pos_tagger')
+
+
+# Function to load the lexicon of unambiguous words built by models/pos_tagging/build_pos_lexicon.py
+def load_lexicon():
+    with open(lexicon_path, 'rb') as file:
+        return pickle.load(file)
+
+
+ModelRegistry.register('punkt', load_punkt)
+ModelRegistry.register('crf_pos_tagger', load_crf_model)
+ModelRegistry.register('maxent_pos_tagger', load_maxent_model)
+ModelRegistry.register('pos_lexicon', load_lexicon)
+
+
+# extracts features for each word in a sentence
+def get_word_features(sentence, i):
+    word = sentence[i]
+    features = {
+        'word': word,
+        'is_first': i == 0,  # if the word is a first word
+        'is_last': i == len(sentence) - 1,  # if the word is a last word
+        'is_capitalized': word[0].upper() == word[0],
+        'is_all_caps': word.upper() == word,  # word is in uppercase
+        'is_all_lower': word.lower() == word,  # word is in lowercase
+        # prefix of the word
+        'prefix-1': word[0],
+        'prefix-2': word[:2],
+        'prefix-3': word[:3],
+        # suffix of the word
+        'suffix-1': word[-1],
+        'suffix-2': word[-2:],
+        'suffix-3': word[-3:],
+        # extracting previous word
+        'prev_word': '' if i == 0 else sentence[i - 1],
+        # extracting next word
+        'next_word': '' if i == len(sentence) - 1 else sentence[i + 1],
+        'has_hyphen': '-' in word,  # if word has hyphen
+        'is_numeric': word.isdigit(),  # if word is in numeric
+        'capitals_inside': word[1:].lower() != word[1:]  # if capital letters in word
+    }
+    return features
+
+
+# position independent features of a word as crfsuite attribute strings, cached because comment vocabularies
+# repeat a lot. Same features as get_word_features: crfsuite turns {'key': 'value'} into 'key:value' and
+# {'key': True} into 'key' (False has weight 0, so it is simply left out)
+word_feature_cache = {}
+word_feature_cache_limit = 500000
+
+
+def get_static_word_features(word):
+    features = word_feature_cache.get(word)
+    if features is None:
+        features = ['word:' + word,
+                    'prefix-1:' + word[0], 'prefix-2:' + word[:2], 'prefix-3:' + word[:3],
+                    'suffix-1:' + word[-1], 'suffix-2:' + word[-2:], 'suffix-3:' + word[-3:]]
+        if word[0].upper() == word[0]:
+            features.append('is_capitalized')
+        if word.upper() == word:
+            features.append('is_all_caps')
+        if word.lower() == word:
+            features.append('is_all_lower')
+        if '-' in word:
+            features.append('has_hyphen')
+        if word.isdigit():
+            features.append('is_numeric')
+        if word[1:].lower() != word[1:]:
+            features.append('capitals_inside')
+        if len(word_feature_cache) < word_feature_cache_limit:
+            word_feature_cache[word] = features
+    return features
+
+
+# extracts crfsuite features for every word in a sentence, without building a dict per word
+def get_sentence_features(sentence):
+    last = len(sentence) - 1
+    features = []
+    for i, word in enumerate(sentence):
+        item = get_static_word_features(word) + [
+            'prev_word:' + (sentence[i - 1] if i > 0 else ''),
+            'next_word:' + (sentence[i + 1] if i < last else '')]
+        if i == 0:
+            item.append('is_first')
+        if i == last:
+            item.append('is_last')
+        features.append(item)
+    return features
+
+
+# Comment vocabularies are very Zipfian, so tagging results are memoized:
+# whole short comments are cached as they are (exact, the CRF only ever sees the comment itself)
+use_tag_cache = True
+short_comment_tokens = 8
+comment_tag_cache = {}
+comment_cache_limit = 200000
+# optional fast path: words the Penn Treebank always tags the same way skip CRF decoding, only the spans
+# between them are decoded, and those spans are cached together with the words around them
+use_lexicon = False
+span_tag_cache = {}
+span_cache_limit = 200000
+# hit/miss counters of the caches above
+tag_cache_stats = Counter()
+Metrics.register_collector('pos_tag_cache', lambda: dict(tag_cache_stats, comment_entries=len(comment_tag_cache),
+                                                         span_entries=len(span_tag_cache)),
+                           gauges=('comment_entries', 'span_entries'))
+
+
+# Function to tag a sentence where lexicon words are tagged directly and only the other spans go through the CRF.
+# Span features are taken from the whole sentence, so only the transitions across span borders are lost
+def tag_with_lexicon(sentence, tagger, lexicon):
+    labels = [lexicon.get(word) for word in sentence]
+    features = None
+    i = 0
+    while i < len(sentence):
+        if labels[i] is not None:
+            tag_cache_stats['lexicon_tokens'] += 1
+            i += 1
+            continue
+        j = i
+        while j < len(sentence) and labels[j] is None:
+            j += 1
+        # the neighbours decide prev_word/next_word and is_first/is_last of the span, so they're part of the key
+        key = (sentence[i - 1] if i > 0 else None, tuple(sentence[i:j]), sentence[j] if j < len(sentence) else None)
+        span_labels = span_tag_cache.get(key)
+        if span_labels is None:
+            if features is None:
+                features = get_sentence_features(sentence)
+            span_labels = tagger.tag(features[i:j])
+            tag_cache_stats['span_misses'] += 1
+            tag_cache_stats['crf_tokens'] += j - i
+            if len(span_tag_cache) < span_cache_limit:
+                span_tag_cache[key] = span_labels
+        else:
+            tag_cache_stats['span_hits'] += 1
+        labels[i:j] = span_labels
+        i = j
+    return labels
+
+
+# predict POS tags for many sentences, reusing the model's single crfsuite Tagger
+# instead of going through CRF.predict (and its per-call overhead) for every comment
+def tag_sentences(sentences, input_model):
+    # the MaxEnt backend tags the whole batch in one go, it's fast enough without the caches
+    if not hasattr(input_model, 'tagger_'):
+        return input_model.tag_sentences(sentences)
+    tagger = input_model.tagger_
+    lexicon = ModelRegistry.get('pos_lexicon') if use_lexicon else None
+    results = []
+    for sentence in sentences:
+        if not sentence:
+            results.append([])
             continue
-        tokens = nltk.word_tokenize(comment)
-        pos_tags = predict_pos_tags(tokens, model)
+        key = None
+        if use_tag_cache and len(sentence) <= short_comment_tokens:
+            # lexicon tags are approximate, so they never share entries with exact ones
+            key = (lexicon is not None, tuple(sentence))
+            labels = comment_tag_cache.get(key)
+            if labels is not None:
+                tag_cache_stats['comment_hits'] += 1
+                results.append(labels)
+                continue
+            tag_cache_stats['comment_misses'] += 1
+        if lexicon is not None:
+            labels = tag_with_lexicon(sentence, tagger, lexicon)
+        else:
+            labels = tagger.tag(get_sentence_features(sentence))
+            tag_cache_stats['crf_tokens'] += len(sentence)
+        if key is not None and len(comment_tag_cache) < comment_cache_limit:
+            comment_tag_cache[key] = labels
+        results.append(labels)
+    return results
+
+
+# predict POS tags for a sentence
+def predict_pos_tags(sentence, input_model):
+    # if CRF model
+    predicted_labels = tag_sentences([sentence], input_model)[0]
+    # (MaxEnt models compiled by MaxentTagger are handled by tag_sentences as well)
+    return list(zip(sentence, predicted_labels))
+
 
-        # count nouns and adjectives
-        nouns = [word for word, label in pos_tags
-                 if label in ['NN', 'NNS'] and
-                 word.lower() not in ['am', 'btw', 'get', 'youre', 'its', 'theres', 'whos', 'thats', 'i']]
-        adjectives = [word for word, label in pos_tags
-                      if label in ['JJ', 'JJR', 'JJS'] and
-                      word.lower() not in ['more', 'many', 'other', 'such', 'much', 'own', 'im', 'cant', 'didnt', 'ive','u']]
+noun_tags = {'NN', 'NNS'}
+adjective_tags = {'JJ', 'JJR', 'JJS'}
+# words the tagger likes to call nouns/adjectives that say nothing about the video
+ignored_nouns = {'am', 'btw', 'get', 'youre', 'its', 'theres', 'whos', 'thats', 'i'}
+ignored_adjectives = {'more', 'many', 'other', 'such', 'much', 'own', 'im', 'cant', 'didnt', 'ive', 'u'}
+# comments tokenized and tagged together, keeps memory bounded on huge videos
+tag_batch_size = 1000
 
+
+# Function to count the nouns and adjectives of tagged sentences. When found is a list, the (nouns, adjectives)
+# of every sentence are appended to it as well, for the per-comment results in the comments file
+def update_counters(sentences, labels, noun_counter, adj_counter, found=None):
+    for tokens, sentence_labels in zip(sentences, labels):
+        nouns = []
+        adjectives = []
+        for word, label in zip(tokens, sentence_labels):
+            if label in noun_tags:
+                if word.lower() not in ignored_nouns:
+                    nouns.append(word)
+            elif label in adjective_tags:
+                if word.lower() not in ignored_adjectives:
+                    adjectives.append(word)
         noun_counter.update(nouns)
         adj_counter.update(adjectives)
+        if found is not None:
+            found.append((nouns, adjectives))
+
+
+# Function to split comments into words with the selected tokenizer
+def tokenize(comments):
+    with Metrics.span('pos.tokenize', comments=len(comments)):
+        if word_tokenizer == 'nltk':
+            ModelRegistry.get('punkt')
+            return [nltk.word_tokenize(comment) for comment in comments]
+        import TextProcessing
+        return TextProcessing.tokenize_words(comments)
+
+
+# Function to tag already tokenized comments and add their nouns and adjectives to the counters
+def count_tokenized(sentences, model, noun_counter, adj_counter, found=None):
+    for start in range(0, len(sentences), tag_batch_size):
+        batch = sentences[start:start + tag_batch_size]
+        with Metrics.span('pos.batch', comments=len(batch)):
+            update_counters(batch, tag_sentences(batch, model), noun_counter, adj_counter, found)
+        if Metrics.enabled:
+            Metrics.count('pos_comments', len(batch))
+            Metrics.count('pos_tokens', sum(len(sentence) for sentence in batch))
+
+
+# Function to tag comments and add their nouns and adjectives to the counters
+def count_nouns_adjectives(comments, model, noun_counter, adj_counter, found=None):
+    batch = []
+    # tokenize comments, then predict POS tags batch by batch
+    for index, comment in enumerate(comments):
+        if not isinstance(comment, str):
+            print(f"Non-string comment at index {index}: {comment} (type: {type(comment)})")
+            # tagged as an empty sentence, so found stays aligned with comments
+            comment = ''
+        batch.append(comment)
+        if len(batch) >= tag_batch_size:
+            count_tokenized(tokenize(batch), model, noun_counter, adj_counter, found)
+            batch = []
+    if batch:
+        count_tokenized(tokenize(batch), model, noun_counter, adj_counter, found)
+
+
+# Function to empty the tag and feature caches, so the next batch is tagged cold (benchmarks)
+def clear_caches():
+    comment_tag_cache.clear()
+    span_tag_cache.clear()
+    word_feature_cache.clear()
+
+
+# comments per task sent to a worker process
+chunk_size = 2000
+
+
+# settings a worker process must share with the parent, spawned workers (Windows, macOS) only see the defaults
+worker_settings = ['pos_backend', 'use_lexicon', 'word_tokenizer', 'use_tag_cache', 'crf_model_path',
+                   'maxent_model_path', 'lexicon_path']
+
+
+# Function run once in every worker process. With fork the model loaded by the parent is already in the
+# registry (shared copy-on-write), with spawn it's loaded here, once per worker
+def init_worker(settings):
+    globals().update(settings)
+    get_model()
+
+
+# Function to tag one chunk of comments in a worker process, returns its own counters and per-comment results
+def tag_chunk(comments):
+    noun_counter = Counter()
+    adj_counter = Counter()
+    found = []
+    count_nouns_adjectives(comments, get_model(), noun_counter, adj_counter, found)
+    return noun_counter, adj_counter, found
+
+
+# Function to tag comments on a pool of processes (the CRF is pure Python plus crfsuite, so threads don't help)
+# and merge the per-chunk counters, chunks are merged in order so the result matches the single process one
+def count_nouns_adjectives_parallel(comments, workers, noun_counter, adj_counter, found=None):
+    comments = list(comments)
+    if workers <= 1 or len(comments) <= chunk_size:
+        count_nouns_adjectives(comments, get_model(), noun_counter, adj_counter, found)
+        return
+    # load the model before the pool starts, so forked workers inherit it (each opens its own crfsuite tagger)
+    get_model()
+    chunks = [comments[i:i + chunk_size] for i in range(0, len(comments), chunk_size)]
+    settings = {name: globals()[name] for name in worker_settings}
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(settings,)) as executor:
+        for chunk_nouns, chunk_adjectives, chunk_found in executor.map(tag_chunk, chunks):
+            noun_counter.update(chunk_nouns)
+            adj_counter.update(chunk_adjectives)
+            if found is not None:
+                found.extend(chunk_found)
+
+
+# Function to tag the comments of a comments file (AnalScraper.save_comments), stores the nouns and adjectives
+# of every comment in the file and returns the 100 most common of each
+def pos_tagging(comments_path, workers=1):
+    # read the comment texts, memory-mapped from the Arrow file
+    comments = CommentStore.read_comments(comments_path)
+
+    # loaded once per process and reused by every later call
+    model = get_model()
+
+    # initialize counters for nouns and adjectives
+    noun_counter = Counter()
+    adj_counter = Counter()
+    found = []
+
+    if workers > 1:
+        count_nouns_adjectives_parallel(comments, workers, noun_counter, adj_counter, found)
+    else:
+        count_nouns_adjectives(comments, model, noun_counter, adj_counter, found)
+
+    if not comments_path.endswith('.csv'):
+        CommentStore.add_columns(comments_path, {'Nouns': [nouns for nouns, _ in found],
+                                                 'Adjectives': [adjectives for _, adjectives in found]})
 
     # get top 100 most used nouns and adjectives
     top_100_nouns = noun_counter.most_common(100)
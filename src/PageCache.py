@@ -0,0 +1,47 @@
+import os
+import json
+import time
+import hashlib
+import threading
+
+# Raw commentThreads responses are kept on disk, so reruns and overlapping jobs replay pages
+# instead of spending API quota, e.g. to reprocess a video with a new model
+default_cache_dir = '../data/page_cache'
+default_ttl = 24 * 60 * 60  # seconds
+
+
+class PageCache:
+    def __init__(self, cache_dir=default_cache_dir, ttl=default_ttl):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    # Function to build the file of a page, keyed by (video_id, order, pageToken) and the requested parts
+    def page_path(self, video_id, order, page_token, part='snippet'):
+        name = hashlib.sha1(f'{order}|{part}|{page_token or ""}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, video_id, f'{name}.json')
+
+    # Function to get a cached response, None when it's missing or older than the TTL
+    def get(self, video_id, order, page_token, part='snippet'):
+        path = self.page_path(video_id, order, page_token, part)
+        try:
+            if self.ttl is not None and time.time() - os.path.getmtime(path) > self.ttl:
+                self.misses += 1
+                return None
+            with open(path, 'r', encoding='utf-8') as file:
+                response = json.load(file)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return response
+
+    def put(self, video_id, order, page_token, response, part='snippet'):
+        path = self.page_path(video_id, order, page_token, part)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so a crash never leaves half a page behind
+        temp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(response, file)
+        os.replace(temp_path, path)
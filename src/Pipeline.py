@@ -0,0 +1,190 @@
+# Streaming version of main: scraping, dedup, POS tagging and sentiment run at the same time,
+# connected by bounded queues, so inference starts on page 1 while later pages are still downloading.
+# Every stage only holds a page or a batch at a time, so memory doesn't grow with the number of comments
+# (apart from the 8-byte hashes and the near-duplicate signatures used for dedup, the noun/adjective counters
+# and the per-comment results that are added to the comments file at the end).
+import os
+import sys
+import queue
+import hashlib
+import threading
+from collections import Counter
+from googleapiclient.discovery import build
+import AnalScraper
+import POSTagging
+import TextProcessing
+import CommentStore
+import NearDuplicates
+import SentimentTimeline
+import Metrics
+
+#needed for the ML_Anal
+sys.path.append(os.path.join(os.path.dirname(__file__), '../models/sentiment_analysis'))
+import ML_Anal
+
+# pages buffered between two stages, the fetcher blocks when the consumers fall behind
+queue_size = 8
+# comments collected before they're sent to the sentiment model together
+sentiment_batch_size = 256
+
+# marks the end of a stream
+done = object()
+
+
+# Function to put into a queue without hanging forever when another stage has failed
+def put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+# Function to get from a queue, returns done when another stage has failed
+def get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return done
+
+
+def run_pipeline(youtube, video_id, max_comments, output_file=None, order='relevance', page_cache=None,
+                 reply_fetcher=None):
+    pages = queue.Queue(queue_size)
+    pos_pages = queue.Queue(queue_size)
+    sentiment_pages = queue.Queue(queue_size)
+    stop = threading.Event()
+    errors = []
+
+    noun_counter = Counter()
+    adj_counter = Counter()
+    sentiment_counts = {0: 0, 1: 0, 2: 0}
+    # per-comment results, in file order (every stage handles the pages in the order they were written)
+    found = []
+    class_ids = []
+
+    def fetch_stage():
+        try:
+            for page in AnalScraper.iter_comment_pages(youtube, video_id, max_comments, order,
+                                                       page_cache=page_cache, reply_fetcher=reply_fetcher):
+                put(pages, page, stop)
+                if stop.is_set():
+                    break
+        finally:
+            put(pages, done, stop)
+
+    def dedup_stage():
+        seen = set()
+        # kept across pages, so a flood spread over many pages is collapsed too
+        near_filter = NearDuplicates.NearDuplicateFilter() if AnalScraper.near_duplicates else None
+        writer = CommentStore.CommentWriter(output_file) if output_file else None
+        try:
+            while True:
+                page = get(pages, stop)
+                if page is done:
+                    break
+                unique_comments = []
+                for comment in page:
+                    key = hashlib.blake2b(comment['Comment'].encode('utf-8'), digest_size=8).digest()
+                    if key not in seen:
+                        seen.add(key)
+                        unique_comments.append(comment)
+                if near_filter:
+                    keep = near_filter.keep([comment['Comment'] for comment in unique_comments])
+                    unique_comments = [comment for comment, kept in zip(unique_comments, keep) if kept]
+                if writer:
+                    writer.write(unique_comments)
+                unique = [comment['Comment'] for comment in unique_comments]
+                # one tokenizer pass gives the words for POS tagging and the IDs for the sentiment model
+                words, input_ids = TextProcessing.tokenize_comments(unique)
+                if POSTagging.word_tokenizer != 'fast':
+                    words = POSTagging.tokenize(unique)
+                put(pos_pages, words, stop)
+                put(sentiment_pages, (unique, input_ids), stop)
+        finally:
+            put(pos_pages, done, stop)
+            put(sentiment_pages, done, stop)
+            if writer:
+                writer.close()
+            if near_filter and near_filter.dropped:
+                print(f'Dropped {near_filter.dropped} near-duplicate comments')
+
+    def pos_stage():
+        model = POSTagging.get_model()
+        while True:
+            words = get(pos_pages, stop)
+            if words is done:
+                break
+            POSTagging.count_tokenized(words, model, noun_counter, adj_counter, found)
+
+    def sentiment_stage():
+        batch = []
+        batch_ids = []
+        while True:
+            page = get(sentiment_pages, stop)
+            if page is not done:
+                batch.extend(page[0])
+                batch_ids.extend(page[1])
+            if batch and (page is done or len(batch) >= sentiment_batch_size):
+                for class_id in ML_Anal.score_comments(batch, batch_ids):
+                    sentiment_counts[class_id] += 1
+                    class_ids.append(class_id)
+                batch = []
+                batch_ids = []
+            if page is done:
+                break
+
+    # a failing stage stops the others instead of leaving them waiting on a queue
+    def run_stage(stage):
+        try:
+            with Metrics.span(f'pipeline.{stage.__name__}', video_id=video_id):
+                stage()
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=run_stage, args=(stage,), name=stage.__name__, daemon=True)
+               for stage in (fetch_stage, dedup_stage, pos_stage, sentiment_stage)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    if output_file:
+        CommentStore.add_columns(output_file, {'Nouns': [nouns for nouns, _ in found],
+                                               'Adjectives': [adjectives for _, adjectives in found],
+                                               'Sentiment': class_ids})
+        SentimentTimeline.update_from_file(output_file, video_id)
+
+    total_comments = sum(sentiment_counts.values())
+    if total_comments:
+        neutral_percentage, positive_percentage, negative_percentage = (
+            sentiment_counts[label] / total_comments for label in (0, 1, 2))
+    else:
+        neutral_percentage = positive_percentage = negative_percentage = 0
+    print(f'Positive: {positive_percentage * 100:.2f}% | Neutral: {neutral_percentage * 100:.2f}% | '
+          f'Negative: {negative_percentage * 100:.2f}% of {total_comments} comments')
+
+    return (noun_counter.most_common(100), adj_counter.most_common(100),
+            positive_percentage, neutral_percentage, negative_percentage)
+
+
+# Function to run the streaming pipeline for a video URL, the streaming counterpart of the steps in main.main
+def run_streaming(api_key, video_url, max_comments, youtube=None, page_cache=None, replies=False, reply_workers=8):
+    youtube = youtube or build('youtube', 'v3', developerKey=api_key)
+    video_id = AnalScraper.extract_video_id(video_url)
+    output_file = CommentStore.comments_path(video_id)
+    reply_fetcher = AnalScraper.ReplyFetcher(lambda: build('youtube', 'v3', developerKey=api_key), reply_workers,
+                                             page_cache=page_cache) if replies else None
+    try:
+        results = run_pipeline(youtube, video_id, AnalScraper.parse_max_comments(max_comments), output_file,
+                               page_cache=page_cache, reply_fetcher=reply_fetcher)
+    finally:
+        if reply_fetcher:
+            reply_fetcher.close()
+    print(f'Processed comments have been saved to {output_file}')
+    return results
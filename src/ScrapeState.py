@@ -0,0 +1,111 @@
+import os
+import json
+
+# Pagination progress of a video, so a scrape that crashed or ran out of quota continues from its last page
+# instead of page 1. The comments are appended to <video>.jsonl page by page and the page token and comment count
+# are kept in <video>.json. The count is only updated after a page is appended, so on resume any comments of a
+# page that was half written are dropped and that page is fetched again.
+default_state_dir = '../data/scrape_state'
+
+
+class PaginationState:
+    def __init__(self, video_id, order='relevance', state_dir=None):
+        self.video_id = video_id
+        self.order = order
+        base = os.path.join(state_dir or default_state_dir, f'{video_id}.{order}')
+        self.state_path = f'{base}.json'
+        self.comments_path = f'{base}.jsonl'
+        self.page_token = None
+        self.count = 0
+        self.pages = 0
+        # lines past count are only possible in a file left by an earlier process
+        self.checked = False
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+            self.page_token = state['page_token']
+            self.count = state['count']
+            self.pages = state['pages']
+        except (OSError, ValueError, KeyError):
+            pass
+        # no next page means the last run got to the end, so there's nothing to resume
+        if self.page_token is None:
+            self.count = 0
+            self.pages = 0
+        # the comments file was deleted or cut short while the state file was kept, the saved progress is of no
+        # use without the comments before it, so the scrape starts again from the first page
+        elif self.saved_lines() < self.count:
+            print(f'Saved comments of video {video_id} are missing, scraping it again from the first page')
+            self.clear()
+
+    # Function to count the saved comment lines, up to count
+    def saved_lines(self):
+        lines = 0
+        try:
+            with open(self.comments_path, 'r', encoding='utf-8') as file:
+                for _ in file:
+                    lines += 1
+                    if lines >= self.count:
+                        break
+        except FileNotFoundError:
+            pass
+        return lines
+
+    # True when a previous run stopped before the last page
+    def resumable(self):
+        return self.page_token is not None
+
+    # Function to read the comments saved by previous runs
+    def load_comments(self):
+        comments = []
+        if not self.resumable():
+            return comments
+        with open(self.comments_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                if len(comments) >= self.count:
+                    break
+                comments.append(json.loads(line))
+        return comments
+
+    # Function to save a fetched page and the token of the next one
+    def save_page(self, comments, next_page_token):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        # a fresh scrape, or lines of a page that was half written before a crash, start the file over
+        mode = 'a' if self.count else 'w'
+        if self.count and not self.checked:
+            self.truncate_comments()
+        self.checked = True
+        with open(self.comments_path, mode, encoding='utf-8') as file:
+            for comment in comments:
+                file.write(json.dumps(comment) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.page_token = next_page_token
+        self.count += len(comments)
+        self.pages += 1
+        temp_path = f'{self.state_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({'video_id': self.video_id, 'order': self.order, 'page_token': self.page_token,
+                       'count': self.count, 'pages': self.pages}, file)
+        os.replace(temp_path, self.state_path)
+
+    # Function to drop comment lines past the saved count
+    def truncate_comments(self):
+        with open(self.comments_path, 'rb+') as file:
+            for _ in range(self.count):
+                file.readline()
+            position = file.tell()
+            if file.readline():
+                file.seek(position)
+                file.truncate()
+
+    # Function to forget the progress once the video has been scraped to the end
+    def clear(self):
+        for path in (self.state_path, self.comments_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.page_token = None
+        self.count = 0
+        self.pages = 0
@@ -0,0 +1,299 @@
+# Long-running local HTTP service for sentiment scoring and POS tagging. The models are loaded once at startup and
+# stay resident, and comments from concurrent requests are coalesced into shared micro-batches: a batch is run
+# as soon as it holds max_batch_comments comments or the oldest waiting request is max_latency old.
+# Usage: python SentimentService.py [--port 8765] [--max-batch 256] [--max-latency-ms 10]
+#   curl -d '{"comments": ["great video", "so bad"]}' localhost:8765/sentiment
+#   curl -d '{"comments": ["great video"]}' localhost:8765/pos
+#   curl localhost:8765/health
+#   curl localhost:8765/metrics
+#   curl localhost:8765/metrics/prometheus
+import os
+import sys
+import json
+import time
+import queue
+import threading
+from collections import Counter, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import POSTagging
+import ModelRegistry
+import Metrics
+
+#needed for the ML_Anal
+sys.path.append(os.path.join(os.path.dirname(__file__), '../models/sentiment_analysis'))
+import ML_Anal
+
+label_names = {0: 'neutral', 1: 'positive', 2: 'negative'}
+
+# comments run through a model together at most
+max_batch_comments = 256
+# seconds a request may wait for other requests to fill its batch
+max_latency = 0.01
+# comments accepted in one request
+max_request_comments = 10000
+# request latencies kept for the percentiles in /metrics
+latency_window = 10000
+
+
+# A request waiting in a batcher, the batcher fills in result (or error) and sets done
+class Pending:
+    def __init__(self, comments):
+        self.comments = comments
+        self.arrived = time.perf_counter()
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+# Collects the comments of concurrent requests and runs them through run_batch together, on one thread, so the
+# models never run concurrently (the crfsuite tagger isn't thread safe) and every call gets a full batch
+class MicroBatcher:
+    def __init__(self, name, run_batch, batch_size=None, latency=None):
+        self.name = name
+        self.run_batch = run_batch
+        self.batch_size = batch_size or max_batch_comments
+        self.latency = latency if latency is not None else max_latency
+        self.requests = queue.Queue()
+        self.stats = Counter()
+        self.thread = threading.Thread(target=self.loop, name=f'{name}-batcher', daemon=True)
+        self.thread.start()
+
+    # Function to score comments, blocks until their batch has run
+    def submit(self, comments):
+        pending = Pending(comments)
+        self.requests.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def loop(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0].comments)
+            deadline = batch[0].arrived + self.latency
+            # keep collecting until the batch is full or the first request has waited long enough
+            while size < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    pending = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(pending)
+                size += len(pending.comments)
+            self.run(batch, size)
+
+    def run(self, batch, size):
+        comments = [comment for pending in batch for comment in pending.comments]
+        start_time = time.perf_counter()
+        try:
+            with Metrics.span(f'service.{self.name}_batch', comments=size, requests=len(batch)):
+                results = self.run_batch(comments)
+        except Exception as e:
+            for pending in batch:
+                pending.error = e
+                pending.done.set()
+            self.stats['errors'] += 1
+            return
+        self.stats['batches'] += 1
+        self.stats['requests'] += len(batch)
+        self.stats['comments'] += size
+        self.stats['busy_ms'] += round((time.perf_counter() - start_time) * 1000)
+        position = 0
+        for pending in batch:
+            pending.result = results[position:position + len(pending.comments)]
+            position += len(pending.comments)
+            pending.done.set()
+
+    def metrics(self):
+        batches = self.stats['batches']
+        return dict(self.stats, queued=self.requests.qsize(),
+                    mean_batch_comments=self.stats['comments'] / batches if batches else 0)
+
+
+# Function to score comments, returns the label and the class probabilities of every comment
+def score_batch(comments):
+    import numpy as np
+    results = []
+    for logits in ML_Anal.score_logits(comments):
+        scores = np.exp(np.array(logits) - max(logits))
+        probabilities = scores / scores.sum()
+        class_id = int(probabilities.argmax())
+        results.append({'label': label_names[class_id], 'class_id': class_id,
+                        'probabilities': {label_names[i]: round(float(p), 4) for i, p in enumerate(probabilities)}})
+    return results
+
+
+# Function to tag comments, returns the nouns and adjectives of every comment
+def tag_batch(comments):
+    found = []
+    POSTagging.count_nouns_adjectives(comments, POSTagging.get_model(), Counter(), Counter(), found)
+    return [{'nouns': nouns, 'adjectives': adjectives} for nouns, adjectives in found]
+
+
+class SentimentService:
+    def __init__(self, batch_size=None, latency=None):
+        self.started = time.time()
+        self.batchers = {
+            'sentiment': MicroBatcher('sentiment', score_batch, batch_size, latency),
+            'pos': MicroBatcher('pos', tag_batch, batch_size, latency)
+        }
+        self.latencies = {name: deque(maxlen=latency_window) for name in self.batchers}
+        self.status_codes = Counter()
+        self.lock = threading.Lock()
+
+    # Function to load every model before the first request, instead of on it
+    def warm_up(self):
+        start_time = time.perf_counter()
+        ML_Anal.get_backend()
+        ML_Anal.get_tokenizer()
+        POSTagging.get_model()
+        self.batchers['sentiment'].submit(['warm up'])
+        self.batchers['pos'].submit(['warm up'])
+        ModelRegistry.record('service warm up', time.perf_counter() - start_time)
+
+    def handle(self, name, comments):
+        start_time = time.perf_counter()
+        results = self.batchers[name].submit(comments)
+        with self.lock:
+            self.latencies[name].append(time.perf_counter() - start_time)
+        Metrics.count('service_requests', endpoint=name)
+        Metrics.count('service_comments', len(comments), endpoint=name)
+        return results
+
+    def health(self):
+        return {
+            'status': 'ok',
+            'uptime_s': round(time.time() - self.started, 1),
+            'backend': ML_Anal.backend_name,
+            'length_policy': f'{ML_Anal.length_policy}:{ML_Anal.max_tokens}',
+            'scoring_mode': ML_Anal.scoring_mode,
+            'pos_backend': POSTagging.pos_backend,
+            'models': {name: ModelRegistry.is_loaded(name) for name in ModelRegistry.loaders}
+        }
+
+    def metrics(self):
+        endpoints = {}
+        with self.lock:
+            for name, latencies in self.latencies.items():
+                ordered = sorted(latencies)
+                percentiles = {f'p{p}_ms': round(ordered[min(len(ordered) - 1, len(ordered) * p // 100)] * 1000, 2)
+                               for p in (50, 90, 99)} if ordered else {}
+                endpoints[name] = dict(self.batchers[name].metrics(), **percentiles)
+            status_codes = dict(self.status_codes)
+        result = {'endpoints': endpoints, 'status_codes': status_codes,
+                  'model_load_s': {name: round(seconds, 3) for name, seconds in ModelRegistry.load_times.items()}}
+        if ML_Anal.use_cache:
+            result['sentiment_cache'] = ML_Anal.get_cache().stats()
+        return result
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            with service.lock:
+                service.status_codes[status] += 1
+
+        def do_GET(self):
+            if self.path == '/health':
+                self.send_json(200, service.health())
+            elif self.path == '/metrics':
+                self.send_json(200, service.metrics())
+            elif self.path == '/metrics/prometheus':
+                data = Metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+            else:
+                self.send_json(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            name = self.path.strip('/')
+            if name not in service.batchers:
+                self.send_json(404, {'error': f'unknown path {self.path}'})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                comments = json.loads(self.rfile.read(length))['comments']
+                if not isinstance(comments, list) or not all(isinstance(comment, str) for comment in comments):
+                    raise ValueError('comments must be a list of strings')
+                if len(comments) > max_request_comments:
+                    raise ValueError(f'at most {max_request_comments} comments per request')
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {'error': f'bad request: {e}'})
+                return
+            try:
+                self.send_json(200, {'results': service.handle(name, comments)})
+            except Exception as e:
+                self.send_json(500, {'error': str(e)})
+
+        # one line per request is too much for a dashboard polling all day
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # many dashboard clients connect at once, the default backlog of 5 resets connections
+    request_queue_size = 128
+
+
+def serve(host='127.0.0.1', port=8765, batch_size=None, latency=None):
+    # span and counter totals for /metrics/prometheus, single spans would pile up in a server running for days
+    Metrics.max_spans = 0
+    Metrics.enable()
+    service = SentimentService(batch_size, latency)
+    print('Loading models...')
+    service.warm_up()
+    print(ModelRegistry.startup_report())
+    server = Server((host, port), make_handler(service))
+    print(f'Serving on http://{host}:{port} (POST /sentiment, POST /pos, GET /health, GET /metrics)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Serve sentiment scoring and POS tagging over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=max_batch_comments,
+                        help='comments run through a model together at most')
+    parser.add_argument('--max-latency-ms', type=float, default=max_latency * 1000,
+                        help='milliseconds a request waits for others to join its batch')
+    parser.add_argument('--backend', default=ML_Anal.backend_name, choices=['torch', 'torch-int8', 'onnx'])
+    parser.add_argument('--length-policy', default=ML_Anal.length_policy, choices=ML_Anal.length_policies)
+    parser.add_argument('--max-tokens', type=ML_Anal.parse_max_tokens, default=ML_Anal.max_tokens,
+                        help='tokens of a comment scored at once')
+    parser.add_argument('--scoring-mode', default=ML_Anal.scoring_mode, choices=ML_Anal.scoring_modes)
+    parser.add_argument('--student-confidence', type=float, default=ML_Anal.student_confidence,
+                        help='student confidence below which the tiered mode asks the fine-tuned model')
+    parser.add_argument('--pos-backend', default=POSTagging.pos_backend, choices=['crf', 'maxent'])
+    parser.add_argument('--no-sentiment-cache', action='store_true')
+    args = parser.parse_args()
+
+    ML_Anal.backend_name = args.backend
+    ML_Anal.length_policy = args.length_policy
+    ML_Anal.max_tokens = args.max_tokens
+    ML_Anal.scoring_mode = args.scoring_mode
+    ML_Anal.student_confidence = args.student_confidence
+    ML_Anal.use_cache = not args.no_sentiment_cache
+    POSTagging.pos_backend = args.pos_backend
+    serve(args.host, args.port, args.max_batch, args.max_latency_ms / 1000)
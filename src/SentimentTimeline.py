@@ -0,0 +1,228 @@
+# Sentiment over time: counts of neutral/positive/negative comments per hour and per day of publishing, for each
+# video. The stored timeline is the one record of a video's counts, every run adds to it: a full run counts the
+# Sentiment and PublishedAt columns of its comments file (one vectorized group-by, nothing is rescored), an
+# incremental run counts its new comments. The timeline keeps the IDs of the comments it counted, so a comment
+# seen by several runs, full or incremental, is counted once. Timelines of several videos are merged by adding
+# their counts.
+# Usage: python SentimentTimeline.py VIDEO_ID [VIDEO_ID ...] [--granularity day] [--since 2024-05-01]
+#   python SentimentTimeline.py VIDEO_ID --event 2024-05-01T18:00 --window 24
+import os
+import json
+from datetime import datetime, timezone
+import pyarrow as pa
+import pyarrow.compute as pc
+import CommentStore
+
+timeline_dir = '../data/timeline'
+
+label_names = {0: 'neutral', 1: 'positive', 2: 'negative'}
+
+# bucket of a comment = the start of its publish time ('2024-05-01T18:42:07Z' -> '2024-05-01T18' / '2024-05-01')
+granularities = {'hour': 13, 'day': 10}
+
+
+def timeline_path(video_id):
+    return os.path.join(timeline_dir, f'{video_id}.json')
+
+
+class Timeline:
+    def __init__(self, video_id=None):
+        self.video_id = video_id
+        # granularity -> bucket -> [neutral, positive, negative]
+        self.buckets = {granularity: {} for granularity in granularities}
+        # scored comments without a publish time, counted in the totals only
+        self.undated = [0, 0, 0]
+        # IDs of the comments counted so far
+        self.counted = set()
+
+    # Function to count comments, the IDs, publish times (ISO strings, None if unknown) and class IDs of the same
+    # comments. Comments counted before are skipped
+    def add(self, comment_ids, published_at, class_ids):
+        for comment_id, published, class_id in zip(comment_ids, published_at, class_ids):
+            if comment_id in self.counted:
+                continue
+            self.counted.add(comment_id)
+            if not published:
+                self.undated[class_id] += 1
+                continue
+            for granularity, length in granularities.items():
+                counts = self.buckets[granularity].setdefault(published[:length], [0, 0, 0])
+                counts[class_id] += 1
+
+    # Function to count a table with CommentID, PublishedAt and Sentiment columns, grouped by arrow instead of row
+    # by row. Comments counted before are skipped
+    def add_table(self, table):
+        table = table.filter(pc.is_valid(table.column('Sentiment')))
+        if self.counted:
+            counted = pc.is_in(table.column('CommentID'), value_set=pa.array(list(self.counted), pa.string()))
+            table = table.filter(pc.invert(pc.fill_null(counted, False)))
+        self.counted.update(comment_id for comment_id in table.column('CommentID').to_pylist() if comment_id)
+        published = table.column('PublishedAt')
+        sentiment = table.column('Sentiment').cast(pa.int64())
+        for granularity, length in granularities.items():
+            grouped = pa.table({'bucket': pc.utf8_slice_codeunits(published, 0, length), 'label': sentiment})
+            grouped = grouped.group_by(['bucket', 'label']).aggregate([([], 'count_all')])
+            for bucket, label, count in zip(*(grouped.column(name).to_pylist()
+                                              for name in ('bucket', 'label', 'count_all'))):
+                if bucket is None:
+                    # every granularity sees the same undated comments, count them once
+                    if granularity == 'hour':
+                        self.undated[label] += count
+                    continue
+                self.buckets[granularity].setdefault(bucket, [0, 0, 0])[label] += count
+
+    # Function to add the counts of another timeline (another video, the runs of one video count into one timeline)
+    def merge(self, other):
+        for granularity, buckets in other.buckets.items():
+            for bucket, counts in buckets.items():
+                own = self.buckets[granularity].setdefault(bucket, [0, 0, 0])
+                for label, count in enumerate(counts):
+                    own[label] += count
+        for label, count in enumerate(other.undated):
+            self.undated[label] += count
+        self.counted |= other.counted
+        return self
+
+    def totals(self):
+        totals = list(self.undated)
+        for counts in self.buckets['day'].values():
+            for label, count in enumerate(counts):
+                totals[label] += count
+        return dict(zip(label_names.values(), totals))
+
+    # Function to get the buckets between since and until (ISO times or prefixes, both included), oldest first
+    def query(self, granularity='day', since=None, until=None):
+        length = granularities[granularity]
+        since = since[:length] if since else None
+        until = until[:length] if until else None
+        rows = []
+        for bucket in sorted(self.buckets[granularity]):
+            if (since and bucket < since) or (until and bucket > until):
+                continue
+            rows.append(make_row(bucket, self.buckets[granularity][bucket]))
+        return rows
+
+    # Function to compare the window buckets before an event (ISO time) with the window buckets from it on
+    def shift(self, event, granularity='hour', window=24):
+        length = granularities[granularity]
+        seconds = 3600 if granularity == 'hour' else 86400
+        event_time = parse_time(event)
+        start = format_time(event_time.timestamp() - window * seconds)[:length]
+        event_bucket = format_time(event_time.timestamp())[:length]
+        end = format_time(event_time.timestamp() + window * seconds)[:length]
+        before = [0, 0, 0]
+        after = [0, 0, 0]
+        for bucket, counts in self.buckets[granularity].items():
+            if start <= bucket < event_bucket:
+                side = before
+            elif event_bucket <= bucket < end:
+                side = after
+            else:
+                continue
+            for label, count in enumerate(counts):
+                side[label] += count
+        before_row = make_row(start, before)
+        after_row = make_row(event_bucket, after)
+        change = {f'{name}_share': round(after_row[f'{name}_share'] - before_row[f'{name}_share'], 4)
+                  for name in label_names.values()}
+        return {'event': event, 'granularity': granularity, 'window': window,
+                'before': before_row, 'after': after_row, 'change': change}
+
+    def to_dict(self):
+        return {'video_id': self.video_id, 'buckets': self.buckets, 'undated': self.undated,
+                'counted': list(self.counted), 'updated_at': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}
+
+    @classmethod
+    def from_dict(cls, data):
+        timeline = cls(data.get('video_id'))
+        for granularity in granularities:
+            timeline.buckets[granularity] = data.get('buckets', {}).get(granularity, {})
+        timeline.undated = data.get('undated', [0, 0, 0])
+        timeline.counted = set(data.get('counted', []))
+        return timeline
+
+
+# Function to turn the counts of a bucket into a report row with the share of every label
+def make_row(bucket, counts):
+    total = sum(counts)
+    row = {'bucket': bucket, 'total': total}
+    for label, name in label_names.items():
+        row[name] = counts[label]
+        row[f'{name}_share'] = round(counts[label] / total, 4) if total else 0
+    return row
+
+
+def parse_time(text):
+    time = datetime.fromisoformat(text.replace('Z', '+00:00'))
+    return time if time.tzinfo else time.replace(tzinfo=timezone.utc)
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def load_timeline(video_id):
+    try:
+        with open(timeline_path(video_id), 'r', encoding='utf-8') as file:
+            return Timeline.from_dict(json.load(file))
+    except FileNotFoundError:
+        return Timeline(video_id)
+
+
+def save_timeline(timeline):
+    os.makedirs(timeline_dir, exist_ok=True)
+    path = timeline_path(timeline.video_id)
+    # write to a temporary file first, so a crash never corrupts the stored counts
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(timeline.to_dict(), file)
+    os.replace(temp_path, path)
+
+
+# Function to add the scored comments file of a video to its stored timeline, or with rebuild to replace the
+# stored timeline by the counts of the file
+def update_from_file(comments_file, video_id, rebuild=False):
+    table = CommentStore.read_table(comments_file)
+    timeline = Timeline(video_id) if rebuild else load_timeline(video_id)
+    if 'Sentiment' in table.column_names:
+        timeline.add_table(table.select(['CommentID', 'PublishedAt', 'Sentiment']))
+    save_timeline(timeline)
+    return timeline
+
+
+# Function to get the merged timeline of several videos, from their stored timelines
+def combined_timeline(video_ids):
+    timeline = Timeline(','.join(video_ids))
+    for video_id in video_ids:
+        timeline.merge(load_timeline(video_id))
+    return timeline
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show the sentiment of comments over time, from stored timelines')
+    parser.add_argument('videos', nargs='+', help='video IDs, the counts of several videos are added up')
+    parser.add_argument('--granularity', default='day', choices=list(granularities))
+    parser.add_argument('--since', default=None, help="first bucket shown, e.g. '2024-05-01'")
+    parser.add_argument('--until', default=None, help="last bucket shown, e.g. '2024-05-31T12'")
+    parser.add_argument('--event', default=None,
+                        help="compare the sentiment before and after this time, e.g. '2024-05-01T18:00Z'")
+    parser.add_argument('--window', type=int, default=24, help='buckets on each side of --event')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='rebuild the timelines from the comments files only, dropping the counts of comments '
+                             'no longer in them (no comments are rescored)')
+    args = parser.parse_args()
+
+    if args.rebuild:
+        for video_id in args.videos:
+            update_from_file(CommentStore.comments_path(video_id), video_id, rebuild=True)
+    timeline = combined_timeline(args.videos)
+    if args.event:
+        print(json.dumps(timeline.shift(args.event, args.granularity, args.window), indent=2))
+    else:
+        print(f'{"bucket":<14} {"total":>7} {"positive":>9} {"neutral":>9} {"negative":>9}')
+        for row in timeline.query(args.granularity, args.since, args.until):
+            print(f'{row["bucket"]:<14} {row["total"]:>7} {row["positive_share"]:>9.1%} '
+                  f'{row["neutral_share"]:>9.1%} {row["negative_share"]:>9.1%}')
+        print(f'Totals: {timeline.totals()}')
@@ -0,0 +1,123 @@
+# Shared text normalization and tokenization stage. Comments are cleaned in bulk with precompiled patterns,
+# and one pass of the Rust-backed DistilBERT fast tokenizer produces both the WordPiece IDs for the sentiment
+# model and the word tokens for POS tagging (taken from the tokenizer's word offsets, split like nltk)
+import re
+import threading
+import ModelRegistry
+import Metrics
+
+# compiled once, clean_comment used to compile it for every comment
+emoji_pattern = re.compile(
+    "["
+    u"\U0001F600-\U0001F64F"  # emoticons
+    u"\U0001F300-\U0001F5FF"  # symbols & pictographs
+    u"\U0001F680-\U0001F6FF"  # transport & map symbols
+    u"\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    u"\U00002702-\U000027B0"  # other symbols
+    u"\U000024C2-\U0001F251"
+    "]+", flags=re.UNICODE)
+# newlines become spaces (commas are kept, comments are stored in Arrow files, not CSV)
+whitespace_table = str.maketrans({'\n': ' ', '\r': ' '})
+
+# Longest sequence the sentiment model accepts
+max_length = 512
+
+
+# Function to clean one comment by removing emojis and newlines
+def clean_comment(text):
+    return emoji_pattern.sub('', text.translate(whitespace_table))
+
+
+# Function to clean many comments at once
+def clean_comments(texts):
+    sub = emoji_pattern.sub
+    return [sub('', text.translate(whitespace_table)) for text in texts]
+
+
+# Function to load the fast tokenizer, only goes to the network if it isn't cached locally yet
+def load_tokenizer():
+    from transformers import DistilBertTokenizerFast
+    try:
+        return DistilBertTokenizerFast.from_pretrained('distilbert-base-uncased', local_files_only=True)
+    except OSError:
+        return DistilBertTokenizerFast.from_pretrained('distilbert-base-uncased')
+
+
+def get_tokenizer():
+    return ModelRegistry.get('sentiment_tokenizer', load_tokenizer)
+
+
+# The fast tokenizer is shared by the POS and sentiment stages and isn't safe to call from two threads at once
+# (encoding and pad change its truncation and padding state), every call holds this lock
+tokenizer_lock = threading.Lock()
+
+
+# words the Penn Treebank splits although they contain no punctuation (gon na, wan na, can not)
+treebank_splits = {'cannot', 'gimme', 'gonna', 'gotta', 'lemme', 'wanna'}
+# abbreviations without an inner period that keep their period in the middle of a sentence
+abbreviations = {'mr', 'mrs', 'ms', 'dr', 'st', 'vs', 'etc', 'jr', 'sr', 'prof'}
+word_tokenizer = None
+
+
+# nltk's Treebank word tokenizer is only regular expressions, it needs no downloaded data
+def get_word_tokenizer():
+    global word_tokenizer
+    if word_tokenizer is None:
+        from nltk.tokenize import NLTKWordTokenizer
+        word_tokenizer = NLTKWordTokenizer()
+    return word_tokenizer
+
+
+# Function to rebuild the words of a comment from the tokenizer's word offsets, split like nltk.word_tokenize.
+# BERT splits at every punctuation character (e - mail, U . S ., $ 5 . 99), so offset spans that touch are
+# joined back into the whitespace-separated chunk they came from. A chunk that is one plain word is a word, the
+# others (and gonna/wanna) go through the Treebank rules of nltk, which keep e-mail, U.S., 5.99, 10/10 and ...
+# whole and split do n't, it 's and quotes. The case of the original text is kept, the CRF features need it
+def words_from_encoding(text, encoding):
+    chunks = []
+    for word_id, (start, end) in zip(encoding.word_ids, encoding.offsets):
+        if word_id is None:
+            continue
+        if chunks and start <= chunks[-1][1]:
+            chunks[-1][1] = max(chunks[-1][1], end)
+            chunks[-1][2] |= chunks[-1][3] != word_id
+            chunks[-1][3] = word_id
+        else:
+            chunks.append([start, end, False, word_id])
+    words = []
+    for index, (start, end, joined, _) in enumerate(chunks):
+        chunk = text[start:end]
+        if not joined and chunk.lower() not in treebank_splits:
+            words.append(chunk)
+            continue
+        tokens = get_word_tokenizer().tokenize(chunk)
+        # nltk cuts the final period of its input, which is right at the end of a sentence only. Inside a
+        # sentence an abbreviation keeps it (the U.S. team), like the sentence splitter of word_tokenize does
+        if (len(tokens) > 1 and tokens[-1] == '.' and index + 1 < len(chunks)
+                and ('.' in tokens[-2] or tokens[-2].lower() in abbreviations)):
+            tokens[-2:] = [tokens[-2] + '.']
+        words.extend(tokens)
+    return words
+
+
+# Function to tokenize comments in one pass, returns the word tokens and the WordPiece IDs of every comment
+def tokenize_comments(texts):
+    tokenizer = get_tokenizer()
+    texts = [str(text) for text in texts]
+    if not texts:
+        return [], []
+    # no truncation here, POS tagging needs every word, and the sentiment stage fits the IDs to its length policy
+    with Metrics.span('tokenize', comments=len(texts)):
+        with tokenizer_lock:
+            batch = tokenizer(texts, truncation=False, verbose=False)
+    words = []
+    input_ids = []
+    for text, encoding in zip(texts, batch.encodings):
+        words.append(words_from_encoding(text, encoding))
+        input_ids.append(encoding.ids)
+    return words, input_ids
+
+
+# Function to get only the word tokens of comments, for POS tagging
+def tokenize_words(texts):
+    return tokenize_comments(texts)[0]
@@ -1,34 +1,177 @@
-import matplotlib.pyplot as plt
+# Report of a video: word clouds of the top nouns and adjectives and the sentiment percentages. Reports are drawn
+# on a plain matplotlib Figure (Agg, no window), so they render headless in batch jobs. The words of the clouds
+# are drawn as text instead of a pasted bitmap, so the PDF stays vector and small at any DPI. Computing a
+# word-cloud layout is the slow part, so layouts are cached by frequency distribution, in memory and on disk.
+import os
+import re
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.font_manager import FontProperties
+from PIL import ImageFont
 from wordcloud import WordCloud
+from wordcloud.wordcloud import FONT_PATH
+import Metrics
 
-def visualize_data(top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage, yt_link, video_id):
-    # create word clouds from top nouns and adjectives
-    noun_wc = WordCloud(width=800, height=400, background_color='white').generate_from_frequencies(dict(top_nouns))
-    adj_wc = WordCloud(width=800, height=400, background_color='white').generate_from_frequencies(dict(top_adjectives))
+# resolution of the raster parts of a report (and of the whole report for png)
+dpi = 150
+report_format = 'pdf'
+# open a window with the report after saving it, blocks until the window is closed
+show_report = True
 
-    plt.figure(figsize=(8, 4.5))
+cloud_width = 800
+cloud_height = 400
+# layouts are computed on a canvas this much smaller and scaled up, the words are vector text either way
+layout_scale = 0.5
+layout_cache_dir = '../data/wordcloud_cache'
+layout_cache = {}
 
-    # title and YouTube video link
-    plt.suptitle("Comments Analysis Report", fontsize=18, fontweight='bold', y=0.85)
-    plt.figtext(0.5, 0.76, f"Video Link: {yt_link}", ha="center", fontsize=8, color="blue", url=yt_link)
+color_pattern = re.compile(r'rgb\((\d+), (\d+), (\d+)\)')
+
+
+def layout_key(frequencies):
+    # the order of equal counts doesn't change the cloud, so the key ignores it
+    items = sorted(frequencies.items(), key=lambda item: (-item[1], item[0]))
+    data = json.dumps([cloud_width, cloud_height, layout_scale, items])
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+# Function to get the layout of a word cloud, as [word, font size, x, y, rotated, color] in canvas pixels, where
+# (x, y) is the start of the baseline of the word
+def get_layout(frequencies):
+    if not frequencies:
+        return []
+    key = layout_key(frequencies)
+    if key in layout_cache:
+        Metrics.count('layout_cache_hits', store='memory')
+        return layout_cache[key]
+    path = os.path.join(layout_cache_dir, f'{key}.json')
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            layout_cache[key] = json.load(file)
+        Metrics.count('layout_cache_hits', store='disk')
+        return layout_cache[key]
+    except (OSError, ValueError):
+        pass
+    Metrics.count('layout_cache_misses')
+
+    width = int(cloud_width * layout_scale)
+    height = int(cloud_height * layout_scale)
+    # a fixed random_state, so the same frequencies always give the same cloud
+    cloud = WordCloud(width=width, height=height, background_color='white', random_state=0)
+    with Metrics.span('render.layout', words=len(frequencies)):
+        cloud.generate_from_frequencies(frequencies)
+    fonts = {}
+    layout = []
+    for (word, _), font_size, (y, x), orientation, color in cloud.layout_:
+        if font_size not in fonts:
+            fonts[font_size] = ImageFont.truetype(cloud.font_path, font_size)
+        # wordcloud gives the top left corner of the ink of the word, the ink box is relative to the baseline
+        left, top, right, _ = fonts[font_size].getbbox(word)
+        ascent = fonts[font_size].getmetrics()[0]
+        # rotated words read upwards, so they start at the bottom
+        if orientation is None:
+            x, y = int(x) - left, int(y) + ascent - top
+        else:
+            x, y = int(x) + ascent - top, int(y) + right
+        layout.append([word, font_size / layout_scale, x / layout_scale, y / layout_scale, orientation is not None,
+                       color])
+    layout_cache[key] = layout
+    os.makedirs(layout_cache_dir, exist_ok=True)
+    # write to a temporary file first, parallel renderers may compute the same layout
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump(layout, file)
+    os.replace(temp_path, path)
+    return layout
+
+
+def parse_color(color):
+    match = color_pattern.fullmatch(color)
+    return tuple(int(value) / 255 for value in match.groups()) if match else 'black'
+
+
+# Function to draw a word cloud layout as text on an axes
+def draw_cloud(axes, layout, font):
+    axes.set_xlim(0, cloud_width)
+    axes.set_ylim(cloud_height, 0)
+    axes.axis('off')
+    # pixels of the canvas to points of the figure
+    figure = axes.get_figure()
+    points_per_pixel = axes.get_position().width * figure.get_figwidth() * 72 / cloud_width
+    for word, font_size, x, y, rotated, color in layout:
+        axes.text(x, y, word, fontproperties=font, fontsize=font_size * points_per_pixel, color=parse_color(color),
+                  rotation=90 if rotated else 0, rotation_mode='anchor', ha='left', va='baseline')
+
+
+def build_figure(figure, top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage,
+                 yt_link):
+    font = FontProperties(fname=FONT_PATH)
 
-    # display the word clouds
-    plt.subplot(1, 2, 1)
-    plt.imshow(noun_wc)
-    plt.title("Top 100 Nouns")
-    plt.axis('off')
+    # title and YouTube video link
+    figure.suptitle("Comments Analysis Report", fontsize=18, fontweight='bold', y=0.85)
+    figure.text(0.5, 0.76, f"Video Link: {yt_link}", ha="center", fontsize=8, color="blue", url=yt_link)
 
-    plt.subplot(1, 2, 2)
-    plt.imshow(adj_wc)
-    plt.title("Top 100 Adjectives")
-    plt.axis('off')
+    # the word clouds, side by side with the 2:1 shape of the canvas
+    for left, title, words in ((0.08, "Top 100 Nouns", top_nouns), (0.54, "Top 100 Adjectives", top_adjectives)):
+        axes = figure.add_axes([left, 0.33, 0.38, 0.38 * figure.get_figwidth() / figure.get_figheight() / 2])
+        draw_cloud(axes, get_layout(dict(words)), font)
+        axes.set_title(title)
 
     # add sentiment percentages
     sentiment_text = (f"Positive: {positive_percentage:.0%} | "
                       f"Neutral: {neutral_percentage:.0%} | "
                       f"Negative: {negative_percentage:.0%}")
-    plt.figtext(0.5, 0.2, sentiment_text, ha="center", fontsize=12, bbox={"facecolor": "white", "alpha": 0.5, "pad": 5})
+    figure.text(0.5, 0.2, sentiment_text, ha="center", fontsize=12,
+                bbox={"facecolor": "white", "alpha": 0.5, "pad": 5})
+
+
+def report_path(video_id, output_dir='.'):
+    return os.path.join(output_dir, f"YouTube_Comments_Analysis_Report_{video_id}.{report_format}")
+
+
+# Function to render a report to a file without opening a window, returns the path
+def render_report(top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage, yt_link,
+                  video_id, output_dir='.'):
+    with Metrics.span('render.report', video_id=video_id):
+        figure = Figure(figsize=(8, 4.5))
+        build_figure(figure, top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage,
+                     yt_link)
+        path = report_path(video_id, output_dir)
+        figure.savefig(path, dpi=dpi)
+    return path
+
+
+def visualize_data(top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage, yt_link, video_id):
+    # save the report, and show it when there is someone to look at it
+    path = render_report(top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage,
+                         yt_link, video_id)
+    print(f'Report saved to {path}')
+    if show_report:
+        import matplotlib.pyplot as plt
+        figure = plt.figure(figsize=(8, 4.5))
+        build_figure(figure, top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage,
+                     yt_link)
+        plt.show()
+    return path
+
+
+def render_report_kwargs(report):
+    return render_report(**report)
+
+
+# Function to copy the settings into a worker process, spawned workers (Windows, macOS) only see the defaults
+def set_settings(settings):
+    globals().update(settings)
+
 
-    # save as pdf and show the plot
-    plt.savefig(f"YouTube_Comments_Analysis_Report_{video_id}.pdf", dpi=600)
-    plt.show()
+# Function to render many reports in parallel, each a dict of render_report arguments, returns their paths
+def render_reports(reports, workers=None):
+    reports = list(reports)
+    if workers == 1 or len(reports) < 2:
+        return [render_report(**report) for report in reports]
+    settings = {'dpi': dpi, 'report_format': report_format, 'layout_scale': layout_scale,
+                'layout_cache_dir': layout_cache_dir}
+    with ProcessPoolExecutor(workers, initializer=set_settings, initargs=(settings,)) as executor:
+        return list(executor.map(render_report_kwargs, reports))
@@ -1,14 +1,26 @@
+import time
+startup_time = time.perf_counter()
+
 import subprocess
 import os
+import argparse
+import ModelRegistry
 import AnalScraper  # Ensure this is correctly implemented
 import POSTagging
 import Visualization
+import Pipeline
+import PageCache
+import Incremental
+import Metrics
 
 #needed for the ML_Anal
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '../models/sentiment_analysis'))
 import ML_Anal
 
+# models are loaded lazily, so this is only the cost of the imports themselves
+ModelRegistry.record('imports', time.perf_counter() - startup_time)
+
 #get req.txt automatically
 def install_requirements(requirements_file):
     try:
@@ -44,26 +56,136 @@ def get_api_key():
     return api_key
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description='YouTube Sentiment Analyzer')
+    parser.add_argument('--install-requirements', action='store_true',
+                        help='pip install -r req.txt before running (no longer done on every run)')
+    parser.add_argument('--startup-profile', action='store_true',
+                        help='print the time spent in imports and in loading each model')
+    parser.add_argument('--backend', default=ML_Anal.backend_name, choices=['torch', 'torch-int8', 'onnx'],
+                        help='sentiment inference backend')
+    parser.add_argument('--length-policy', default=ML_Anal.length_policy, choices=ML_Anal.length_policies,
+                        help='how comments longer than --max-tokens are scored: cut, head and tail kept, or the '
+                             'averaged logits of every window')
+    parser.add_argument('--max-tokens', type=ML_Anal.parse_max_tokens, default=ML_Anal.max_tokens,
+                        help='tokens of a comment scored at once (see benchmarks/LengthPolicyEval.py)')
+    parser.add_argument('--scoring-mode', default=ML_Anal.scoring_mode, choices=ML_Anal.scoring_modes,
+                        help="'tiered' scores with the distilled student and sends only the comments it is unsure "
+                             "about to the fine-tuned model (train the student with Distillation.py first)")
+    parser.add_argument('--student-confidence', type=float, default=ML_Anal.student_confidence,
+                        help='student confidence below which --scoring-mode tiered asks the fine-tuned model')
+    parser.add_argument('--no-sentiment-cache', action='store_true',
+                        help='always run the sentiment model instead of reusing cached predictions')
+    parser.add_argument('--page-cache-ttl', type=float, default=0,
+                        help='hours a cached page of API results is replayed instead of refetched (default 0, off: a '
+                             'replayed page misses the comments posted since it was cached)')
+    parser.add_argument('--pos-workers', type=int, default=1,
+                        help='processes used for POS tagging (default 1, tags in this process)')
+    parser.add_argument('--pos-backend', default=POSTagging.pos_backend, choices=['crf', 'maxent'],
+                        help="POS tagger: 'crf' (more accurate) or 'maxent' (vectorized, faster)")
+    parser.add_argument('--pos-lexicon', action='store_true',
+                        help='tag unambiguous words from models/pos_tagging/pos_lexicon.pkl without the CRF '
+                             '(faster, slightly less accurate)')
+    parser.add_argument('--word-tokenizer', default=POSTagging.word_tokenizer, choices=['fast', 'nltk'],
+                        help="word splitting for POS tagging: 'fast' (DistilBERT fast tokenizer offsets) or 'nltk'")
+    parser.add_argument('--wait-for-quota', action='store_true',
+                        help='when the API quota runs out, wait for the daily reset instead of stopping '
+                             '(a stopped scrape continues from its last page on the next run either way)')
+    parser.add_argument('--near-duplicates', action='store_true',
+                        help='also drop near-duplicate comments (bot floods with small changes), not only exact '
+                             'duplicates')
+    parser.add_argument('--replies', action='store_true',
+                        help='also analyze the replies of every comment (not with --incremental)')
+    parser.add_argument('--reply-workers', type=int, default=8, help='reply threads fetched at the same time')
+    parser.add_argument('--headless', action='store_true',
+                        help='only save the report, without opening a window (for servers and scripts)')
+    parser.add_argument('--report-dpi', type=int, default=Visualization.dpi,
+                        help='resolution of the report (its text and word clouds are vector either way)')
+    parser.add_argument('--metrics', default=None,
+                        help='record where the time goes (spans, counters, peak memory) and write it to this file '
+                             '(OpenTelemetry JSON for .json, Prometheus text otherwise)')
+    parser.add_argument('--stream', action='store_true',
+                        help='scrape, tag and score at the same time instead of one step after the other')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only fetch and score comments posted since the last run and merge them into the '
+                             'stored aggregates of the video')
+    return parser.parse_args()
+
+
 def main():
-    
-    requirements_file = "../req.txt"
-    install_requirements(requirements_file)
+    args = parse_args()
+
+    if args.install_requirements:
+        requirements_file = "../req.txt"
+        install_requirements(requirements_file)
+    ML_Anal.backend_name = args.backend
+    ML_Anal.use_cache = not args.no_sentiment_cache
+    ML_Anal.length_policy = args.length_policy
+    ML_Anal.max_tokens = args.max_tokens
+    ML_Anal.scoring_mode = args.scoring_mode
+    ML_Anal.student_confidence = args.student_confidence
+    POSTagging.use_lexicon = args.pos_lexicon
+    POSTagging.pos_backend = args.pos_backend
+    POSTagging.word_tokenizer = args.word_tokenizer
+    AnalScraper.wait_for_quota = args.wait_for_quota
+    AnalScraper.near_duplicates = args.near_duplicates
+    Visualization.show_report = not args.headless
+    Visualization.dpi = args.report_dpi
+    if args.metrics:
+        Metrics.enable()
+
+    page_cache = PageCache.PageCache(ttl=args.page_cache_ttl * 3600) if args.page_cache_ttl > 0 else None
 
     api_key, video_url, num_comments = welcome_message()
 
-     # Call the scraper
-    print('Scraping...')
-    AnalScraper.run_scraper(api_key, video_url, num_comments)
-    
-    csv_path = AnalScraper.run_scraper(api_key, video_url, num_comments)
-    top_nouns, top_adjectives = POSTagging.pos_tagging(csv_path)
-
-    video_id = AnalScraper.extract_video_id(video_url)
-    print('Analyzing...')
-    comments_file = f'../data/Processed_Comments_{video_id}.csv'
-    positive_percentage, neutral_percentage, negative_percentage = ML_Anal.analyze_comments(comments_file, video_id)
+    if args.incremental:
+        print('Updating...')
+        video_id = AnalScraper.extract_video_id(video_url)
+        with Metrics.span('incremental', video_id=video_id):
+            (top_nouns, top_adjectives,
+             positive_percentage, neutral_percentage, negative_percentage) = Incremental.run_incremental(api_key,
+                                                                                                         video_url,
+                                                                                                         num_comments)
+    elif args.stream:
+        print('Scraping and analyzing...')
+        video_id = AnalScraper.extract_video_id(video_url)
+        try:
+            with Metrics.span('pipeline', video_id=video_id):
+                results = Pipeline.run_streaming(api_key, video_url, num_comments, page_cache=page_cache,
+                                                 replies=args.replies, reply_workers=args.reply_workers)
+        except AnalScraper.QuotaExceeded:
+            # the streaming pipeline doesn't save its progress, the whole video is analyzed again
+            print('Run again after the API quota resets (midnight Pacific time) to analyze the video')
+            return
+        top_nouns, top_adjectives, positive_percentage, neutral_percentage, negative_percentage = results
+    else:
+        # Call the scraper
+        print('Scraping...')
+        try:
+            with Metrics.span('scrape'):
+                comments_file = AnalScraper.run_scraper(api_key, video_url, num_comments, page_cache, args.replies,
+                                                        args.reply_workers)
+        except AnalScraper.QuotaExceeded:
+            print('Run again after the API quota resets (midnight Pacific time) to continue scraping')
+            return
+        with Metrics.span('pos'):
+            top_nouns, top_adjectives = POSTagging.pos_tagging(comments_file, args.pos_workers)
+
+        video_id = AnalScraper.extract_video_id(video_url)
+        print('Analyzing...')
+        with Metrics.span('sentiment'):
+            positive_percentage, neutral_percentage, negative_percentage = ML_Anal.analyze_comments(comments_file,
+                                                                                                    video_id)
     print('Visualizing...')
-    Visualization.visualize_data(top_nouns,top_adjectives,positive_percentage, neutral_percentage, negative_percentage, video_url, video_id)
+    if ML_Anal.use_cache:
+        print(f'Sentiment cache: {ML_Anal.get_cache().stats()}')
+    if args.startup_profile:
+        print(ModelRegistry.startup_report())
+    with Metrics.span('render'):
+        Visualization.visualize_data(top_nouns,top_adjectives,positive_percentage, neutral_percentage, negative_percentage, video_url, video_id)
+    if args.metrics:
+        print(Metrics.summary())
+        print(f'Metrics saved to {Metrics.export(args.metrics)}')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules are flat scripts in src, imported the way they import each other
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../src'))
@@ -0,0 +1,25 @@
+# Length policies at the smallest --max-tokens, and values below it rejected on the command line
+import os
+import sys
+import argparse
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../models/sentiment_analysis'))
+import ML_Anal
+
+
+@pytest.mark.parametrize('value', ['0', '1', '2', '-5', 'many'])
+def test_max_tokens_too_small_are_rejected(value):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--max-tokens', type=ML_Anal.parse_max_tokens, default=ML_Anal.max_tokens)
+    with pytest.raises(SystemExit):
+        parser.parse_args(['--max-tokens', value])
+
+
+@pytest.mark.parametrize('policy', ML_Anal.length_policies)
+def test_policies_work_at_the_smallest_max_tokens(policy):
+    assert ML_Anal.parse_max_tokens('3') == 3
+    # [CLS] 10 11 12 13 [SEP]
+    windows, owners = ML_Anal.make_windows([[101, 10, 11, 12, 13, 102], [101, 20, 102]], policy, limit=3)
+    assert all(len(window) == 3 and window[0] == 101 and window[-1] == 102 for window in windows)
+    assert sorted(set(owners)) == [0, 1]
@@ -0,0 +1,54 @@
+# Metric types of the exports: counted totals get _total, collected sizes and ratios are gauges
+import pytest
+import Metrics
+
+
+@pytest.fixture(autouse=True)
+def enabled_metrics(monkeypatch):
+    monkeypatch.setattr(Metrics, 'collectors', {})
+    monkeypatch.setattr(Metrics, 'collector_gauges', {})
+    monkeypatch.setattr(Metrics, 'enabled', False)
+    Metrics.reset()
+    Metrics.enable()
+    yield
+    Metrics.reset()
+
+
+def register_cache():
+    Metrics.register_collector('test_cache', lambda: {'hits': 3, 'misses': 1, 'evictions': 0, 'entries': 42,
+                                                      'hit_rate': 0.75}, gauges=('entries', 'hit_rate'))
+
+
+def test_prometheus_gauges_have_no_total_suffix():
+    Metrics.count('api_comments', 100)
+    register_cache()
+    lines = Metrics.prometheus_text().splitlines()
+    assert '# TYPE ytca_api_comments_total counter' in lines
+    assert '# TYPE ytca_test_cache_total counter' in lines
+    assert 'ytca_test_cache_total{stat="hits"} 3' in lines
+    assert 'ytca_test_cache_total{stat="misses"} 1' in lines
+    assert 'ytca_test_cache_total{stat="evictions"} 0' in lines
+    assert '# TYPE ytca_test_cache_entries gauge' in lines
+    assert 'ytca_test_cache_entries 42' in lines
+    assert '# TYPE ytca_test_cache_hit_rate gauge' in lines
+    assert 'ytca_test_cache_hit_rate 0.75' in lines
+    assert not any('entries' in line and '_total' in line or 'hit_rate' in line and '_total' in line
+                   for line in lines)
+
+
+def test_otlp_gauges_are_not_monotonic_sums():
+    register_cache()
+    _, metrics = Metrics.otel_json()
+    exported = {metric['name']: metric for metric in metrics['resourceMetrics'][0]['scopeMetrics'][0]['metrics']}
+    assert exported['test_cache']['sum']['isMonotonic']
+    assert [point['attributes'][0]['value']['stringValue']
+            for point in exported['test_cache']['sum']['dataPoints']] == ['hits', 'misses', 'evictions']
+    assert exported['test_cache_entries']['gauge']['dataPoints'][0]['intValue'] == '42'
+    assert exported['test_cache_hit_rate']['gauge']['dataPoints'][0]['doubleValue'] == 0.75
+
+
+def test_a_collector_that_fails_reports_nothing():
+    def failing():
+        raise RuntimeError('cache never loaded')
+    Metrics.register_collector('broken_cache', failing, gauges=('entries',))
+    assert 'broken_cache' not in Metrics.prometheus_text()
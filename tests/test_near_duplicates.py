@@ -0,0 +1,54 @@
+# Near-duplicate filtering at the default settings: a flood of edited bot copies collapses, real comments that
+# only differ by a word or a number are kept
+import random
+import NearDuplicates
+
+flood_text = 'This is the best song of the decade, everyone needs to hear it at least once in their life'
+flood_edits = [lambda text, rng: f'{text} {rng.choice(["🔥", "❤️", "😍", "👍"])}',
+               lambda text, rng: text.upper(),
+               lambda text, rng: text.replace(',', '!!!'),
+               lambda text, rng: f'{text}!!',
+               lambda text, rng: text.replace('best', 'bestt'),
+               lambda text, rng: text.replace('decade', 'decad'),
+               lambda text, rng: f'{text} fr',
+               lambda text, rng: f'wow {text}']
+
+
+def keep(texts):
+    return NearDuplicates.NearDuplicateFilter().keep(texts)
+
+
+def test_a_flood_of_edited_copies_collapses():
+    rng = random.Random(0)
+    flood = [flood_text]
+    for _ in range(200):
+        text = flood_text
+        for edit in rng.sample(flood_edits, 2):
+            text = edit(text, rng)
+        flood.append(text)
+    kept = keep(flood)
+    assert kept[0]
+    assert sum(kept) <= 3
+
+
+def test_real_variants_survive():
+    variants = [
+        ('This song is absolutely amazing, I love it so much', 'This song is absolutely amazing, I hate it so much'),
+        ('Who is still listening to this masterpiece in 2024?', 'Who is still listening to this masterpiece in 2025?'),
+        ('Anyone here in 2024? This song never gets old, pure nostalgia',
+         'Anyone here in 2025? This song never gets old, pure nostalgia'),
+    ]
+    for first, second in variants:
+        assert keep([first, second]) == [True, True]
+
+
+def test_variants_survive_among_a_flood():
+    near_filter = NearDuplicates.NearDuplicateFilter()
+    love = 'This song is absolutely amazing, I love it so much'
+    flood = [f'{love}{"!" * count}' for count in range(50)] + [love.upper(), f'{love} 😍😍']
+    variants = [love.replace('love', 'hate'), 'Who is still listening to this masterpiece in 2024?',
+                'Who is still listening to this masterpiece in 2025?']
+    kept = near_filter.keep(flood[:25] + variants + flood[25:])
+    assert kept[25:28] == [True, True, True]
+    assert sum(kept) == 4
+    assert near_filter.dropped == len(flood) - 1
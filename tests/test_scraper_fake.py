@@ -0,0 +1,130 @@
+# Scraper checks against the local fault-injecting fake API (FakeYouTube): transient errors, quota exhaustion and
+# resuming, reply threads, and several videos fetched at once, also on a quota budget. No key or network needed:
+#   python -m pytest tests
+import os
+import pytest
+import AnalScraper
+import FakeYouTube
+import ScrapeState
+
+all_comments = float('inf')
+
+
+@pytest.fixture(autouse=True)
+def isolated_scraper(tmp_path, monkeypatch):
+    # resume state goes to a temporary folder, and retries don't sleep
+    monkeypatch.setattr(ScrapeState, 'default_state_dir', str(tmp_path / 'scrape_state'))
+    monkeypatch.setattr(AnalScraper, 'backoff_base', 0.0)
+    monkeypatch.setattr(AnalScraper, 'wait_for_quota', False)
+
+
+def fetch(youtube, video_id='video', max_comments=all_comments, **kwargs):
+    return AnalScraper.fetch_comments(youtube, video_id, max_comments, progress=False, **kwargs)
+
+
+def test_faults_return_the_same_comments_as_a_clean_run():
+    clean = fetch(FakeYouTube.FakeYouTube(950, reply_rate=0))
+    faulty_api = FakeYouTube.FakeYouTube(950, reply_rate=0, error_rate=0.3, seed=0)
+    faulty = fetch(faulty_api)
+    assert faulty_api.error_count > 0
+    assert faulty == clean
+    assert len(clean) == 950
+
+
+def test_resume_after_quota_matches_an_uninterrupted_run():
+    uninterrupted = fetch(FakeYouTube.FakeYouTube(950, reply_rate=0), resume=True)
+
+    # the quota runs out after 4 of the 10 pages
+    limited_api = FakeYouTube.FakeYouTube(950, reply_rate=0, quota=4)
+    with pytest.raises(AnalScraper.QuotaExceeded):
+        fetch(limited_api, resume=True)
+    limited_api.reset_quota(None)
+    resumed = fetch(limited_api, resume=True)
+
+    assert resumed == uninterrupted
+    assert len({comment['CommentID'] for comment in resumed}) == 950
+    # 4 pages before the quota ran out, 6 after it, plus the refused request
+    assert limited_api.request_count == 11
+
+
+def test_budget_stop_is_resumed_too():
+    uninterrupted = fetch(FakeYouTube.FakeYouTube(500, reply_rate=0))
+    youtube = FakeYouTube.FakeYouTube(500, reply_rate=0)
+    with pytest.raises(AnalScraper.QuotaExceeded):
+        fetch(youtube, resume=True, quota=AnalScraper.QuotaBudget(2))
+    assert fetch(youtube, resume=True, quota=AnalScraper.QuotaBudget(10)) == uninterrupted
+
+
+@pytest.mark.parametrize('damage', ['deleted', 'cut short'])
+def test_resume_without_the_saved_comments_starts_over(damage):
+    uninterrupted = fetch(FakeYouTube.FakeYouTube(500, reply_rate=0))
+    youtube = FakeYouTube.FakeYouTube(500, reply_rate=0)
+    with pytest.raises(AnalScraper.QuotaExceeded):
+        fetch(youtube, resume=True, quota=AnalScraper.QuotaBudget(3))
+    state = ScrapeState.PaginationState('video')
+    assert state.resumable()
+    if damage == 'deleted':
+        os.remove(state.comments_path)
+    else:
+        with open(state.comments_path, 'r+', encoding='utf-8') as file:
+            file.truncate(len(file.readline()))
+
+    requests = youtube.request_count
+    assert fetch(youtube, resume=True) == uninterrupted
+    # every page fetched again, from the first one
+    assert youtube.request_count - requests == 5
+    assert not os.path.exists(state.state_path)
+
+
+def test_reply_threads_are_complete():
+    youtube = FakeYouTube.FakeYouTube(300, reply_rate=0.5, max_replies=40, error_rate=0.1)
+    fetcher = AnalScraper.ReplyFetcher(lambda: youtube, workers=4)
+    try:
+        comments = fetch(youtube, reply_fetcher=fetcher)
+    finally:
+        fetcher.close()
+
+    threads = [comment for comment in comments if comment['ParentID'] is None]
+    assert len(threads) == 300
+    replies = {}
+    for comment in comments:
+        if comment['ParentID'] is not None:
+            replies.setdefault(comment['ParentID'], []).append(comment['CommentID'])
+    # threads with more than the 5 replies a page carries are in there, fetched with comments().list
+    assert any(len(ids) > 5 for ids in replies.values())
+    for thread in threads:
+        serial = int(thread['CommentID'].rsplit('.', 1)[1])
+        expected = [f'{thread["CommentID"]}.{index}' for index in range(youtube.reply_count('video', serial))]
+        assert replies.get(thread['CommentID'], []) == expected
+
+
+def test_many_videos_match_one_by_one_fetches():
+    video_ids = ['a', 'b', 'c', 'd', 'e']
+    youtube = FakeYouTube.FakeYouTube({'a': 250, 'b': 0, 'c': 100, 'd': 999, 'e': 42})
+    results = AnalScraper.fetch_many_videos(lambda: youtube, video_ids, all_comments, max_workers=3,
+                                            requests_per_second=0)
+    clean = FakeYouTube.FakeYouTube({'a': 250, 'b': 0, 'c': 100, 'd': 999, 'e': 42})
+    assert sorted(results) == video_ids
+    for video_id in video_ids:
+        assert results[video_id] == fetch(clean, video_id)
+    assert youtube.request_count == clean.request_count
+
+
+def test_many_videos_on_a_quota_budget_stop_cleanly():
+    video_ids = ['a', 'b', 'c', 'd']
+    youtube = FakeYouTube.FakeYouTube(250, reply_rate=0)
+    # 3 pages per video, the budget covers 2 videos and a page of a third
+    results = AnalScraper.fetch_many_videos(lambda: youtube, video_ids, all_comments, max_workers=2,
+                                            requests_per_second=0, quota_units=7)
+    assert youtube.request_count == 7
+    # only complete videos come back, the rest are left to resume
+    assert len(results) == 2
+    for video_id, comments in results.items():
+        assert len(comments) == 250
+
+    rest = [video_id for video_id in video_ids if video_id not in results]
+    resumed = AnalScraper.fetch_many_videos(lambda: youtube, rest, all_comments, max_workers=2,
+                                            requests_per_second=0, quota_units=100)
+    clean = FakeYouTube.FakeYouTube(250, reply_rate=0)
+    for video_id in rest:
+        assert resumed[video_id] == fetch(clean, video_id)
@@ -0,0 +1,55 @@
+# Full and incremental runs of a video add up to one stored timeline, and a comment seen by several runs is
+# counted once
+import pytest
+import CommentStore
+import SentimentTimeline
+
+
+@pytest.fixture(autouse=True)
+def isolated_timelines(tmp_path, monkeypatch):
+    monkeypatch.setattr(SentimentTimeline, 'timeline_dir', str(tmp_path / 'timeline'))
+
+
+def scored_file(path, comments):
+    CommentStore.write_comments([{'VideoID': 'video', 'CommentID': comment_id, 'PublishedAt': published,
+                                  'Comment': f'comment {comment_id}'} for comment_id, published, _ in comments],
+                                str(path))
+    CommentStore.add_columns(str(path), {'Sentiment': [label for _, _, label in comments]})
+    return str(path)
+
+
+full_comments = [('a', '2024-05-01T10:00:00Z', 1), ('b', '2024-05-01T11:30:00Z', 2), ('c', None, 0)]
+
+
+def test_full_runs_are_counted_once(tmp_path):
+    path = scored_file(tmp_path / 'full.arrow', full_comments)
+    SentimentTimeline.update_from_file(path, 'video')
+    SentimentTimeline.update_from_file(path, 'video')
+    timeline = SentimentTimeline.load_timeline('video')
+    assert timeline.totals() == {'neutral': 1, 'positive': 1, 'negative': 1}
+    assert timeline.buckets['hour'] == {'2024-05-01T10': [0, 1, 0], '2024-05-01T11': [0, 0, 1]}
+
+
+def test_incremental_and_full_runs_add_up(tmp_path):
+    path = scored_file(tmp_path / 'full.arrow', full_comments)
+    SentimentTimeline.update_from_file(path, 'video')
+
+    # an incremental run sees two new comments and one the full run counted
+    timeline = SentimentTimeline.load_timeline('video')
+    timeline.add(['d', 'e', 'a'], ['2024-05-02T09:00:00Z', '2024-05-02T09:10:00Z', '2024-05-01T10:00:00Z'],
+                 [1, 1, 1])
+    SentimentTimeline.save_timeline(timeline)
+    expected = {'neutral': 1, 'positive': 3, 'negative': 1}
+    assert SentimentTimeline.load_timeline('video').totals() == expected
+
+    # a later full run keeps the incremental counts and only adds the comments not counted yet
+    path = scored_file(tmp_path / 'later.arrow', full_comments + [('d', '2024-05-02T09:00:00Z', 1),
+                                                                  ('f', '2024-05-03T12:00:00Z', 2)])
+    SentimentTimeline.update_from_file(path, 'video')
+    timeline = SentimentTimeline.load_timeline('video')
+    assert timeline.totals() == {'neutral': 1, 'positive': 3, 'negative': 2}
+    assert timeline.buckets['day'] == {'2024-05-01': [0, 1, 1], '2024-05-02': [0, 2, 0], '2024-05-03': [0, 0, 1]}
+
+    # a rebuild counts the comments file only
+    timeline = SentimentTimeline.update_from_file(path, 'video', rebuild=True)
+    assert timeline.totals() == {'neutral': 1, 'positive': 2, 'negative': 2}